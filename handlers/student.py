@@ -1,15 +1,24 @@
 # handlers/student.py
 # 学生端/通用接口 Handler（已包含：/ping, /cos/info, /cos/test,
-# /submissions/create, /submissions/upload_image, /score/run, /results/<id>）
+# /submissions/create, /submissions/upload_image, /submissions/upload_ticket,
+# /submissions/finalize, /score/run, /results/<id>）
 import os
 import time
+import sys
 from handlers.common import ok, err
+from services import coldstart
 
-# /ping —— 健康检查 + 版本号
+# /ping —— 健康检查 + 版本号；?imports=1 附带冷启动 import 耗时报告；?routes=1 附带路由表诊断（重复/遮蔽的前缀）
 API_VERSION = os.getenv("API_VERSION", "2025-09-15-1")
 def ping(event, tail, query, body):
     # router: "new" 方便确认走到新路由；后续需要可删
-    return ok({"ok": True, "ver": API_VERSION, "time": int(time.time()), "router": "new"})
+    payload = {"ok": True, "ver": API_VERSION, "time": int(time.time()), "router": "new"}
+    if (query.get("imports") if query else "") in ("1", "true"):
+        payload["coldstart"] = coldstart.report()
+    if (query.get("routes") if query else "") in ("1", "true"):
+        index = sys.modules.get("index")
+        payload["routes"] = index.ROUTE_TABLE.report if index is not None else []
+    return ok(payload)
 
 # /cos/info —— 返回 COS 基本配置（仅读环境变量）
 def cos_info(event, tail, query, body):
@@ -18,24 +27,35 @@ def cos_info(event, tail, query, body):
       COS_BUCKET=eng-homework-1374188029
       COS_REGION=ap-beijing
       COS_TEMP_CRED=true  (如函数使用临时凭证)
-      ALLOWED_RESIGN_PREFIXES=tts/,submissions/,db/
+      ALLOWED_RESIGN_PREFIXES=tts/,submissions/,db/,media/
     """
     bucket = os.getenv("COS_BUCKET", "")
     region = os.getenv("COS_REGION", "ap-beijing")
     temp_cred = os.getenv("COS_TEMP_CRED", "").lower() in ("1", "true", "yes")
-    allowed = os.getenv("ALLOWED_RESIGN_PREFIXES", "tts/,submissions/,db/")
+    allowed = os.getenv("ALLOWED_RESIGN_PREFIXES", "tts/,submissions/,db/,media/")
 
     if not bucket:
         return err(500, "cos_not_configured", "COS_BUCKET is not set",
                    need=["COS_BUCKET", "COS_REGION"])
 
-    return ok({
+    payload = {
         "ok": True,
         "bucket": bucket,
         "region": region,
         "useTempCredential": temp_cred,
         "allowedResignPrefixes": [p.strip() for p in allowed.split(",") if p.strip()],
-    })
+    }
+    # ?stats=1：共享 COS 客户端的连接池复用统计 + 各类 key 的 GET 延迟分位（不会为此构造客户端）
+    if (query.get("stats") if query else "") in ("1", "true"):
+        from services import cos_client
+        payload["pool"] = cos_client.pool_stats()
+        payload["hedge"] = cos_client.hedge_stats()
+        payload["speech"] = cos_client.speech_stats()
+        if "services.results_bloom" in sys.modules:
+            payload["results_bloom"] = sys.modules["services.results_bloom"].stats()
+        if "services.submission_index" in sys.modules:
+            payload["submission_records"] = sys.modules["services.submission_index"].record_stats()
+    return ok(payload)
 
 # /cos/test —— 代理到 legacy（保持行为 100% 一致）
 def cos_test(event, tail, query, body):
@@ -61,6 +81,22 @@ def upload_images(event, tail, query, body):
         return err(500, "legacy_missing", f"index_legacy not importable: {e}")
     return index_legacy.main_handler(event, None)
 
+# /submissions/upload_ticket —— 代理到 legacy（返回预签名 PUT，前端直传 COS）
+def upload_ticket(event, tail, query, body):
+    try:
+        import index_legacy
+    except Exception as e:
+        return err(500, "legacy_missing", f"index_legacy not importable: {e}")
+    return index_legacy.main_handler(event, None)
+
+# /submissions/finalize —— 代理到 legacy（直传完成后记账）
+def finalize_submission(event, tail, query, body):
+    try:
+        import index_legacy
+    except Exception as e:
+        return err(500, "legacy_missing", f"index_legacy not importable: {e}")
+    return index_legacy.main_handler(event, None)
+
 # /score/run —— 代理到 legacy
 def score_run(event, tail, query, body):
     try:
@@ -1,8 +1,10 @@
 # handlers/student_inbox.py
 # 简易收件箱：db/inbox/<student_id>.ndjson
+# ?memberships=1 时附带学生所属老师/班级（走 services.roster 反向索引缓存）
 import json
 from handlers.common import ok, err
 from services import db_index
+from services import roster
 
 INBOX_DIR = "db/inbox"
 
@@ -13,8 +15,13 @@ def list_inbox(event, tail, query, body):
         return err("bad_request", "student_id required")
     path = f"{INBOX_DIR}/{student_id}.ndjson"
     try:
-        lines = db_index.read_lines(path, limit=limit)
-    except Exception:
-        lines = []
+        lines = db_index.read_lines(path, limit=limit)  # 不存在 → []；存储故障（重试后）→ 异常
+    except Exception as e:
+        return err(503, "storage_unavailable", f"{e}")
     items = [json.loads(x) for x in lines if x.strip()]
-    return ok({"items": items, "nextCursor": None})
+    payload = {"items": items, "nextCursor": None}
+    if (query.get("memberships") if query else "") in ("1", "true"):
+        m = roster.memberships_of_student(student_id)
+        payload["teachers"] = m.get("teachers", [])
+        payload["classes"] = m.get("classes", [])
+    return ok(payload)
@@ -4,11 +4,20 @@
 # - 依赖 services.db_index:  append_json_line, write_json, read_lines, read_json
 # - 新增：_push_inbox_for_students() 将作业投递到 db/inbox/<sid>.ndjson
 # - 在 publish_tts() 返回前，读取 body.target_students（可为空），并执行投递
+# - 名册读取走 services.roster（TTL 缓存 + 学生反向索引），/roster/save 负责写入
 
 import os, json, time, datetime
 from handlers.common import ok, err
 from services import db_index
 from services import cos_client
+from services import roster
+from services import sign_cache
+from services import retry
+from services import submission_index
+from services import db_unit
+from concurrent.futures import ThreadPoolExecutor
+
+PUBLISH_TTS_WORKERS = int(os.environ.get("PUBLISH_TTS_WORKERS", "4"))  # 不同文本并发合成的上限
 
 # ========= 小工具 =========
 
@@ -36,7 +45,7 @@ def _push_inbox_for_students(assignment: dict, target_students):
         if not sid:
             continue
         try:
-            db_index.append_json_line(f"db/inbox/{sid}.ndjson", rec)
+            db_index.append_json_line(f"db/inbox/{sid}.ndjson", rec, best_effort=True)
         except Exception:
             # 不阻断主流程；按需打印日志
             pass
@@ -58,6 +67,29 @@ def _mk_assignment_id():
     week = time.strftime("%G-W%V", time.gmtime())
     return f"a_{week}_{int(time.time()) & 0xfffffff:08x}"
 
+def _synthesize_unique(texts, tts: dict):
+    """
+    texts 逐条对应返回 [(cos_key, None) | (None, error)]。
+    相同缓存 key 的文本只调用一次 tts_synthesize_cached；不同 key 之间并发（PUBLISH_TTS_WORKERS）。
+    """
+    first = {}   # cos_key -> 首次出现的文本
+    keys = []
+    for t in texts:
+        k, _ = cos_client.tts_cache_key(t, tts)
+        first.setdefault(k, t)
+        keys.append(k)
+
+    def _one(k):
+        try:
+            return cos_client.tts_synthesize_cached(first[k], tts), None
+        except Exception as e:
+            return None, e
+
+    uniq = list(first)
+    with ThreadPoolExecutor(max_workers=max(1, min(PUBLISH_TTS_WORKERS, len(uniq) or 1))) as ex:
+        done = dict(zip(uniq, ex.map(db_unit.propagate(_one), uniq)))
+    return [done[k] for k in keys]
+
 # ========= 接口实现 =========
 
 def tts_preview(event, tail, query, body):
@@ -149,12 +181,10 @@ def publish_tts(event, tail, query, body):
         if speaker: obj["speaker"] = speaker
         items.append(obj)
 
-    # 2) 针对每条生成/复用 TTS（带最小重试）
+    # 2) 针对每条生成/复用 TTS：按缓存 key 去重（"Apple"/"apple " 同一指纹），每个 key 只合成一次再回填
     out = []
-    for it in items:
-        try:
-            cos_key = cos_client.tts_synthesize_cached(it["text"], tts)
-        except Exception as e:
+    for it, (cos_key, e) in zip(items, _synthesize_unique([it["text"] for it in items], tts)):
+        if e is not None:
             # SAFE：个别失败也不中断整个发布；前端仍可看到失败项
             out.append({**it, "audio_cos_key": None, "fileUrl": None, "tts_error": str(e)})
             continue
@@ -194,16 +224,18 @@ def publish_tts(event, tail, query, body):
         "items": out
     })
 
+    # 作业索引与详情必须先落盘：投递收件箱之后再失败，客户端重试会生成新作业并重复投递
+    try:
+        db_index.commit()
+    except Exception as e:
+        return err(503, "storage_unavailable", f"{e}")
+
     # 4) 发布时“投递”到学生收件箱（若未显式传，尝试读取名册）
     target_students = (body.get("target_students") or [])
     if not target_students:
-        # 兜底：若老师未传，尝试读取示例名册（最多 20 人）
+        # 兜底：若老师未传，读取老师名册（热容器内有 TTL 缓存，不截断人数）
         try:
-            roster_path = f"db/roster/teachers/{teacher_id}.json"
-            roster = db_index.read_json(roster_path)
-            target_students = [str(s.get("student_id", "")).strip() 
-                               for s in (roster.get("students") or []) if str(s.get("student_id", "")).strip()]
-            target_students = target_students[:20]
+            target_students = roster.student_ids_of_teacher(teacher_id)
         except Exception:
             target_students = []
 
@@ -219,8 +251,8 @@ def list_assignments(event, tail, query, body):
     teacher_id = (query.get("teacher_id") if query else "") or ""
     try:
         lines = db_index.read_lines("db/assignments.ndjson", limit=500)  # SAFE：上限 500
-    except Exception:
-        lines = []
+    except Exception as e:
+        return err(503, "storage_unavailable", f"{e}")  # 存储故障不要伪装成“没有作业”
     items = []
     for ln in lines:
         try:
@@ -235,8 +267,9 @@ def list_assignments(event, tail, query, body):
 
 def get_assignment(event, tail, query, body):
     """
-    GET /assignments/get/<id>
+    GET /assignments/get/<id>[?embed_urls=1]
     返回：{ ok:true, assignment:{...}, items:[...]} 或 { ok:false, error:"not_found" }
+    embed_urls=1：每个条目附带 signedUrl / signedExpiresIn（一次调用拿到全部直链，规则同 /cos/resign）
     """
     aid = (tail or "").strip("/").strip()
     if not aid:
@@ -245,21 +278,120 @@ def get_assignment(event, tail, query, body):
         data = db_index.read_json(f"db/assignments/{aid}.json")
     except Exception:
         return err("not_found", f"assignment {aid} not found")  # FIX：总是带 msg，避免参数错误
+    # 详情里的音频 key 都是发布时落过盘的：登记为已知存在，随后的 /cos/resign 可跳过 HEAD
+    sign_cache.mark_known_many(x.get("audio_cos_key") for x in (data.get("items") or []) if x.get("audio_cos_key"))
+
+    if (query.get("embed_urls") if query else "") in ("1", "true"):
+        try:
+            import index_legacy
+        except Exception as e:
+            return err(500, "legacy_missing", f"index_legacy not importable: {e}")
+        if not index_legacy.bearer_ok(event):
+            return err(401, "unauthorized", "bearer token required for embed_urls")
+        items = data.get("items") or []
+        signed = index_legacy.resign_many(x.get("audio_cos_key") for x in items if x.get("audio_cos_key"))
+        for x in items:
+            got = signed.get(x.get("audio_cos_key") or "")
+            if got and got.get("ok"):
+                x["signedUrl"] = got["fileUrl"]
+                x["signedExpiresIn"] = got["expires_in"]
     return ok(data)
 
+def assignment_stats(event, tail, query, body):
+    """
+    GET /assignments/stats[?assignment_id=a_xxx]
+    返回：{ ok:true, built_at, stats:{ <assignment_id>: {count, scored, avg_overall, wer:{...}} } }
+    数据来自列式快照 db/snapshots/results.col（由 index.snapshot_handler 定时重建）
+    """
+    from services import results_snapshot  # 延迟加载：只有看板用到
+    aid = ((query.get("assignment_id") if query else "") or "").strip()
+    try:
+        stats = results_snapshot.assignment_stats(aid or None)
+        built_at = results_snapshot.load([])["_built_at"]
+    except Exception as e:
+        if retry.is_not_found(e):
+            return err(404, "snapshot_missing", "results snapshot not built yet")
+        return err(503, "storage_unavailable", f"{e}")
+    return ok({"ok": True, "built_at": built_at, "stats": stats})
+
+def save_roster(event, tail, query, body):
+    """
+    POST /roster/save
+    入参：{ teacher_id, students:[{student_id, class_id?}, ...], class_id? }
+    返回：{ ok:true, teacher_id, added, removed, total }
+    说明：同时维护 db/roster/students/<sid>.json 反向索引
+    """
+    if not body:
+        return err(400, "bad_request", "missing body")
+    teacher_id = (body.get("teacher_id") or "").strip()
+    students = body.get("students")
+    need = []
+    if not teacher_id: need.append("teacher_id")
+    if not isinstance(students, list): need.append("students")
+    if need:
+        return err(400, "bad_request", "missing fields", need=need)
+
+    data = {"students": students}
+    if body.get("class_id"):
+        data["class_id"] = body.get("class_id")
+    try:
+        stats = roster.save_teacher_roster(teacher_id, data)
+    except Exception as e:
+        return err(500, "roster_save_failed", f"{e}")
+    return ok({"ok": True, "teacher_id": teacher_id, **stats})
+
 def list_submissions(event, tail, query, body):
     """
-    GET /submissions/list?assignment_id=... 或 ?teacher_id=...
-    简易占位：按需扩展
+    GET /submissions/list?assignment_id=...[&cursor=...&limit=50&status=scored&student_id=S001]
+    返回：{ ok:true, assignment_id, items:[{submission_id, student_id, status, created_at, ...}], nextCursor }
+    说明：读 assignment_id → 提交 的二级索引（services.submission_index），最近的在前；
+         nextCursor 非空时原样带回 cursor 取下一页
     """
-    return ok({"ok": True, "items": [], "nextCursor": None})
+    q = query or {}
+    aid = (q.get("assignment_id") or "").strip()
+    if not aid:
+        return err(400, "bad_request", "assignment_id required", need=["assignment_id"])
+    try:
+        limit = int(q.get("limit") or 50)
+    except ValueError:
+        return err(400, "bad_request", "limit must be an integer")
+    try:
+        page = submission_index.list_page(aid, cursor=q.get("cursor") or None, limit=limit,
+                                          status=(q.get("status") or "").strip() or None,
+                                          student_id=(q.get("student_id") or "").strip() or None)
+    except ValueError as e:
+        return err(400, "bad_cursor", f"{e}")
+    except Exception as e:
+        return err(503, "storage_unavailable", f"{e}")
+    return ok({"ok": True, "assignment_id": aid, **page})
 
 def get_submission(event, tail, query, body):
     """
     GET /submissions/get/<id>
-    简易占位：按需扩展
+    返回：{ ok:true, submission_id, status, submission:{...}, result:{...}|null }
+    说明：提交记录 db/submissions/<id>.json 与评分结果 db/results/<id>.json 并发读取（均走读穿缓存），
+         未评分时 result 为 null
     """
     sid = (tail or "").strip("/")
     if not sid:
-        return err("bad_request", "submission_id required in path")
-    return err("not_found", f"submission {sid} not found")
+        return err(400, "bad_request", "submission_id required in path")
+
+    def _result():
+        try:
+            return db_index.read_json_cached(f"db/results/{sid}.json")
+        except Exception as e:
+            if retry.is_not_found(e):
+                return None
+            raise
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f_rec = ex.submit(db_unit.propagate(submission_index.get_record), sid)
+        f_res = ex.submit(db_unit.propagate(_result))
+        try:
+            rec, res = f_rec.result(), f_res.result()
+        except Exception as e:
+            return err(503, "storage_unavailable", f"{e}")
+    if rec is None and res is None:
+        return err(404, "not_found", f"submission {sid} not found")
+    status = (res or {}).get("status") or (rec or {}).get("status") or "unknown"
+    return ok({"ok": True, "submission_id": sid, "status": status, "submission": rec, "result": res})
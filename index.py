@@ -1,44 +1,125 @@
 # index.py —— 超薄入口：先尝试新路由；没匹配就回退到旧入口
-import os, sys
+# 路由目标写成 "module:func" 字符串，首次命中才 import（冷启动只加载 router/coldstart）
+import os, sys, json
 # 兜底引入 lib/（qcloud_cos 等三方库）
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), "lib"))
 
-from router import route_with_fallback
-import index_legacy
+from services import coldstart
+from services import retry
+from services import db_unit
+from router import route_with_fallback, compile_routes
 
-# 既有模块
-from handlers import student_inbox
-from handlers import student
-from handlers import teacher
-from handlers import text_tools
-
-# 路由表（注意：更长前缀要放前面，避免被短前缀“吃掉”）
+# 路由表（按“最长前缀优先”匹配，与书写顺序无关；同一前缀重复注册时第一个生效）
 ROUTES = [
     # —— 学生端（公共/自检）——
-    ("GET",  "/ping",                     student.ping),
-    ("GET",  "/cos/info",                 student.cos_info),
-    ("GET",  "/cos/test",                 student.cos_test),
+    ("GET",  "/ping",                     "handlers.student:ping"),
+    ("GET",  "/cos/info",                 "handlers.student:cos_info"),
+    ("GET",  "/cos/test",                 "handlers.student:cos_test"),
 
-    ("POST", "/submissions/create",       student.create_submission),
-    ("POST", "/submissions/upload_image", student.upload_images),   # 注意：upload_images（复数）
-    ("GET",  "/student/inbox",            student_inbox.list_inbox),
-    ("POST", "/score/run",                student.score_run),
-    ("GET",  "/results/",                 student.get_result),      # /results/<submission_id>
+    ("POST", "/submissions/create",       "handlers.student:create_submission"),
+    ("POST", "/submissions/upload_image", "handlers.student:upload_images"),   # 注意：upload_images（复数）
+    ("POST", "/submissions/upload_ticket", "handlers.student:upload_ticket"),  # 预签名 PUT 直传票据
+    ("POST", "/submissions/finalize",     "handlers.student:finalize_submission"),
+    ("GET",  "/student/inbox",            "handlers.student_inbox:list_inbox"),
+    ("POST", "/score/run",                "handlers.student:score_run"),
+    ("GET",  "/results/",                 "handlers.student:get_result"),      # /results/<submission_id>
 
     # —— 老师端（全部直接指向 teacher 模块）——
-    ("POST", "/tts/preview",              teacher.tts_preview),
-    ("POST", "/assignments/publish_tts",  teacher.publish_tts),
-    ("POST", "/assignments/publish",      teacher.publish),
+    ("POST", "/tts/preview",              "handlers.teacher:tts_preview"),
+    ("POST", "/assignments/publish_tts",  "handlers.teacher:publish_tts"),
+    ("POST", "/assignments/publish",      "handlers.teacher:publish"),
     
-    ("GET",  "/assignments/list",         teacher.list_assignments),
-    ("GET",  "/assignments/get/",         teacher.get_assignment),  # /assignments/get/<id>
-    ("GET",  "/submissions/list",         teacher.list_submissions),
-    ("GET",  "/submissions/get/",         teacher.get_submission),  # /submissions/get/<id>
+    ("GET",  "/assignments/list",         "handlers.teacher:list_assignments"),
+    ("GET",  "/assignments/get/",         "handlers.teacher:get_assignment"),  # /assignments/get/<id>
+    ("GET",  "/submissions/list",         "handlers.teacher:list_submissions"),
+    ("GET",  "/submissions/get/",         "handlers.teacher:get_submission"),  # /submissions/get/<id>
+    ("GET",  "/assignments/stats",        "handlers.teacher:assignment_stats"), # 看板聚合（列式快照）
+    ("POST", "/roster/save",              "handlers.teacher:save_roster"),
     # —— 工具类 ——
-    ("POST", "/text/check_words",  text_tools.check_words),
-    ("POST", "/text/validate",     text_tools.validate),
+    ("POST", "/text/check_words",  "handlers.text_tools:check_words"),
+    ("POST", "/text/validate",     "handlers.text_tools:validate"),
 
 ]
 
+# 旧入口同样延迟加载（index_legacy 体量最大，/ping 等新路由完全用不到）
+LEGACY_HANDLER = "index_legacy:main_handler"
+
+# import 时编译一次；重复/重叠前缀等诊断见 /ping?routes=1
+ROUTE_TABLE = compile_routes(ROUTES)
+
+coldstart.record("import index", coldstart.since_start_ms())
+
+def _finish_db_unit(response):
+    """
+    刷出本次调用缓冲的写入；耗时写入响应头，非 best_effort 的写入失败改为 500。
+    有不可撤销副作用的 handler 应在副作用前调用 db_index.commit()（如 publish_tts 投递收件箱前），
+    这样这里改成 500 时客户端重试不会重复那些副作用。
+    """
+    # 有缓冲的写入说明 db_index 已加载；没加载就没有要刷的
+    db = sys.modules.get("services.db_index")
+    if db is None:
+        return response
+    report = db.flush_unit()
+    if not report["keys"]:
+        return response
+    fatal = [e for e in report["errors"] if not e["best_effort"]]
+    print(f"[db_flush] {json.dumps(report, ensure_ascii=False)}")
+    if fatal:
+        response = {"statusCode": 500, "headers": dict((response or {}).get("headers") or {}),
+                    "body": json.dumps({"ok": False, "error": "storage_flush_failed",
+                                        "keys": [e["key"] for e in fatal]}, ensure_ascii=False)}
+    if isinstance(response, dict):
+        headers = dict(response.get("headers") or {})  # 不要改动共享的 CORS 字典
+        headers.update({
+            "X-DB-Flush-Ms": str(report["ms"]),
+            "X-DB-Flush-Keys": str(report["keys"]),
+            "X-DB-Flush-Ops": str(report["ops"]),
+        })
+        response["headers"] = headers
+    return response
+
 def main_handler(event, context):
-    return route_with_fallback(event, context, ROUTES, index_legacy.main_handler)
+    retry.begin_invocation(context)  # 按 SCF 剩余时间设置本次调用的重试截止时刻
+    token = db_unit.begin()          # 组提交作用域：db_index 第一次写入时才建缓冲
+    try:
+        try:
+            response = route_with_fallback(event, context, ROUTE_TABLE, LEGACY_HANDLER)
+        except Exception:
+            _finish_db_unit(None)  # 已缓冲的写入照常落盘，异常原样抛出
+            raise
+        return _finish_db_unit(response)
+    finally:
+        db_unit.end(token)
+
+def prewarm_handler(event, context):
+    """
+    TTS 预热入口（单独配置为函数入口 index.prewarm_handler，可挂定时触发器）
+    event: { words?, combos?, recent?, dry_run?, workers? }，定时触发器放在 Message 里
+    """
+    retry.begin_invocation(context)
+    report = coldstart.timed_import("services.tts_prewarm").run_event(event)
+    print(f"[prewarm] {json.dumps({k: v for k, v in report.items() if k != 'errors'}, ensure_ascii=False)}")
+    return report
+
+def snapshot_handler(event, context):
+    """
+    结果列式快照重建入口（单独配置为函数入口 index.snapshot_handler，挂定时触发器）
+    顺带按提交表 + 结果表重建 /results 轮询用的索引（请求路径不写索引；触发周期决定 pending 回答的陈旧上限）
+    """
+    retry.begin_invocation(context)
+    report = coldstart.timed_import("services.results_snapshot").build()
+    try:
+        report["results_bloom"] = coldstart.timed_import("services.results_bloom").rebuild()
+    except Exception as e:
+        report["results_bloom"] = {"error": str(e)}
+    print(f"[snapshot] {json.dumps(report, ensure_ascii=False)}")
+    return report
+
+def spool_merge_handler(event, context):
+    """
+    spool 分段合并入口（单独配置为函数入口 index.spool_merge_handler，挂定时触发器；DB_SPOOL_KEYS 为空时无事可做）
+    """
+    retry.begin_invocation(context)
+    report = coldstart.timed_import("services.db_index").merge_spools()
+    print(f"[spool] {json.dumps(report, ensure_ascii=False)}")
+    return report
@@ -1,10 +1,18 @@
-# index.py — SCF 路由：TTS发布 / 学生提交(Base64) / 图片上传 / 评分(含STT失败友好) / 查询结果 / 重签URL / 诊断
-import os, sys, json, base64, time, urllib.request, urllib.parse, hashlib, uuid, datetime, re
+# index.py — SCF 路由：TTS发布 / 学生提交(Base64 或预签名直传) / 图片上传 / 评分(含STT失败友好) / 查询结果 / 重签URL / 诊断
+import os, sys, json, base64, binascii, time, urllib.request, urllib.parse, hashlib, uuid, datetime, re
+from concurrent.futures import ThreadPoolExecutor
 
 # 依赖与 index.py 同层时确保可 import
 sys.path.insert(0, os.path.dirname(__file__))
 
-from qcloud_cos import CosConfig, CosS3Client
+from services import sign_cache
+from services import cos_client
+from services import retry
+from services import speech_auth
+from services import db_index
+from services import submission_index
+from services import results_bloom
+from services import db_unit
 
 # ========= 配置 / CORS =========
 ALLOW_ORIGIN   = "*"
@@ -13,9 +21,37 @@ API_TOKEN      = os.environ.get("API_TOKEN")                # 若设置，要求
 DEFAULT_VOICE  = os.environ.get("DEFAULT_VOICE", "en-US-JennyNeural")
 DEFAULT_LANG   = os.environ.get("DEFAULT_LANG", "en-US")    # STT 默认语言
 RESIGN_EXPIRES = int(os.environ.get("RESIGN_EXPIRES", "3600"))  # /cos/resign 链接有效期（秒）
+# 批量重签：单次最多 key 数 / HEAD 并发数
+RESIGN_BATCH_MAX     = int(os.environ.get("RESIGN_BATCH_MAX", "200"))
+RESIGN_BATCH_WORKERS = int(os.environ.get("RESIGN_BATCH_WORKERS", "8"))
+# 重签前是否 HEAD 校验对象存在：always / known（已知存在的 key 跳过）/ never
+RESIGN_HEAD_MODE = (os.environ.get("RESIGN_HEAD_MODE") or "known").strip().lower()
 # 仅允许这些前缀的对象被重签，防止任意对象重签
 ALLOWED_RESIGN_PREFIXES = [p.strip() for p in os.environ.get("ALLOWED_RESIGN_PREFIXES", "tts/,submissions/,db/").split(",") if p.strip()]
 
+# 大提交流式处理：Base64 分块解码 → COS 分块上传，内存峰值≈一个分块，不随体积增长
+STREAM_UPLOAD_MIN_MB = int(os.environ.get("STREAM_UPLOAD_MIN_MB", "1"))  # 解码后 ≥ 该值走分块上传
+COS_PART_MB          = int(os.environ.get("COS_PART_MB", "1"))           # COS 要求非末块 ≥ 1MB
+B64_CHUNK_CHARS      = 256 * 1024                                         # 每次解码的 Base64 字符数（4 的倍数）
+
+# 内容寻址去重：提交媒体按 sha256 存到 media/<sha256><ext>，提交路径下只写一个小 JSON 引用
+# 开启后 cos_key 指向 media/：只有开启时才把 media/ 加进 ALLOWED_RESIGN_PREFIXES（含显式配置的情况），
+# 关闭时 media/ 不可重签
+MEDIA_DEDUP  = os.environ.get("MEDIA_DEDUP", "").lower() in ("1", "true", "yes")
+MEDIA_PREFIX = "media/"
+if MEDIA_DEDUP and MEDIA_PREFIX not in ALLOWED_RESIGN_PREFIXES:
+    ALLOWED_RESIGN_PREFIXES.append(MEDIA_PREFIX)
+
+# /submissions/upload_image 并发上传的线程数（与 COS 连接池大小相当即可）
+IMAGE_UPLOAD_WORKERS = int(os.environ.get("IMAGE_UPLOAD_WORKERS", "6"))
+
+# 直传（预签名 PUT）：票据有效期 / 单个对象体积上限（finalize 时按 HEAD 的 Content-Length 校验）
+UPLOAD_TICKET_EXPIRES = int(os.environ.get("UPLOAD_TICKET_EXPIRES", "900"))
+MAX_DIRECT_UPLOAD_MB  = int(os.environ.get("MAX_DIRECT_UPLOAD_MB", "50"))
+MAX_TICKET_IMAGES     = int(os.environ.get("MAX_TICKET_IMAGES", "20"))
+# 客户端自带的 submission_id 会拼进对象路径：只允许一个路径段内的安全字符
+SUBMISSION_ID_RE      = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
 VERSION = os.environ.get("API_VERSION", "2025-09-15-1")
 
 def resp(status, data):
@@ -62,7 +98,8 @@ def tts_azure(text, voice=DEFAULT_VOICE, fmt="audio-16khz-32kbitrate-mono-mp3"):
 </speak>""".encode("utf-8")
 
     req = urllib.request.Request(url, data=ssml, method="POST")
-    req.add_header("Ocp-Apim-Subscription-Key", key)
+    for k, v in speech_auth.auth_headers(key, region).items():
+        req.add_header(k, v)
     req.add_header("Content-Type", "application/ssml+xml")
     req.add_header("X-Microsoft-OutputFormat", fmt)
     with urllib.request.urlopen(req, timeout=20) as r:
@@ -84,7 +121,8 @@ def stt_azure_bytes(audio_bytes: bytes, language: str = DEFAULT_LANG, content_ty
     url = f"https://{region}.stt.speech.microsoft.com/speech/recognition/conversation/cognitiveservices/v1?{q}"
 
     req = urllib.request.Request(url, data=audio_bytes, method="POST")
-    req.add_header("Ocp-Apim-Subscription-Key", key)
+    for k, v in speech_auth.auth_headers(key, region).items():
+        req.add_header(k, v)
     req.add_header("Content-Type", content_type)
     with urllib.request.urlopen(req, timeout=30) as r:
         raw = r.read().decode("utf-8", "ignore")
@@ -106,42 +144,131 @@ _SECRET_ID = os.environ.get("TENCENTCLOUD_SECRETID")
 _SECRET_KEY = os.environ.get("TENCENTCLOUD_SECRETKEY")
 _TOKEN     = os.environ.get("TENCENTCLOUD_SESSIONTOKEN")  # 执行角色会注入
 
-_cfg = CosConfig(
-    Region=_REGION,
-    SecretId=_SECRET_ID,
-    SecretKey=_SECRET_KEY,
-    Token=_TOKEN,
-    Scheme="https",
-)
-_cos = CosS3Client(_cfg)
+# 与 services.cos_client 共用同一个延迟构造的客户端（同一连接池 / TLS 会话）
+def _client():
+    return cos_client.get_client()
 
+# 基础读写统一走 services.cos_client（含退避重试、已知 key 登记）
 def cos_exists(key: str) -> bool:
+    return cos_client.cos_exists(key)
+
+def put_cos_bytes(key: str, blob: bytes, content_type: str = None):
+    cos_client.cos_put_bytes(key, blob, content_type=content_type)
+
+def put_cos_text(key: str, text: str, content_type: str = "application/json"):
+    cos_client.put_text(key, text, content_type=content_type)
+
+def b64_decoded_len(b64: str) -> int:
+    """按字符数估算解码后的字节数（不解码、不复制）"""
+    n = len(b64 or "")
+    pad = 2 if (b64 or "").endswith("==") else (1 if (b64 or "").endswith("=") else 0)
+    return max(0, n * 3 // 4 - pad)
+
+def iter_b64_decode(b64: str, validate: bool = False, chunk_chars: int = B64_CHUNK_CHARS):
+    """
+    分块解码 Base64，逐块 yield bytes。
+    validate=True：非字母表字符直接抛 binascii.Error（与 b64decode(validate=True) 一致）
+    validate=False：与 b64decode 默认行为一致，先丢弃非字母表字符再解码
+    """
+    carry = ""
+    for i in range(0, len(b64), chunk_chars):
+        piece = b64[i:i + chunk_chars]
+        if not validate:
+            piece = re.sub(r"[^A-Za-z0-9+/=]", "", piece)
+        piece = carry + piece
+        n = len(piece) // 4 * 4
+        carry = piece[n:]
+        if n:
+            yield base64.b64decode(piece[:n], validate=validate)
+    if carry:
+        # 剩余不足 4 个字符：交给 b64decode 报 Incorrect padding
+        yield base64.b64decode(carry, validate=validate)
+
+def put_cos_b64(key: str, b64: str, content_type: str = None, validate: bool = False) -> int:
+    """
+    Base64 → COS，返回写入字节数。
+    小对象：一次性解码 + put_object；大对象：分块解码 + cos_client.put_stream 分块上传（失败时 abort）。
+    Base64 非法时抛 binascii.Error / ValueError，由调用方映射为 bad_base64。
+    """
+    if b64_decoded_len(b64) < STREAM_UPLOAD_MIN_MB * 1024 * 1024:
+        blob = base64.b64decode(b64, validate=validate)
+        put_cos_bytes(key, blob, content_type=content_type)
+        return len(blob)
+
+    return cos_client.put_stream(key, iter_b64_decode(b64, validate=validate),
+                                 content_type=content_type, part_mb=COS_PART_MB)
+
+def store_media_b64(dst_key: str, b64: str, content_type: str = None, validate: bool = False) -> dict:
+    """
+    保存一份提交媒体，返回 { cos_key, size_bytes[, sha256, ref_key, deduped] }。
+    MEDIA_DEDUP 关闭：直接写 dst_key。
+    MEDIA_DEDUP 开启：内容写 media/<sha256><ext>（已存在则跳过上传），
+                     dst_key + ".ref.json" 写引用（便于按学生/周目录浏览），cos_key 返回 media 路径。
+    """
+    if not MEDIA_DEDUP:
+        return {"cos_key": dst_key, "size_bytes": put_cos_b64(dst_key, b64, content_type=content_type, validate=validate)}
+
+    blob = None
+    if b64_decoded_len(b64) < STREAM_UPLOAD_MIN_MB * 1024 * 1024:
+        blob = base64.b64decode(b64, validate=validate)
+        sha, size = hashlib.sha256(blob).hexdigest(), len(blob)
+    else:
+        # 大对象：先流式算哈希（内存恒定），命中则无需第二遍解码
+        h, size = hashlib.sha256(), 0
+        for chunk in iter_b64_decode(b64, validate=validate):
+            h.update(chunk)
+            size += len(chunk)
+        sha = h.hexdigest()
+
+    ext = os.path.splitext(dst_key)[1].lower()
+    media_key = f"{MEDIA_PREFIX}{sha}{ext}"
+    deduped = cos_exists(media_key)
+    if deduped:
+        sign_cache.mark_known(media_key)
+    else:
+        if blob is not None:
+            put_cos_bytes(media_key, blob, content_type=content_type)
+        else:
+            put_cos_b64(media_key, b64, content_type=content_type, validate=validate)
+
+    ref_key = dst_key + ".ref.json"
+    put_cos_text(ref_key, json.dumps({
+        "media_key": media_key,
+        "sha256": sha,
+        "size_bytes": size,
+        "content_type": content_type,
+        "created_at": datetime.datetime.utcnow().isoformat() + "Z"
+    }, ensure_ascii=False))
+    return {"cos_key": media_key, "size_bytes": size, "sha256": sha, "ref_key": ref_key, "deduped": deduped}
+
+def b64_is_valid(b64: str) -> bool:
+    """只校验不落盘（分块解码后丢弃），用于在判 too_large 前先判 bad_base64"""
     try:
-        _cos.head_object(Bucket=_BUCKET, Key=key)
+        for _ in iter_b64_decode(b64, validate=True):
+            pass
         return True
     except Exception:
         return False
 
-def put_cos_bytes(key: str, blob: bytes, content_type: str = None):
-    if content_type:
-        _cos.put_object(Bucket=_BUCKET, Key=key, Body=blob, ContentType=content_type)
-    else:
-        _cos.put_object(Bucket=_BUCKET, Key=key, Body=blob)
-
-def put_cos_text(key: str, text: str, content_type: str = "application/json"):
-    _cos.put_object(Bucket=_BUCKET, Key=key, Body=text.encode("utf-8"), ContentType=content_type)
+def head_cos(key: str):
+    """返回 head_object 结果；不存在/失败（重试后）返回 None"""
+    try:
+        return retry.call(_client().head_object, Bucket=_BUCKET, Key=key)
+    except Exception:
+        return None
 
 def get_cos_bytes(key: str) -> bytes:
-    obj = _cos.get_object(Bucket=_BUCKET, Key=key)
-    return obj["Body"].get_raw_stream().read()
+    # 走 get_bytes：db/results/ 等前缀在开启 COS_HEDGE_READS 时自动对冲
+    return cos_client.get_bytes(key)
 
-def sign_url(key: str, expires: int = 3600) -> str:
-    # 先拿到基础预签名
-    url = _cos.get_presigned_url(
-        Method="GET",
+def sign_url(key: str, expires: int = 3600, method: str = "GET", headers: dict = None) -> str:
+    # 先拿到基础预签名（method=PUT 用于前端直传；headers 参与签名，前端上传时须原样携带）
+    url = _client().get_presigned_url(
+        Method=method,
         Bucket=_BUCKET,
         Key=key,
         Expired=expires,
+        Headers=headers or {},
     )
     # 若是临时凭证，把 token 作为查询参数拼上（腾讯 COS 要求）
     if _TOKEN:
@@ -165,35 +292,29 @@ def week_prefix(student_id: str):
     y, w, _ = datetime.datetime.utcnow().isocalendar()
     return f"submissions/{student_id}/{y}-W{w:02d}/"
 
+def image_content_type(fn: str, mime: str = ""):
+    mime = (mime or "").strip()
+    if mime:
+        return mime
+    low = (fn or "").lower()
+    if low.endswith(".png"):
+        return "image/png"
+    if low.endswith((".jpg", ".jpeg")):
+        return "image/jpeg"
+    return None
+
+def audio_content_type(fn: str) -> str:
+    return "audio/wav" if (fn or "").lower().endswith(".wav") else "audio/mpeg"
+
+# 存储格式（gzip 分段 / 旧明文兼容）统一由 services.db_index 处理
 def ndjson_append(key: str, record: dict):
-    try:
-        old = get_cos_bytes(key)
-        buf = old + (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
-    except Exception:
-        buf = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
-    put_cos_bytes(key, buf, content_type="application/x-ndjson")
+    db_index.append_json_line(key, record)
 
 def ndjson_all(key: str):
-    try:
-        raw = get_cos_bytes(key).decode("utf-8", "ignore")
-        return [json.loads(line) for line in raw.splitlines() if line.strip()]
-    except Exception:
-        return []
+    return db_index.ndjson_all(key)
 
 def ndjson_upsert(key: str, id_field: str, id_value: str, updater):
-    items = ndjson_all(key)
-    found = False
-    for it in items:
-        if it.get(id_field) == id_value:
-            updater(it)
-            found = True
-            break
-    if not found:
-        it = {id_field: id_value}
-        updater(it)
-        items.append(it)
-    text = "\n".join(json.dumps(x, ensure_ascii=False) for x in items) + "\n"
-    put_cos_text(key, text, content_type="application/x-ndjson")
+    db_index.upsert_json_line(key, id_field, id_value, updater)
 
 # ========= 文本对齐与打分（基线 WER）=========
 _word_re = re.compile(r"[A-Za-z']+")
@@ -286,6 +407,55 @@ def _extract_resign_key(event, path: str):
             return (vals[0] or "").strip()
     return ""
 
+def _resign_needs_head(key: str) -> bool:
+    """RESIGN_HEAD_MODE：always=每次 HEAD；known=已知存在的 key 跳过（默认）；never=从不 HEAD"""
+    if RESIGN_HEAD_MODE == "never":
+        return False
+    if RESIGN_HEAD_MODE == "known":
+        return not sign_cache.is_known(key)
+    return True
+
+def resign_key(key: str):
+    """
+    单个 key 重签，返回 (status, payload)，供 GET /cos/resign 与批量接口共用。
+    顺序：前缀白名单 → URL 缓存（纯内存）→ 必要时 HEAD → 签名并入缓存
+    """
+    if not any(key.startswith(p) for p in ALLOWED_RESIGN_PREFIXES):
+        return 403, {"ok": False, "error": "prefix_not_allowed", "allowed": ALLOWED_RESIGN_PREFIXES}
+    cached = sign_cache.get_url(key, RESIGN_EXPIRES)
+    if cached:
+        # 快路径：不 HEAD、不重新签名
+        return 200, {"ok": True, "key": key, "fileUrl": cached[0], "expires_in": cached[1]}
+    if _resign_needs_head(key) and not cos_exists(key):
+        return 404, {"ok": False, "error": "object_not_found"}
+    url = sign_url(key, expires=RESIGN_EXPIRES)
+    sign_cache.put_url(key, url, RESIGN_EXPIRES)
+    return 200, {"ok": True, "key": key, "fileUrl": url, "expires_in": RESIGN_EXPIRES}
+
+def resign_many(keys):
+    """
+    批量重签：返回 {key: payload}（payload 同 resign_key，失败项含 error）。
+    需要 HEAD 的 key 用线程池并发校验，其余纯内存完成。
+    """
+    uniq = []
+    for k in keys or []:
+        k = str(k or "").strip()
+        if k and k not in uniq:
+            uniq.append(k)
+    out = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(RESIGN_BATCH_WORKERS, len(uniq) or 1))) as pool:
+        for k, (_, payload) in zip(uniq, pool.map(db_unit.propagate(resign_key), uniq)):
+            out[k] = payload
+    return out
+
+def assignment_audio_keys(assignment_id: str):
+    """读取作业详情中的全部 audio_cos_key（同时登记为已知存在）"""
+    raw = get_cos_bytes(f"db/assignments/{assignment_id}.json").decode("utf-8", "ignore")
+    items = (json.loads(raw) or {}).get("items") or []
+    keys = [x.get("audio_cos_key") for x in items if x.get("audio_cos_key")]
+    sign_cache.mark_known_many(keys)
+    return keys
+
 # ========= 路由 =========
 def route(event):
     path = (event.get("path") or "/").rstrip("/")
@@ -314,7 +484,7 @@ def route(event):
             if not _BUCKET:
                 return resp(500, {"ok": False, "error": "COS_BUCKET env missing"})
             key = f"hello-{int(time.time())}.txt"
-            _cos.put_object(Bucket=_BUCKET, Key=key, Body=b"hello cos", ContentType="text/plain")
+            put_cos_bytes(key, b"hello cos", content_type="text/plain")
             url = sign_url(key, expires=600)
             return resp(200, {"ok": True, "key": key, "fileUrl": url})
         except Exception as e:
@@ -374,6 +544,153 @@ def route(event):
         except Exception as e:
             return resp(500, {"ok": False, "error": str(e)})
 
+    # 学生：申请直传票据 → 返回预签名 PUT URL（媒体字节不经过函数）
+    if path == "/submissions/upload_ticket" and method == "POST":
+        try:
+            if not bearer_ok(event):
+                return resp(401, {"ok": False, "error": "unauthorized"})
+            data = parse_json_body(event)
+            assignment_id = (data.get("assignment_id") or "").strip()
+            student_id    = (data.get("student_id") or "").strip()
+            audio         = data.get("audio")          # 可选：{ filename? }，传 true 也可
+            images        = data.get("images") or []   # 可选：[{ filename, mime? }, ...]
+
+            need = []
+            if not assignment_id: need.append("assignment_id")
+            if not student_id:    need.append("student_id")
+            if not (audio or images): need.append("audio_or_images")
+            if need:
+                return resp(400, {"ok": False, "error": "missing_fields", "need": need})
+            if not isinstance(images, list):
+                return resp(400, {"ok": False, "error": "images_must_be_list"})
+            if len(images) > MAX_TICKET_IMAGES:
+                return resp(413, {"ok": False, "error": "too_many_images", "limit": MAX_TICKET_IMAGES})
+
+            submission_id = str(data.get("submission_id") or "").strip() or uuid.uuid4().hex[:12]
+            if not SUBMISSION_ID_RE.fullmatch(submission_id):
+                return resp(400, {"ok": False, "error": "bad_submission_id"})
+            prefix = week_prefix(student_id)
+            out = {"ok": True, "submission_id": submission_id,
+                   "expires_in": UPLOAD_TICKET_EXPIRES, "max_mb": MAX_DIRECT_UPLOAD_MB}
+
+            if audio:
+                fn  = (audio.get("filename") if isinstance(audio, dict) else "") or "audio.mp3"
+                ext = ".wav" if fn.lower().endswith(".wav") else ".mp3"
+                key = prefix + f"{submission_id}{ext}"
+                hdr = {"Content-Type": audio_content_type(fn)}
+                out["audio"] = {"cos_key": key, "method": "PUT", "headers": hdr,
+                                "putUrl": sign_url(key, UPLOAD_TICKET_EXPIRES, method="PUT", headers=hdr)}
+
+            tickets = []
+            for i, item in enumerate(images):
+                item = item if isinstance(item, dict) else {}
+                # 以 / 结尾的文件名 basename 为空，退回默认名，避免生成以 / 结尾的 key
+                fn  = os.path.basename(str(item.get("filename") or "")) or f"img_{i+1}.jpg"
+                key = f"{prefix}images/{submission_id}/{fn}"
+                ct  = image_content_type(fn, item.get("mime"))
+                hdr = {"Content-Type": ct} if ct else {}
+                tickets.append({"index": i, "filename": fn, "cos_key": key, "method": "PUT", "headers": hdr,
+                                "putUrl": sign_url(key, UPLOAD_TICKET_EXPIRES, method="PUT", headers=hdr)})
+            if tickets:
+                out["images"] = tickets
+            return resp(200, out)
+        except Exception as e:
+            return resp(500, {"ok": False, "error": str(e)})
+
+    # 学生：直传完成 → 校验对象已落 COS → 记账（与 create / upload_image 相同的 ndjson）
+    if path == "/submissions/finalize" and method == "POST":
+        try:
+            if not bearer_ok(event):
+                return resp(401, {"ok": False, "error": "unauthorized"})
+            data = parse_json_body(event)
+            # 字段可能是数字等非字符串：统一转成字符串再校验（格式不对返回 400，而不是 500）
+            assignment_id = str(data.get("assignment_id") or "").strip()
+            student_id    = str(data.get("student_id") or "").strip()
+            submission_id = str(data.get("submission_id") or "").strip()
+            audio_key     = str(data.get("audio_cos_key") or "").strip()
+            # 空串直接丢弃、重复的只算一次
+            raw_keys      = data.get("image_cos_keys") or []
+            if not isinstance(raw_keys, list):
+                return resp(400, {"ok": False, "error": "image_cos_keys_must_be_list"})
+            image_keys    = list(dict.fromkeys(k for k in (str(k or "").strip() for k in raw_keys) if k))
+
+            need = []
+            if not assignment_id: need.append("assignment_id")
+            if not student_id:    need.append("student_id")
+            if not submission_id: need.append("submission_id")
+            if not (audio_key or image_keys): need.append("audio_cos_key_or_image_cos_keys")
+            if need:
+                return resp(400, {"ok": False, "error": "missing_fields", "need": need})
+            if not SUBMISSION_ID_RE.fullmatch(submission_id):
+                return resp(400, {"ok": False, "error": "bad_submission_id"})
+
+            # 只接受本学生、本提交的票据 key（与 upload_ticket 生成的路径逐段一致），防止拿别人的对象来记账；
+            # 周目录不限定当前周：跨周零点领票 / 提交也能通过
+            own = rf"submissions/{re.escape(student_id)}/\d{{4}}-W\d{{2}}/"
+            audio_ok = re.compile(own + re.escape(submission_id) + r"\.(mp3|wav)")
+            image_ok = re.compile(own + "images/" + re.escape(submission_id) + r"/[^/]+")
+            for k, pat in [(audio_key, audio_ok)] + [(k, image_ok) for k in image_keys]:
+                if k and not pat.fullmatch(k):
+                    return resp(403, {"ok": False, "error": "key_not_allowed", "key": k})
+
+            limit = MAX_DIRECT_UPLOAD_MB * 1024 * 1024
+            sizes = {}
+            for k in [audio_key] + image_keys:
+                if not k:
+                    continue
+                meta = head_cos(k)
+                if meta is None:
+                    return resp(404, {"ok": False, "error": "object_not_found", "key": k})
+                size = int(meta.get("Content-Length") or 0)
+                if size > limit:
+                    # 超限对象不记账也不留存：删掉，免得一直占着存储
+                    try:
+                        cos_client.delete_object(k)
+                    except Exception as e:
+                        print(f"[finalize] delete oversized {k} failed: {e}")
+                    return resp(413, {"ok": False, "error": "too_large", "limit_mb": MAX_DIRECT_UPLOAD_MB, "key": k})
+                sizes[k] = size
+
+            now = datetime.datetime.utcnow().isoformat() + "Z"
+            out = {"ok": True, "submission_id": submission_id}
+            if audio_key:
+                ndjson_append("db/submissions.ndjson", {
+                    "id": submission_id,
+                    "student_id": student_id,
+                    "assignment_id": assignment_id,
+                    "cos_key": audio_key,
+                    "status": "pending",
+                    "upload": "direct",
+                    "created_at": now
+                })
+                submission_index.record(assignment_id, submission_id, student_id=student_id,
+                                        status="pending", has_audio=True, created_at=now)
+                submission_index.save_record(submission_id, {
+                    "student_id": student_id, "assignment_id": assignment_id, "cos_key": audio_key,
+                    "status": "pending", "upload": "direct", "created_at": now})
+                out.update({"status": "pending", "cos_key": audio_key})
+            if image_keys:
+                ndjson_append("db/submissions_images.ndjson", {
+                    "submission_id": submission_id,
+                    "student_id": student_id,
+                    "assignment_id": assignment_id,
+                    "count": len(image_keys),
+                    "keys": image_keys,
+                    "prefix": image_keys[0].rsplit("/", 1)[0] + "/",
+                    "upload": "direct",
+                    "created_at": now
+                })
+                submission_index.record(assignment_id, submission_id, student_id=student_id,
+                                        images=image_keys, created_at=now)
+                submission_index.save_record(submission_id, {
+                    "student_id": student_id, "assignment_id": assignment_id,
+                    "images": image_keys, "created_at": now})
+                out["saved"] = [{"filename": k.rsplit("/", 1)[-1], "cos_key": k, "size_bytes": sizes[k]}
+                                for k in image_keys]
+            return resp(200, out)
+        except Exception as e:
+            return resp(500, {"ok": False, "error": str(e)})
+
     # 学生：提交作业（音频 Base64）→ COS → pending
     if path == "/submissions/create" and method == "POST":
         try:
@@ -401,7 +718,8 @@ def route(event):
             # 按扩展名推断 content-type，默认 mp3；前端若传 wav 建议扩展名 .wav
             ext = ".mp3"
             dst_key = week_prefix(student_id) + f"{submission_id}{ext}"
-            put_cos_bytes(dst_key, base64.b64decode(audio_b64), content_type="audio/mpeg")
+            stored  = store_media_b64(dst_key, audio_b64, content_type="audio/mpeg")
+            dst_key = stored["cos_key"]
 
             # 记录 meta（A 阶段：COS ndjson）
             meta_key = "db/submissions.ndjson"
@@ -413,10 +731,18 @@ def route(event):
                 "status": "pending",
                 "created_at": datetime.datetime.utcnow().isoformat() + "Z"
             }
+            if stored.get("ref_key"):
+                record["ref_key"] = stored["ref_key"]
+                record["sha256"] = stored["sha256"]
             ndjson_append(meta_key, record)
-
-            return resp(200, {"ok": True, "submission_id": submission_id,
-                              "status": "pending", "cos_key": dst_key})
+            submission_index.record(assignment_id, submission_id, student_id=student_id,
+                                    status="pending", has_audio=True, created_at=record["created_at"])
+            submission_index.save_record(submission_id, {k: v for k, v in record.items() if k != "id"})
+
+            out = {"ok": True, "submission_id": submission_id, "status": "pending", "cos_key": dst_key}
+            if "deduped" in stored:
+                out["deduped"] = stored["deduped"]
+            return resp(200, out)
         except Exception as e:
             return resp(500, {"ok": False, "error": str(e)})
 
@@ -441,38 +767,72 @@ def route(event):
             submission_id = (data.get("submission_id") or uuid.uuid4().hex[:12])
             base_prefix   = f"{week_prefix(student_id)}images/{submission_id}/"
 
-            saved = []
+            # 1) 顺序预检（不碰 COS）：缺字段 / 体积超限 / Base64 非法；有错时一张都不上传，
+            #    免得出错下标前后的图片成为没有记账的孤儿对象
+            plan, first_err = [], None
             for i, item in enumerate(images):
                 fn   = (item.get("filename") or f"img_{i+1}.jpg")
                 b64  = item.get("image_b64") or ""
                 mime = (item.get("mime") or "").strip()
                 if not b64:
-                    return resp(400, {"ok": False, "error": "missing_fields", "need": [f"images[{i}].image_b64"]})
-
+                    first_err = resp(400, {"ok": False, "error": "missing_fields", "need": [f"images[{i}].image_b64"]})
+                    break
+                # 先按字符数判体积（不解码）；超限时仍先判 bad_base64，保持原有错误优先级
+                if b64_decoded_len(b64) > MAX_UPLOAD_MB * 1024 * 1024:
+                    if not b64_is_valid(b64):
+                        first_err = resp(400, {"ok": False, "error": "bad_base64", "index": i})
+                    else:
+                        first_err = resp(413, {"ok": False, "error": "too_large", "limit_mb": MAX_UPLOAD_MB, "index": i})
+                    break
+                if not b64_is_valid(b64):
+                    first_err = resp(400, {"ok": False, "error": "bad_base64", "index": i})
+                    break
+                plan.append((i, fn, b64, image_content_type(fn, mime)))
+            if first_err:
+                return first_err
+
+            # 2) 并发解码 + 上传
+            def _upload_one(i, fn, b64, ct):
                 try:
-                    blob = base64.b64decode(b64, validate=True)
-                except Exception:
-                    return resp(400, {"ok": False, "error": "bad_base64", "index": i})
+                    stored = store_media_b64(base_prefix + fn, b64, content_type=ct, validate=True)
+                except (binascii.Error, ValueError):
+                    return None
+                item = {"filename": fn, "cos_key": stored["cos_key"], "size_bytes": stored["size_bytes"]}
+                if "deduped" in stored:
+                    item["deduped"] = stored["deduped"]
+                return item
 
-                if len(blob) > MAX_UPLOAD_MB * 1024 * 1024:
-                    return resp(413, {"ok": False, "error": "too_large", "limit_mb": MAX_UPLOAD_MB, "index": i})
-
-                key = base_prefix + fn
-                ct  = mime if mime else ("image/png" if fn.lower().endswith(".png")
-                                         else "image/jpeg" if fn.lower().endswith((".jpg",".jpeg"))
-                                         else None)
-                put_cos_bytes(key, blob, content_type=ct)
-                saved.append({"filename": fn, "cos_key": key, "size_bytes": len(blob)})
+            saved = []
+            workers = max(1, min(IMAGE_UPLOAD_WORKERS, len(plan)))
+            pool = ThreadPoolExecutor(max_workers=workers)
+            try:
+                futures = [pool.submit(db_unit.propagate(_upload_one), *p) for p in plan]
+                # 按下标顺序取结果：最小下标的错误（或异常）优先返回
+                for (i, _, _, _), fut in zip(plan, futures):
+                    item = fut.result()
+                    if item is None:
+                        return resp(400, {"ok": False, "error": "bad_base64", "index": i})
+                    saved.append(item)
+            finally:
+                # 出错返回时取消尚未开始的上传，不等它们跑完
+                pool.shutdown(wait=False, cancel_futures=True)
 
             meta_key = "db/submissions_images.ndjson"
+            now = datetime.datetime.utcnow().isoformat() + "Z"
             ndjson_append(meta_key, {
                 "submission_id": submission_id,
                 "student_id": student_id,
                 "assignment_id": assignment_id,
                 "count": len(saved),
+                "keys": [x["cos_key"] for x in saved],
                 "prefix": base_prefix,
-                "created_at": datetime.datetime.utcnow().isoformat() + "Z"
+                "created_at": now
             })
+            submission_index.record(assignment_id, submission_id, student_id=student_id,
+                                    images=[x["cos_key"] for x in saved], created_at=now)
+            submission_index.save_record(submission_id, {
+                "student_id": student_id, "assignment_id": assignment_id,
+                "images": [x["cos_key"] for x in saved], "created_at": now})
 
             return resp(200, {"ok": True, "submission_id": submission_id, "saved": saved})
         except Exception as e:
@@ -526,14 +886,21 @@ def route(event):
                     "error": "no_speech_or_invalid_audio"
                 }
                 res_key = f"db/results/{submission_id}.json"
-                put_cos_text(res_key, json.dumps(result, ensure_ascii=False))
+                db_index.write_json(res_key, result)  # 同时失效本容器的读穿缓存
                 ndjson_append("db/results.ndjson", {"submission_id": submission_id, "result_key": res_key,
-                                                    "overall": None, "scored_at": result["scored_at"], "status":"stt_failed"})
+                                                    "assignment_id": found.get("assignment_id"),
+                                                    "overall": None, "wer": None,
+                                                    "scored_at": result["scored_at"], "status":"stt_failed"})
                 def _upd_fail(it):
                     if it.get("id")==submission_id:
                         it["status"]="stt_failed"
                         it["result_key"]=res_key
                 ndjson_upsert("db/submissions.ndjson", "id", submission_id, _upd_fail)
+                submission_index.record(found.get("assignment_id"), submission_id, status="stt_failed",
+                                        scored_at=result["scored_at"])
+                submission_index.save_record(submission_id, {"status": "stt_failed", "result_key": res_key,
+                                                             "scored_at": result["scored_at"]})
+                results_bloom.mark_scored(submission_id)
                 return resp(200, {"ok": True, "status": "stt_failed", "submission_id": submission_id,
                                   "result_key": res_key, "result": result})
 
@@ -558,14 +925,22 @@ def route(event):
             }
 
             res_key = f"db/results/{submission_id}.json"
-            put_cos_text(res_key, json.dumps(result, ensure_ascii=False))
+            db_index.write_json(res_key, result)  # 同时失效本容器的读穿缓存
             ndjson_append("db/results.ndjson", {"submission_id": submission_id, "result_key": res_key,
-                                                "overall": scores["overall"], "scored_at": result["scored_at"], "status":"scored"})
+                                                "assignment_id": found.get("assignment_id"),
+                                                "overall": scores["overall"], "wer": round(wer, 4),
+                                                "scored_at": result["scored_at"], "status":"scored"})
             def _upd_ok(it):
                 if it.get("id")==submission_id:
                     it["status"]="scored"
                     it["result_key"]=res_key
             ndjson_upsert("db/submissions.ndjson", "id", submission_id, _upd_ok)
+            submission_index.record(found.get("assignment_id"), submission_id, status="scored",
+                                    overall=scores["overall"], scored_at=result["scored_at"])
+            submission_index.save_record(submission_id, {"status": "scored", "result_key": res_key,
+                                                         "overall": scores["overall"], "wer": round(wer, 4),
+                                                         "scored_at": result["scored_at"]})
+            results_bloom.mark_scored(submission_id)
 
             return resp(200, {"ok": True, "status": "scored", "submission_id": submission_id,
                               "result_key": res_key, "result": result})
@@ -577,6 +952,9 @@ def route(event):
         try:
             submission_id = path.split("/")[-1]
             res_key = f"db/results/{submission_id}.json"
+            # 过滤器确定“还没有结果”且状态表记着 pending：直接返回，省掉 HEAD 和全表扫描
+            if results_bloom.lookup(submission_id) == "pending":
+                return resp(200, {"ok": True, "status": "pending", "submission_id": submission_id})
             if not cos_exists(res_key):
                 subs = ndjson_all("db/submissions.ndjson")
                 found = next((x for x in subs if x.get("id")==submission_id), None)
@@ -588,6 +966,32 @@ def route(event):
         except Exception as e:
             return resp(500, {"ok": False, "error": str(e)})
 
+    # 批量重签：POST /cos/resign/batch  { keys:[...] } 或 { assignment_id }
+    # 一次调用返回整份作业的直链，省掉前端逐条 GET /cos/resign
+    if path == "/cos/resign/batch" and method == "POST":
+        try:
+            if not bearer_ok(event):
+                return resp(401, {"ok": False, "error": "unauthorized"})
+            data = parse_json_body(event)
+            keys = data.get("keys") or []
+            assignment_id = (data.get("assignment_id") or "").strip()
+            if not isinstance(keys, list):
+                return resp(400, {"ok": False, "error": "keys_must_be_list"})
+            if assignment_id:
+                try:
+                    keys = keys + assignment_audio_keys(assignment_id)
+                except Exception:
+                    return resp(404, {"ok": False, "error": "assignment_not_found"})
+            if not keys:
+                return resp(400, {"ok": False, "error": "missing_fields", "need": ["keys_or_assignment_id"]})
+            if len(keys) > RESIGN_BATCH_MAX:
+                return resp(413, {"ok": False, "error": "too_many_keys", "limit": RESIGN_BATCH_MAX})
+            signed = resign_many(keys)
+            items = [{"key": k, **{f: v for f, v in p.items() if f not in ("ok", "key")}} for k, p in signed.items()]
+            return resp(200, {"ok": True, "items": items, "expires_in": RESIGN_EXPIRES})
+        except Exception as e:
+            return resp(500, {"ok": False, "error": str(e)})
+
     # 重新签名：支持两种形态
     #   1) GET /cos/resign/<key...>   （推荐）
     #   2) GET /cos/resign?key=<key>
@@ -598,12 +1002,8 @@ def route(event):
             key = _extract_resign_key(event, path)
             if not key:
                 return resp(400, {"ok": False, "error": "key_required"})
-            if not any(key.startswith(p) for p in ALLOWED_RESIGN_PREFIXES):
-                return resp(403, {"ok": False, "error": "prefix_not_allowed", "allowed": ALLOWED_RESIGN_PREFIXES})
-            if not cos_exists(key):
-                return resp(404, {"ok": False, "error": "object_not_found"})
-            url = sign_url(key, expires=RESIGN_EXPIRES)
-            return resp(200, {"ok": True, "key": key, "fileUrl": url, "expires_in": RESIGN_EXPIRES})
+            status, payload = resign_key(key)
+            return resp(status, payload)
         except Exception as e:
             return resp(500, {"ok": False, "error": str(e)})
 
@@ -611,4 +1011,7 @@ def route(event):
     return resp(404, {"ok": False, "error": "not_found", "path": path, "method": method})
 
 def main_handler(event, context):
+    # 直接作为入口时（非经 index.py）同样设置截止时间；经 router 回退时 context 为同一个
+    if context is not None:
+        retry.begin_invocation(context)
     return route(event)
\ No newline at end of file
@@ -1,5 +1,6 @@
-# router.py —— 轻量路由：支持 method + 前缀匹配；采用“最长前缀优先”
+# router.py —— 轻量路由：支持 method + 前缀匹配；采用“最长前缀优先”（import 时编译为 dict + trie；目标可为 "module:func" 字符串，首次命中才 import）
 import json
+from services import coldstart
 
 def _parse_query(event):
     qs = event.get("queryString") or event.get("queryStringParameters") or {}
@@ -18,15 +19,123 @@ def _parse_body(event):
     except Exception:
         return {"_raw": body}
 
+# ========= 延迟加载的路由目标 =========
+
+class LazyTarget:
+    """
+    "package.module:func" 形式的路由目标：首次命中时才 import 并缓存函数，
+    /ping 之类的请求不会拖着 index_legacy / qcloud_cos 一起加载。
+    """
+    __slots__ = ("spec", "_fn")
+
+    def __init__(self, spec):
+        self.spec = spec
+        self._fn = None
+
+    def resolve(self):
+        if self._fn is None:
+            modname, _, attr = self.spec.partition(":")
+            self._fn = getattr(coldstart.timed_import(modname), attr)
+        return self._fn
+
+    def __call__(self, *args, **kwargs):
+        return self.resolve()(*args, **kwargs)
+
+    def __repr__(self):
+        return f"LazyTarget({self.spec!r})"
+
+_lazy_targets = {}  # spec -> LazyTarget（同一 spec 只解析一次）
+
+def lazy(target):
+    """字符串 → LazyTarget（按 spec 复用）；可调用对象原样返回"""
+    if not isinstance(target, str):
+        return target
+    lt = _lazy_targets.get(target)
+    if lt is None:
+        lt = _lazy_targets[target] = LazyTarget(target)
+    return lt
+
+# ========= 路由编译：精确路径 dict + 按方法的前缀 trie =========
+_END = ""  # trie 节点中存放路由条目的键（路径字符不会是空串）
+
+class CompiledRoutes:
+    """
+    由 [(method, prefix, handler), ...] 编译而来，import 时构建一次：
+      - exact[method][prefix] -> (prefix, handler)：路径恰好等于前缀时 O(1) 命中
+      - tries[method]：逐字符前缀树，沿路径走一遍即得“最长前缀”，O(len(path))，无排序、无临时列表
+      - report：重复/遮蔽/前缀重叠等诊断信息（list[dict]）
+    同一 method+prefix 重复注册时保留第一个（与旧的稳定排序行为一致）。
+    """
+    def __init__(self, routes):
+        self.exact = {}
+        self.tries = {}
+        self.report = []
+        for m, p, h in routes:
+            m = m.upper()
+            h = lazy(h)
+            table = self.exact.setdefault(m, {})
+            if p in table:
+                self.report.append({"type": "duplicate", "method": m, "prefix": p,
+                                    "detail": "shadowed by an earlier route with the same prefix"})
+                continue
+            table[p] = (p, h)
+            node = self.tries.setdefault(m, {})
+            for ch in p:
+                node = node.setdefault(ch, {})
+            node[_END] = (p, h)
+        # 前缀重叠：短前缀不以 / 结尾时，也会匹配到 "/xxx_foo" 这类路径，列出来供人工确认
+        for m, table in self.exact.items():
+            for p in table:
+                if p.endswith("/"):
+                    continue
+                for q in table:
+                    if q != p and q.startswith(p):
+                        self.report.append({"type": "prefix_overlap", "method": m, "prefix": p, "longer": q,
+                                            "detail": f"{p} also matches {p}<anything>; {q} wins only by being longer"})
+
+    def match(self, method, path):
+        """返回 (prefix, handler)；无匹配返回 None"""
+        hit = self.exact.get(method, {}).get(path)
+        if hit:
+            return hit
+        node = self.tries.get(method)
+        if node is None:
+            return None
+        best = node.get(_END)
+        for ch in path:
+            node = node.get(ch)
+            if node is None:
+                break
+            best = node.get(_END, best)
+        return best
+
+def compile_routes(routes):
+    return routes if isinstance(routes, CompiledRoutes) else CompiledRoutes(routes)
+
+# 兼容直接传 list 的调用方：id(list) -> (list 本身, CompiledRoutes)，首次使用时编译一次。
+# 持有 list 引用，id 不会被回收后复用；请求路径上只有一次 dict 查找，不再比对内容，
+# 之后原地修改 list 不会生效——路由表应在 import 时定型，推荐直接传 compile_routes() 的结果。
+_compiled_cache = {}
+
+def _table_for(routes):
+    if isinstance(routes, CompiledRoutes):
+        return routes
+    hit = _compiled_cache.get(id(routes))
+    if hit is not None and hit[0] is routes:
+        return hit[1]
+    table = CompiledRoutes(routes)
+    _compiled_cache[id(routes)] = (routes, table)
+    return table
+
 def route_with_fallback(event, context, routes, legacy_handler):
     method = (event.get("httpMethod") or event.get("requestContext", {}).get("http", {}).get("method") or "GET").upper()
     path = event.get("path") or event.get("requestContext", {}).get("path") or "/"
+    table = _table_for(routes)
 
-    # “最长前缀优先”筛选候选
-    candidates = [(m, p, h) for (m, p, h) in routes if m == method and path.startswith(p)]
-    if candidates:
-        # 选前缀最长的那个
-        m, p, handler = sorted(candidates, key=lambda x: len(x[1]), reverse=True)[0]
+    # “最长前缀优先”
+    hit = table.match(method, path)
+    if hit:
+        p, handler = hit
         tail = path[len(p):]  # 去掉前缀后的尾巴（可能为空或以 / 开头）
         query = _parse_query(event)
         body = _parse_body(event)
@@ -39,5 +148,5 @@ def route_with_fallback(event, context, routes, legacy_handler):
                 "body": json.dumps({"ok": False, "error": "handler_error", "message": str(e)})
             }
 
-    # 回退到旧入口
-    return legacy_handler(event, context)
+    # 回退到旧入口（同样支持 "module:func" 字符串，首次回退时才 import）
+    return lazy(legacy_handler)(event, context)
@@ -0,0 +1,130 @@
+# services/circuit.py
+# 熔断器 + 负缓存（进程内，热容器复用），用于外部服务（Azure 语音）降级时快速失败
+# - CircuitBreaker：连续 K 次“服务端类”失败（429/5xx/超时）后打开；打开期间直接抛 CircuitOpen；
+#   到期后进入半开，只放行 1 个探测请求，成功则关闭，失败则再次打开。429 的 Retry-After 会延长打开时长。
+# - NegativeCache：按指纹记住最近失败的请求，短时间内相同请求直接失败，不再占用函数时长。
+
+import os, time, threading
+import urllib.error
+
+class CircuitOpen(RuntimeError):
+    """熔断打开中：retry_after 为建议的重试等待秒数"""
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} circuit open, retry after {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def retry_after_of(e):
+    """从 HTTPError 中取 Retry-After（秒）；没有则 None"""
+    headers = getattr(e, "headers", None)
+    if not headers:
+        return None
+    try:
+        v = headers.get("Retry-After")
+        return float(v) if v else None
+    except Exception:
+        return None
+
+def is_provider_failure(e) -> bool:
+    """429 / 5xx / 网络超时 视为服务端降级；400/401 等请求自身问题不计入熔断"""
+    if isinstance(e, urllib.error.HTTPError):
+        return e.code == 429 or e.code >= 500
+    return isinstance(e, (urllib.error.URLError, TimeoutError, ConnectionError, OSError))
+
+class CircuitBreaker:
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 30.0,
+                 max_open: float = 300.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.max_open = max_open
+        self.state = "closed"        # closed / open / half_open
+        self.failures = 0
+        self.open_until = 0.0
+        self.opened = 0              # 累计打开次数（监控用）
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if self.state == "open" and now < self.open_until:
+                raise CircuitOpen(self.name, self.open_until - now)
+            # 到期：半开，只放行一个探测请求
+            if self._probing:
+                raise CircuitOpen(self.name, max(1.0, self.open_until - now))
+            self.state = "half_open"
+            self._probing = True
+
+    def on_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probing = False
+
+    def on_failure(self, retry_after: float = None):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                wait_s = min(self.max_open, max(self.reset_timeout, retry_after or 0))
+                self.state = "open"
+                self.open_until = time.monotonic() + wait_s
+                self.opened += 1
+            self._probing = False
+
+    def call(self, fn, *args, **kwargs):
+        self.before_call()
+        try:
+            out = fn(*args, **kwargs)
+        except Exception as e:
+            if is_provider_failure(e):
+                self.on_failure(retry_after_of(e))
+            else:
+                # 请求本身的问题（如 400）说明服务是通的；半开探测也算通过
+                self.on_success()
+            raise
+        self.on_success()
+        return out
+
+    def is_open(self) -> bool:
+        """打开且未到期（到期后等待半开探测的不算）"""
+        with self._lock:
+            return self.state == "open" and time.monotonic() < self.open_until
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            left = max(0.0, self.open_until - time.monotonic()) if self.state == "open" else 0.0
+            return {"name": self.name, "state": self.state, "failures": self.failures,
+                    "open_for_s": round(left, 1), "opened": self.opened}
+
+class NegativeCache:
+    """fingerprint -> (过期时刻, 错误信息)，容量有上限，超出时丢弃最早过期的"""
+    def __init__(self, ttl: float = 60.0, max_items: int = 2000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, fp: str):
+        with self._lock:
+            hit = self._items.get(fp)
+            if not hit:
+                return None
+            if hit[0] <= time.monotonic():
+                self._items.pop(fp, None)
+                return None
+            return hit[1]
+
+    def put(self, fp: str, message: str, ttl: float = None):
+        if (ttl if ttl is not None else self.ttl) <= 0:
+            return
+        with self._lock:
+            if len(self._items) >= self.max_items:
+                oldest = min(self._items, key=lambda k: self._items[k][0])
+                self._items.pop(oldest, None)
+            self._items[fp] = (time.monotonic() + (ttl if ttl is not None else self.ttl), message)
+
+    def discard(self, fp: str):
+        with self._lock:
+            self._items.pop(fp, None)
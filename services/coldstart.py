@@ -0,0 +1,29 @@
+# services/coldstart.py
+# 冷启动耗时登记：记录各模块 import / 客户端构造的耗时（毫秒），/ping?imports=1 可查看
+# 纯标准库，index.py 最先 import 它，保证自身开销可忽略
+
+import time, importlib, threading
+
+_T0 = time.perf_counter()   # 容器内第一次 import 本模块的时刻 ≈ 冷启动起点
+_lock = threading.Lock()
+_events = []                # [(name, ms, since_start_ms)]
+
+def record(name: str, ms: float):
+    with _lock:
+        _events.append((name, round(ms, 2), round(since_start_ms(), 2)))
+
+def since_start_ms() -> float:
+    """距冷启动起点（本模块首次 import）的毫秒数"""
+    return (time.perf_counter() - _T0) * 1000
+
+def timed_import(modname: str):
+    """import 并登记耗时；已加载过的模块几乎零开销"""
+    t = time.perf_counter()
+    mod = importlib.import_module(modname)
+    record(f"import {modname}", (time.perf_counter() - t) * 1000)
+    return mod
+
+def report() -> dict:
+    with _lock:
+        items = [{"name": n, "ms": ms, "at_ms": at} for n, ms, at in _events]
+    return {"uptime_ms": round(since_start_ms(), 2), "events": items}
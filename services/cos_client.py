@@ -1,8 +1,14 @@
 # services/cos_client.py
 # Azure TTS + COS 缓存工具（含 get_text/put_text 以兼容 db_index）
 
-import os, json, hashlib, urllib.request, html, re
-from qcloud_cos import CosConfig, CosS3Client
+import os, json, hashlib, urllib.request, urllib.error, html, re, time, threading, random, heapq
+from concurrent.futures import ThreadPoolExecutor
+from services import sign_cache
+from services import coldstart
+from services import retry
+from services import circuit
+from services import speech_auth
+from services.singleflight import SingleFlight
 
 # ===== COS 客户端 =====
 _REGION = os.environ.get("COS_REGION", "ap-beijing")
@@ -11,48 +17,497 @@ _SECRET_ID  = os.environ.get("TENCENTCLOUD_SECRETID")
 _SECRET_KEY = os.environ.get("TENCENTCLOUD_SECRETKEY")
 _TOKEN      = os.environ.get("TENCENTCLOUD_SESSIONTOKEN")
 
-_cfg = CosConfig(
-    Region=_REGION,
-    SecretId=_SECRET_ID,
-    SecretKey=_SECRET_KEY,
-    Token=_TOKEN,
-    Scheme="https",
-)
-_cos = CosS3Client(_cfg)
+# SDK 自带的重试是无退避的立即重试，与 services.retry 叠加会放大请求量，默认关闭
+COS_SDK_RETRY = int(os.environ.get("COS_SDK_RETRY", "0"))
+COS_TIMEOUT   = int(os.environ.get("COS_TIMEOUT", "10"))  # 单次请求超时（秒），配合截止时间预算约束尾延迟
+
+# 连接池大小：SDK 内置连接池在进程内所有 CosS3Client 间共享，以第一次构造时的配置为准
+COS_POOL_SIZE = int(os.environ.get("COS_POOL_SIZE", "16"))
+
+# 进程内唯一的 COS 客户端（新代码 / index_legacy / db_index 共用），首次真正访问 COS 时才构造
+_cos = None
+_client_lock = threading.Lock()
+_client_stats = {"builds": 0, "gets": 0}
+_stats_lock = threading.Lock()   # 模块内计数器（客户端 / lease）可能在多个线程里同时递增
+
+def _count(stats: dict, name: str) -> None:
+    with _stats_lock:
+        stats[name] += 1
+
+def get_client():
+    """共享 CosS3Client（延迟构造、线程安全）"""
+    global _cos
+    _count(_client_stats, "gets")
+    if _cos is not None:
+        return _cos
+    with _client_lock:
+        if _cos is None:
+            t = time.perf_counter()
+            from qcloud_cos import CosConfig, CosS3Client
+            cfg = CosConfig(
+                Region=_REGION,
+                SecretId=_SECRET_ID,
+                SecretKey=_SECRET_KEY,
+                Token=_TOKEN,
+                Scheme="https",
+                PoolConnections=COS_POOL_SIZE,
+                PoolMaxSize=COS_POOL_SIZE,
+                Timeout=COS_TIMEOUT,
+            )
+            _cos = CosS3Client(cfg, retry=COS_SDK_RETRY)
+            _count(_client_stats, "builds")
+            coldstart.record("cos client", (time.perf_counter() - t) * 1000)
+    return _cos
+
+_client = get_client  # 模块内简写
+
+def pool_stats() -> dict:
+    """
+    连接复用统计：每个 host 的 urllib3 连接池累计建连数 / 请求数。
+    reuse_ratio = 1 - 建连数/请求数，越接近 1 说明 TLS 会话复用越充分。
+    """
+    with _stats_lock:
+        counts = dict(_client_stats)
+    out = {"client_built": _cos is not None, "pool_size": COS_POOL_SIZE, **counts, "hosts": []}
+    if _cos is None:
+        return out
+    try:
+        pools = _cos._session.adapters["https://"].poolmanager.pools
+        for k in list(pools.keys()):
+            pool = pools.get(k)
+            if pool is None:
+                continue
+            conns, reqs = getattr(pool, "num_connections", 0), getattr(pool, "num_requests", 0)
+            out["hosts"].append({
+                "host": getattr(pool, "host", str(k)),
+                "connections": conns,
+                "requests": reqs,
+                "reuse_ratio": round(1 - conns / reqs, 4) if reqs else None,
+            })
+    except Exception as e:
+        out["error"] = str(e)
+    return out
 
+# ===== 基础读写（瞬时错误经 services.retry 退避重试；404 不重试）=====
 def cos_exists(key: str) -> bool:
     try:
-        _cos.head_object(Bucket=_BUCKET, Key=key)
-        return True
+        retry.call(_client().head_object, Bucket=_BUCKET, Key=key)
     except Exception:
         return False
+    sign_cache.mark_known(key)
+    return True
 
 def cos_put_bytes(key: str, blob: bytes, content_type: str = None):
     kwargs = dict(Bucket=_BUCKET, Key=key, Body=blob)
     if content_type:
         kwargs["ContentType"] = content_type
-    _cos.put_object(**kwargs)
+    r = retry.call(_client().put_object, **kwargs)  # 整对象覆盖写，幂等
+    sign_cache.mark_known(key)
+    return (r or {}).get("ETag")
 
-def cos_get_bytes(key: str) -> bytes:
-    obj = _cos.get_object(Bucket=_BUCKET, Key=key)
+def delete_object(key: str):
+    retry.call(_client().delete_object, Bucket=_BUCKET, Key=key)  # 删除是幂等的
+    sign_cache.forget(key)
+
+def _get_once(key: str) -> bytes:
+    obj = _client().get_object(Bucket=_BUCKET, Key=key)
     return obj["Body"].get_raw_stream().read()
 
+def cos_get_bytes(key: str) -> bytes:
+    # 读 body 也放在重试内：连接中途断开同样按瞬时错误处理
+    return retry.call(_get_once, key)
+
+def _range_once(key: str, start: int, length: int, if_match: str = None):
+    kwargs = {"IfMatch": if_match} if if_match else {}
+    obj = _client().get_object(Bucket=_BUCKET, Key=key, Range=f"bytes={start}-{start + length - 1}", **kwargs)
+    return obj["Body"].get_raw_stream().read(), obj.get("ETag")
+
+def _get_cond_once(key: str, etag: str):
+    kwargs = {"IfNoneMatch": etag} if etag else {}
+    obj = _client().get_object(Bucket=_BUCKET, Key=key, **kwargs)
+    new_etag = obj.get("ETag")
+    if etag and new_etag == etag:
+        return None, etag   # SDK 把 304 当成功返回（无 body）
+    return obj["Body"].get_raw_stream().read(), new_etag
+
+def get_if_changed(key: str, etag: str = None):
+    """
+    条件 GET（If-None-Match）：对象未变返回 (None, etag)，只花一次往返不传 body；
+    否则返回 (bytes, 新 ETag)。不存在时抛 404。
+    """
+    try:
+        return retry.call(_get_cond_once, key, etag)
+    except Exception as e:
+        if etag and retry.status_of(e) == 304:
+            return None, etag
+        raise
+
+def get_range(key: str, start: int, length: int, if_match: str = None, with_etag: bool = False):
+    """
+    Range GET：只取 [start, start+length) 字节（列式快照按列读取用）。
+    if_match：对象 ETag 不一致（已被覆盖）时抛 412，不会读到新旧版本拼接的字节。
+    with_etag=True 时返回 (bytes, etag)。
+    """
+    if length <= 0:
+        return (b"", if_match) if with_etag else b""
+    blob, etag = retry.call(_range_once, key, start, length, if_match)
+    return (blob, etag) if with_etag else blob
+
+def list_objects(prefix: str, limit: int = None):
+    """
+    按前缀列对象（自动翻页），返回 [{key, size, last_modified}, ...]，按 key 升序。
+    limit：最多返回多少条（None 不限）。
+    """
+    out, marker = [], ""
+    while True:
+        page = retry.call(_client().list_objects, Bucket=_BUCKET, Prefix=prefix, Marker=marker,
+                          MaxKeys=1000 if limit is None else max(1, min(1000, limit - len(out))))
+        for c in page.get("Contents") or []:
+            out.append({"key": c.get("Key"), "size": int(c.get("Size") or 0),
+                        "last_modified": c.get("LastModified") or ""})
+        if str(page.get("IsTruncated")).lower() != "true" or (limit is not None and len(out) >= limit):
+            return out
+        marker = page.get("NextMarker") or (out[-1]["key"] if out else "")
+        if not marker:
+            return out
+
+# ===== 对冲读（hedged read）=====
+# 小 JSON（作业详情 / 评分结果）的 p99 主要来自偶发的慢响应：首个 GET 超过该类 key 的 p95 仍未返回时，
+# 在线程池里再发一个相同的 GET；主请求在调用线程上执行，失败（含 COS_TIMEOUT 超时）时直接用已在路上的对冲结果。按 key 类别（目录 + 扩展名）维护延迟直方图来调节对冲延迟。
+COS_HEDGE_READS    = os.environ.get("COS_HEDGE_READS", "").lower() in ("1", "true", "yes")  # 总开关（默认关）
+COS_HEDGE_PREFIXES = [p.strip() for p in os.environ.get("COS_HEDGE_PREFIXES", "db/assignments/,db/results/").split(",") if p.strip()]
+HEDGE_QUANTILE     = float(os.environ.get("HEDGE_QUANTILE", "0.95"))
+HEDGE_DEFAULT_MS   = float(os.environ.get("HEDGE_DEFAULT_MS", "100"))  # 样本不足时的对冲延迟
+HEDGE_MIN_SAMPLES  = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+
+class LatencyHistogram:
+    """对数分桶（1ms ~ 16s，每档 ×√2），记录 / 估分位数都是 O(桶数)，内存恒定"""
+    BOUNDS = [2 ** (i / 2) for i in range(0, 29)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def record(self, ms: float):
+        i = 0
+        while i < len(self.BOUNDS) and ms > self.BOUNDS[i]:
+            i += 1
+        with self._lock:
+            self.counts[i] += 1
+            self.total += 1
+
+    def quantile(self, q: float):
+        with self._lock:
+            if not self.total:
+                return None
+            need, acc = q * self.total, 0
+            for i, c in enumerate(self.counts):
+                acc += c
+                if acc >= need:
+                    return self.BOUNDS[min(i, len(self.BOUNDS) - 1)]
+        return self.BOUNDS[-1]
+
+_hists = {}
+_hists_lock = threading.Lock()
+_hedge_stats = {"hedged": 0, "hedge_wins": 0}
+_hedge_stats_lock = threading.Lock()   # 计数在请求线程与对冲线程池里都会递增
+_hedge_pool = None
+
+def key_class(key: str) -> str:
+    """db/assignments/a_2025.json → db/assignments/*.json；顶层文件原样返回"""
+    d, _, name = key.rpartition("/")
+    if not d:
+        return key
+    ext = os.path.splitext(name)[1]
+    return f"{d}/*{ext}"
+
+def _hist(cls: str) -> LatencyHistogram:
+    h = _hists.get(cls)
+    if h is None:
+        with _hists_lock:
+            h = _hists.setdefault(cls, LatencyHistogram())
+    return h
+
+def _timed_get(key: str) -> bytes:
+    t = time.perf_counter()
+    blob = cos_get_bytes(key)
+    _hist(key_class(key)).record((time.perf_counter() - t) * 1000)
+    return blob
+
+def hedge_delay_ms(key: str) -> float:
+    h = _hist(key_class(key))
+    if h.total < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_MS
+    return h.quantile(HEDGE_QUANTILE) or HEDGE_DEFAULT_MS
+
+def _pool():
+    global _hedge_pool
+    if _hedge_pool is None:
+        with _hists_lock:
+            if _hedge_pool is None:
+                _hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="cos-hedge")
+    return _hedge_pool
+
+class _HedgeTimer:
+    """单个守护线程按到期时间触发对冲：等待期间不占线程池 worker，主请求先返回的对冲直接作废"""
+    def __init__(self):
+        self._cv = threading.Condition()
+        self._heap = []
+        self._seq = 0
+        self._thread = None
+
+    def schedule(self, due: float, fn):
+        with self._cv:
+            self._seq += 1
+            heapq.heappush(self._heap, (due, self._seq, fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="cos-hedge-timer", daemon=True)
+                self._thread.start()
+            self._cv.notify()
+
+    def _run(self):
+        while True:
+            with self._cv:
+                while not self._heap or self._heap[0][0] > time.monotonic():
+                    self._cv.wait(self._heap[0][0] - time.monotonic() if self._heap else None)
+                _, _, fn = heapq.heappop(self._heap)
+            fn()
+
+_hedge_timer = _HedgeTimer()
+
+class _HedgeState:
+    __slots__ = ("lock", "primary_done", "future")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.primary_done = False
+        self.future = None
+
+def _hedged_get(key: str) -> bytes:
+    """
+    主请求在调用线程上直接执行（不经线程池）；到达对冲延迟仍未返回时，由定时线程把对冲 GET 提交到线程池。
+    主请求成功即返回；主请求失败时改用对冲结果（对冲已在路上，省掉一次从头重试）。
+    """
+    st = _HedgeState()
+
+    def _fire():
+        with st.lock:
+            if st.primary_done:
+                return
+            st.future = _pool().submit(_timed_get, key)
+        with _hedge_stats_lock:
+            _hedge_stats["hedged"] += 1
+
+    _hedge_timer.schedule(time.monotonic() + hedge_delay_ms(key) / 1000.0, _fire)
+    try:
+        return _timed_get(key)
+    except Exception:
+        with st.lock:
+            st.primary_done = True
+            hedge = st.future
+        if hedge is None:
+            raise
+        blob = hedge.result()   # 对冲也失败时抛对冲的异常
+        with _hedge_stats_lock:
+            _hedge_stats["hedge_wins"] += 1
+        return blob
+    finally:
+        with st.lock:
+            st.primary_done = True
+
+def hedge_stats() -> dict:
+    with _hedge_stats_lock:
+        counts = dict(_hedge_stats)
+    out = {"enabled": COS_HEDGE_READS, **counts, "classes": {}}
+    for cls, h in list(_hists.items()):
+        out["classes"][cls] = {"n": h.total, "p50_ms": h.quantile(0.5), "p95_ms": h.quantile(0.95),
+                               "p99_ms": h.quantile(0.99)}
+    return out
+
 # 兼容层（db_index 需要这两个名字）
-def get_bytes(key: str) -> bytes:
-    return cos_get_bytes(key)
+def get_bytes(key: str, hedge: bool = None) -> bytes:
+    """
+    hedge=None：按 COS_HEDGE_READS + COS_HEDGE_PREFIXES 决定；True/False 强制开关。
+    无论是否对冲都会记录该类 key 的延迟，用于估算对冲延迟。
+    """
+    if hedge is None:
+        hedge = COS_HEDGE_READS and any(key.startswith(p) for p in COS_HEDGE_PREFIXES)
+    return _hedged_get(key) if hedge else _timed_get(key)
 
 def put_bytes(key: str, blob: bytes, content_type: str = None):
     return cos_put_bytes(key, blob, content_type)
 
-def get_text(key: str, encoding: str = "utf-8") -> str:
-    return cos_get_bytes(key).decode(encoding, "ignore")
+def get_text(key: str, encoding: str = "utf-8", hedge: bool = None) -> str:
+    return get_bytes(key, hedge=hedge).decode(encoding, "ignore")
 
 def put_text(key: str, text: str, content_type: str = "application/json", encoding: str = "utf-8"):
     cos_put_bytes(key, text.encode(encoding), content_type=content_type)
 
+# ===== 流式上传（未知长度的数据流 → COS）=====
+# 先攒满一块：不足一块就结束的小对象直接 put_object；否则走分块上传，
+# 读下一块的同时后台上传上一块，每个流的在途块数受 COS_STREAM_INFLIGHT 限制，内存上限约 (在途+1) × 块大小。
+# 每个流用自己的上传线程（不共享线程池），一个长 TTS 流不会让并发的其他流排队等它的分块
+COS_PART_MB         = int(os.environ.get("COS_PART_MB", "1"))          # COS 要求非末块 ≥ 1MB
+COS_STREAM_INFLIGHT = int(os.environ.get("COS_STREAM_INFLIGHT", "2"))
+
+def put_stream(key: str, chunks, content_type: str = None, part_mb: int = None) -> int:
+    """
+    入参:
+      chunks: 可迭代的 bytes 块（如 requests 的 iter_content、分段解码的 Base64）
+    返回:
+      写入的总字节数。中途失败时 abort 分块上传并抛出原异常。
+    """
+    part_size = max(1, part_mb or COS_PART_MB) * 1024 * 1024
+    it = iter(chunks)
+    buf, total = bytearray(), 0
+    for chunk in it:
+        if not chunk:
+            continue
+        buf.extend(chunk)
+        total += len(chunk)
+        if len(buf) >= part_size:
+            break
+    else:
+        cos_put_bytes(key, bytes(buf), content_type=content_type)
+        return total
+
+    kwargs = {"ContentType": content_type} if content_type else {}
+    # create 不幂等（每次生成新的 UploadId），不重试；分块/合并按幂等处理
+    upload_id = retry.call(_client().create_multipart_upload, Bucket=_BUCKET, Key=key,
+                           idempotent=False, **kwargs)["UploadId"]
+    inflight = max(1, COS_STREAM_INFLIGHT)
+    uploader = ThreadPoolExecutor(max_workers=inflight, thread_name_prefix="cos-part")
+    pending, parts = [], []
+
+    def _upload(num: int, body: bytes) -> dict:
+        r = retry.call(_client().upload_part, Bucket=_BUCKET, Key=key, Body=body,
+                       PartNumber=num, UploadId=upload_id)
+        return {"PartNumber": num, "ETag": r["ETag"]}
+
+    def _submit(body: bytes):
+        # 在途已满时先等最早的一块，限制内存
+        while len(pending) >= inflight:
+            parts.append(pending.pop(0).result())
+        pending.append(uploader.submit(_upload, len(parts) + len(pending) + 1, body))
+
+    try:
+        for chunk in it:
+            if len(buf) >= part_size:
+                _submit(bytes(buf))
+                buf.clear()
+            if chunk:
+                buf.extend(chunk)
+                total += len(chunk)
+        if buf:   # 末尾的空块不上传（首块已满，parts 不会为空）
+            _submit(bytes(buf))
+            buf.clear()
+        while pending:
+            parts.append(pending.pop(0).result())
+        retry.call(_client().complete_multipart_upload, Bucket=_BUCKET, Key=key, UploadId=upload_id,
+                   MultipartUpload={"Part": parts})
+    except Exception:
+        for f in pending:
+            f.cancel()
+        try:
+            _client().abort_multipart_upload(Bucket=_BUCKET, Key=key, UploadId=upload_id)
+        except Exception:
+            pass
+        raise
+    finally:
+        uploader.shutdown(wait=False)
+    sign_cache.mark_known(key)
+    return total
+
+# ===== COS lease（跨容器互斥）=====
+# lock 对象 + 禁止覆盖写实现的轻量互斥：TTS 合成去重、spool 表 / 登记表的整表读-改-写共用
+COS_LEASE_POLL_MS = int(os.environ.get("COS_LEASE_POLL_MS", os.environ.get("TTS_LEASE_POLL_MS", "200")))  # 等待 lease 的轮询间隔
+_lease_stats = {"acquired": 0, "contended": 0, "waited_hit": 0, "stale": 0, "errors": 0}
+
+def _lease_acquire(lock_key: str, ttl_s: float):
+    """
+    抢占 lease：x-cos-forbid-overwrite 保证同一时刻只有一个 PUT 成功（409 表示已被占用）。
+    已过期的 lease 删除后再抢一次。
+    返回 True 抢到 / False 被占用 / None COS 异常（调用方自行降级，不持有 lease）
+    """
+    body = json.dumps({"expires_at": time.time() + ttl_s}).encode("utf-8")
+    for _ in range(2):
+        try:
+            _client().put_object(Bucket=_BUCKET, Key=lock_key, Body=body, ContentType="application/json",
+                                 Metadata={"x-cos-forbid-overwrite": "true"})
+            _count(_lease_stats, "acquired")
+            return True
+        except Exception as e:
+            if retry.status_of(e) != 409:
+                _count(_lease_stats, "errors")
+                return None
+        try:
+            held = json.loads(_get_once(lock_key) or b"{}")
+        except Exception as e:
+            if retry.is_not_found(e):
+                continue  # 刚被释放，再抢一次
+            _count(_lease_stats, "errors")
+            return None
+        if float(held.get("expires_at") or 0) > time.time():
+            _count(_lease_stats, "contended")
+            return False
+        _count(_lease_stats, "stale")
+        _lease_release(lock_key)
+    return False
+
+def _lease_release(lock_key: str):
+    try:
+        _client().delete_object(Bucket=_BUCKET, Key=lock_key)
+    except Exception:
+        pass
+
+def acquire_lease(lock_key: str, ttl_s: float, wait_s: float = None) -> bool:
+    """
+    阻塞抢占通用 lease（整表读-改-写串行化用）：抢到返回 True；
+    等待超过 wait_s（默认 ttl_s）/ 本次调用时间不够 / COS 异常时返回 False，调用方不得继续写。
+    """
+    until = time.monotonic() + (ttl_s if wait_s is None else wait_s)
+    while True:
+        got = _lease_acquire(lock_key, ttl_s)
+        if got:
+            return True
+        if got is None or time.monotonic() >= until:
+            return False
+        left = retry.remaining_ms()
+        if left is not None and left < COS_LEASE_POLL_MS:
+            return False
+        time.sleep(random.uniform(0.02, COS_LEASE_POLL_MS / 1000.0))
+
+def release_lease(lock_key: str):
+    _lease_release(lock_key)
+
+def lease_stats() -> dict:
+    with _stats_lock:
+        return dict(_lease_stats)
+
 # ===== Azure TTS =====
 _SPEECH_KEY = os.environ.get("SPEECH_KEY")
 _SPEECH_REGION = os.environ.get("SPEECH_REGION", "eastasia")
+_SPEECH_TTS_URL = os.environ.get("SPEECH_TTS_URL", "")  # 覆盖 TTS 终结点（私有终结点/本地压测）
+TTS_STREAM_CHUNK = int(os.environ.get("TTS_STREAM_CHUNK", str(64 * 1024)))  # 读取 Azure 音频流的块大小
+
+# 熔断：连续 SPEECH_CB_FAILURES 次 429/5xx/超时后打开 SPEECH_CB_RESET_S 秒（429 的 Retry-After 更长时以其为准），
+# 打开期间 publish_tts 剩余条目立即失败，不会把整个函数超时耗在等待 Azure 上
+_speech_breaker = circuit.CircuitBreaker(
+    "azure-tts",
+    failure_threshold=int(os.environ.get("SPEECH_CB_FAILURES", "3")),
+    reset_timeout=float(os.environ.get("SPEECH_CB_RESET_S", "30")),
+)
+# 负缓存：同一指纹遇到服务端降级类失败（429/5xx/超时）后 TTS_NEGATIVE_TTL 秒内直接失败
+_tts_negative = circuit.NegativeCache(ttl=float(os.environ.get("TTS_NEGATIVE_TTL", "60")))
+
+# 同一指纹只合成一次：容器内 single-flight；跨容器用 COS lease（tts/.../<sha1>.lock，禁止覆盖写抢占）
+# 没抢到 lease 的一方轮询音频是否已写入，lease 过期或等不到时再自己合成（lease 只是优化，不影响正确性）
+# 默认关闭（与 MEDIA_DEDUP / NDJSON_GZIP 一样按需开启）：每次缓存未命中多一次禁止覆盖写 PUT + DELETE，
+# 只有多个容器常常同时合成同一文本（大班同时发布）时才划算
+TTS_LEASE         = os.environ.get("TTS_LEASE", "0").lower() in ("1", "true", "yes")
+TTS_LEASE_TTL_S   = float(os.environ.get("TTS_LEASE_TTL_S", "30"))
+_tts_flight = SingleFlight()
 
 _FMT_TO_AZURE = {
     "mp3-16k": "audio-16khz-32kbitrate-mono-mp3",
@@ -101,9 +556,14 @@ def _build_ssml(text: str, voice: str, language: str, rate: str, pitch: str, sty
 </speak>""".strip()
     return ssml.encode("utf-8")
 
-def _azure_tts_bytes(text: str, tts: dict) -> bytes:
+def _azure_tts_request(text: str, tts: dict):
+    """
+    发起 TTS 请求并返回已收到响应头的流式 Response（body 未读）。
+    HTTP 错误统一转成 urllib.error.HTTPError，熔断器 / 负缓存按原规则分类。
+    """
     if not _SPEECH_KEY:
         raise RuntimeError("SPEECH_KEY missing")
+    import requests  # 延迟加载：只有真正合成时才需要
     region   = _SPEECH_REGION
     language = tts.get("language", "en-GB")
     voice    = tts.get("voice",    "en-GB-LibbyNeural")
@@ -113,24 +573,43 @@ def _azure_tts_bytes(text: str, tts: dict) -> bytes:
     fmt      = tts.get("format",   "mp3-16k")
 
     ssml = _build_ssml(text, voice, language, rate, pitch, style)
-    url = f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
-    req = urllib.request.Request(url, data=ssml, method="POST")
-    req.add_header("Ocp-Apim-Subscription-Key", _SPEECH_KEY)
-    req.add_header("Content-Type", "application/ssml+xml")
-    req.add_header("X-Microsoft-OutputFormat", _azure_format(fmt))
+    url = _tts_url(region)
 
-    with urllib.request.urlopen(req, timeout=20) as r:
-        audio_bytes = r.read()
-    return audio_bytes
+    def _once():
+        headers = {
+            **speech_auth.auth_headers(_SPEECH_KEY, region),
+            "Content-Type": "application/ssml+xml",
+            "X-Microsoft-OutputFormat": _azure_format(fmt),
+        }
+        r = requests.post(url, data=ssml, headers=headers, stream=True, timeout=(5, 20))
+        if r.status_code >= 400:
+            msg = r.text[:200]
+            r.close()
+            raise urllib.error.HTTPError(url, r.status_code, msg or r.reason, r.headers, None)
+        return r
+
+    try:
+        return _once()
+    except urllib.error.HTTPError as e:
+        # token 模式下 401：缓存的 token 可能已被吊销，换一次再试
+        if e.code != 401 or not speech_auth.using_token():
+            raise
+        speech_auth.invalidate(_SPEECH_KEY, region)
+        return _once()
+
+def _azure_tts_bytes(text: str, tts: dict) -> bytes:
+    """整段读入内存（预览等不落 COS 的场景）"""
+    with _azure_tts_request(text, tts) as r:
+        return r.content
+
+def _tts_url(region: str) -> str:
+    return _SPEECH_TTS_URL or f"https://{region}.tts.speech.microsoft.com/cognitiveservices/v1"
 
 # ===== 主函数：TTS 合成并缓存到 COS =====
-def tts_synthesize_cached(text: str, tts: dict) -> str:
+def tts_cache_key(text: str, tts: dict):
     """
-    入参:
-      text: 文本
-      tts:  { language, voice, rate, pitch, style, format }
-    返回:
-      cos_key: tts/<lang>/<voice>/<format>/<sha1>.{mp3|wav}
+    只算缓存位置、不合成（预热 / 去重用）。
+    返回: (cos_key, fingerprint)
     """
     language = tts.get("language", "en-GB")
     voice    = tts.get("voice",    "en-GB-LibbyNeural")
@@ -141,13 +620,82 @@ def tts_synthesize_cached(text: str, tts: dict) -> str:
 
     fp_src = "|".join([_norm_text(text), language, voice, rate, pitch, style, fmt])
     fp = _sha1(fp_src)
+    return f"tts/{language}/{voice}/{fmt}/{fp}{_ext_for_format(fmt)}", fp
 
-    ext = _ext_for_format(fmt)
-    cos_key = f"tts/{language}/{voice}/{fmt}/{fp}{ext}"
+def _lease_key(cos_key: str) -> str:
+    return os.path.splitext(cos_key)[0] + ".lock"
 
-    if cos_exists(cos_key):
+def _wait_for_object(cos_key: str, lock_key: str) -> bool:
+    """等其他容器写完：对象出现返回 True；lease 释放/过期或本次调用时间不够时返回 False"""
+    until = time.monotonic() + TTS_LEASE_TTL_S
+    while time.monotonic() < until:
+        left = retry.remaining_ms()
+        if left is not None and left < COS_LEASE_POLL_MS:
+            return False
+        time.sleep(COS_LEASE_POLL_MS / 1000.0)
+        if cos_exists(cos_key):
+            _count(_lease_stats, "waited_hit")
+            return True
+        try:
+            _client().head_object(Bucket=_BUCKET, Key=lock_key)
+        except Exception:
+            return cos_exists(cos_key)  # lease 已释放（持有方可能失败了）
+    return False
+
+def _synthesize_to_cos(text: str, tts: dict, cos_key: str, fp: str) -> str:
+    # 同容器内刚有别的线程写完（put_stream 会登记 known）
+    if sign_cache.is_known(cos_key):
         return cos_key
+    # 同一指纹刚失败过：直接失败，不再等 Azure 超时
+    neg = _tts_negative.get(fp)
+    if neg:
+        raise RuntimeError(f"tts recently failed: {neg}")
 
-    audio_bytes = _azure_tts_bytes(text, tts)
-    put_bytes(cos_key, audio_bytes, content_type=_content_type_for_format(fmt))
+    lock_key = _lease_key(cos_key)
+    held = _lease_acquire(lock_key, TTS_LEASE_TTL_S) if TTS_LEASE else None
+    if held is False:
+        if _wait_for_object(cos_key, lock_key):
+            return cos_key
+        # 等不到：自己合成（结果相同，覆盖写无害）
+    try:
+        # 熔断只覆盖“拿到响应头”这一步；音频边收边传到 COS，长句不必整段驻留内存
+        try:
+            r = _speech_breaker.call(_azure_tts_request, text, tts)
+        except circuit.CircuitOpen:
+            raise
+        except Exception as e:
+            # 只记服务端降级类失败（429/5xx/超时）；缺 SPEECH_KEY、4xx 参数错误等请求/本地问题不缓存，
+            # 否则一次坏请求会把同一文本挡住 TTS_NEGATIVE_TTL 秒
+            if circuit.is_provider_failure(e):
+                _tts_negative.put(fp, str(e))
+            raise
+        with r:
+            put_stream(cos_key, r.iter_content(chunk_size=TTS_STREAM_CHUNK),
+                       content_type=_content_type_for_format(tts.get("format", "mp3-16k")))
+    finally:
+        if held:
+            _lease_release(lock_key)
     return cos_key
+
+def tts_synthesize_cached(text: str, tts: dict) -> str:
+    """
+    入参:
+      text: 文本
+      tts:  { language, voice, rate, pitch, style, format }
+    返回:
+      cos_key: tts/<lang>/<voice>/<format>/<sha1>.{mp3|wav}
+    """
+    cos_key, fp = tts_cache_key(text, tts)
+
+    if cos_exists(cos_key):
+        return cos_key
+    # 同容器内并发的相同请求只合成一次，其余线程共享结果
+    return _tts_flight.do(fp, _synthesize_to_cos, text, tts, cos_key, fp)
+
+def speech_breaker_open() -> bool:
+    """Azure 语音熔断是否打开中（批量任务据此提前停止）"""
+    return _speech_breaker.is_open()
+
+def speech_stats() -> dict:
+    return {**_speech_breaker.snapshot(), "auth": speech_auth.stats(),
+            "single_flight": _tts_flight.stats(), "lease": lease_stats()}
@@ -3,98 +3,509 @@
 # 依赖 services.cos_client 提供的：
 #   - get_text(key) / put_text(key, text, content_type?)
 #   - get_bytes(key) / put_bytes(key, bytes, content_type?)
-#   - cos_exists(key)
+#   - cos_exists(key) / list_objects(prefix) / delete_object(key)
+# NDJSON 表可选 gzip 分段存储（NDJSON_GZIP，默认关闭），读写对调用方透明（见下方“NDJSON 存储格式”）
 
-import json
+import os, json, gzip, zlib, time, copy, threading, uuid, itertools
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 
 from services.cos_client import (
-    get_text, put_text, get_bytes, put_bytes, cos_exists
+    get_text, put_text, get_bytes, put_bytes, cos_exists, list_objects, delete_object,
+    acquire_lease, release_lease
 )
+from services.retry import is_not_found
+from services import db_unit
+
+# 注意：只有“对象不存在”才当作空表处理；其他读失败（重试后仍失败）一律抛出，
+# 否则一次瞬时 503 会被当成空文件，随后的全量回写会把整张表覆盖掉。
 
 # ========== 基础 JSON ==========
 
-def write_json(key: str, data) -> None:
+def write_json(key: str, data, best_effort: bool = False) -> None:
     """
-    将对象序列化为 JSON 并写入 COS。
+    将对象序列化为 JSON 并写入 COS（组提交开启时先缓冲，调用结束统一写出）。
     """
     text = json.dumps(data, ensure_ascii=False)
+    invalidate_cached(key)
+    if _buffer(key, ("json", text, best_effort)):
+        return
     put_text(key, text, content_type="application/json")
 
-def read_json(key: str):
+def read_json(key: str, hedge: bool = None):
     """
     从 COS 读取 JSON 并反序列化。
+    hedge：是否对冲读（None 时按 cos_client 的前缀配置决定）。
     """
-    text = get_text(key)
+    _flush_pending(key)
+    text = get_text(key, hedge=hedge)
     return json.loads(text)
 
-# ========== NDJSON（逐行 JSON） ==========
+# ========== 读穿缓存（热容器内） ==========
+# 单条记录类 JSON（提交记录 / 评分结果）读多写少：命中直接返回副本，未命中读 COS 后放入缓存。
+# 本容器内 write_json 会同步失效；其他容器的写入最多延迟 JSON_CACHE_TTL 秒可见。不缓存“不存在”。
+
+JSON_CACHE_TTL = float(os.environ.get("JSON_CACHE_TTL", "30"))   # 秒；0 表示不缓存
+JSON_CACHE_MAX = int(os.environ.get("JSON_CACHE_MAX", "2000"))
+
+_json_cache = OrderedDict()   # key -> (expire_at, obj)
+_json_cache_lock = threading.Lock()
+_json_cache_stats = {"hit": 0, "miss": 0}
+
+def read_json_cached(key: str, ttl: float = None):
+    """同 read_json，但经过进程内 TTL 缓存；返回深拷贝，调用方可随意修改"""
+    ttl = JSON_CACHE_TTL if ttl is None else ttl
+    now = time.monotonic()
+    with _json_cache_lock:
+        hit = _json_cache.get(key)
+        if hit and hit[0] > now:
+            _json_cache.move_to_end(key)
+            _json_cache_stats["hit"] += 1
+            return copy.deepcopy(hit[1])
+        _json_cache_stats["miss"] += 1
+    obj = read_json(key)
+    if ttl > 0:
+        with _json_cache_lock:
+            _json_cache[key] = (now + ttl, obj)
+            _json_cache.move_to_end(key)
+            while len(_json_cache) > JSON_CACHE_MAX:
+                _json_cache.popitem(last=False)
+    return copy.deepcopy(obj)
+
+def invalidate_cached(key: str = None):
+    with _json_cache_lock:
+        if key is None:
+            _json_cache.clear()
+        else:
+            _json_cache.pop(key, None)
+
+def cache_stats() -> dict:
+    with _json_cache_lock:
+        return {**_json_cache_stats, "size": len(_json_cache)}
+
+# ========== NDJSON 存储格式 ==========
+# 读取总是按 gzip 魔数识别，明文表和 gzip 表都能读；NDJSON_GZIP 只决定写入格式。
+# NDJSON_GZIP=1：表以 gzip 存储（key 不变，仍是 .ndjson）。
+# - 追加：旧内容原样保留，新行单独压成一个 gzip member 接在后面（多 member 串联仍是合法 gzip）；
+#   member 数达到 NDJSON_MAX_SEGMENTS 时整表重压成一个 member，保持压缩率
+# - 全量回写（upsert）：整表压成一个 member
+# NDJSON_GZIP=0（默认）：按明文写；遇到 gzip 表时下一次写入顺带解压回明文。
+# 不设置 Content-Encoding：避免 HTTP 层自动解压后再按 gzip 解一次；下载工具需自行 gunzip
+#
+# 切换到 gzip 要分阶段进行（不经过本模块读表的都会读坏：旧版本函数的明文追加会把 gzip 表写坏，
+# 经 /cos/resign 拿 db/ 直链的客户端拿到的是没有 Content-Encoding 的 gzip 字节）：
+#   1. 共用该存储桶的所有函数版本都升级到本模块（保持 NDJSON_GZIP=0），确认没有客户端直链下载 db/ 表；
+#   2. 各函数统一设置 NDJSON_GZIP=1，之后写到的表逐个变成 gzip；
+#   3. 用 migrate_ndjson(prefix, dry_run=True) 看收益，再去掉 dry_run 批量压缩其余表。
+# 回退：先把各函数改回 NDJSON_GZIP=0，再 migrate_ndjson(prefix, compress=False) 把表解压回明文。
+
+NDJSON_GZIP         = os.environ.get("NDJSON_GZIP", "0").lower() in ("1", "true", "yes")
+NDJSON_GZIP_LEVEL   = int(os.environ.get("NDJSON_GZIP_LEVEL", "6"))
+NDJSON_MAX_SEGMENTS = int(os.environ.get("NDJSON_MAX_SEGMENTS", "64"))
+NDJSON_CONTENT_TYPE = "application/x-ndjson"
+
+_GZIP_MAGIC = b"\x1f\x8b"
+
+def _encode(data: bytes) -> bytes:
+    return gzip.compress(data, compresslevel=NDJSON_GZIP_LEVEL, mtime=0)
+
+def _decode(raw: bytes):
+    """返回 (明文字节, gzip member 数)；未压缩对象 member 数为 0"""
+    if not raw.startswith(_GZIP_MAGIC):
+        return raw, 0
+    out, members = [], 0
+    while raw.startswith(_GZIP_MAGIC):
+        d = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        out.append(d.decompress(raw))
+        out.append(d.flush())
+        members += 1
+        raw = d.unused_data
+    return b"".join(out), members
+
+def _read_raw(key: str) -> Optional[bytes]:
+    """对象不存在返回 None，其他读失败抛出"""
+    try:
+        return get_bytes(key)
+    except Exception as e:
+        if not is_not_found(e):
+            raise
+        return None
+
+def _read_table(key: str) -> str:
+    raw = _read_raw(key)
+    return _decode(raw)[0].decode("utf-8", "ignore") if raw else ""
+
+def _write_table(key: str, data: bytes) -> None:
+    put_bytes(key, _encode(data) if NDJSON_GZIP else data, content_type=NDJSON_CONTENT_TYPE)
+
+# ========== 追加旁路（spool） ==========
+# DB_SPOOL_KEYS 中的表追加时不再读-改-写主表，而是写一个小分段：
+#   db/_spool/<表名>/<容器 ID>/<序号>.ndjson
+# 热路径只有一次小 PUT，多个容器并发追加互不争用同一对象。merge_spools()（index.spool_merge_handler 定时调用）
+# 把分段并入主表，回读确认行已在主表后才删除分段。
+# 只适用于按 id 唯一的表：DB_SPOOL_KEYS 写成 "db/submissions.ndjson:id,..."（省略 :字段 时为 id），
+# 分段行的 id 已在主表中即视为已合并（合并重复执行 / 与读取并发都不会多出行；inbox、事件流这类允许重复行的表不要配置）。
+# 缺少 id 字段的行不走 spool，照旧直接追加主表。
+# - 读取：先列分段、读分段，最后读主表（合并发生在中间时，行要么已在主表，要么仍在分段）
+# - 合并、upsert、整表覆盖这些“整表读-改-写”都在该表的 COS lease 内进行，互不覆盖；
+#   upsert / 整表覆盖前先在 lease 内合并分段，因此 spool 表的每次 upsert（如 /score/run）都带一次完整合并
+#   （列分段 + 读各分段 + 写主表 + 删分段），分段堆积越多越慢，定时合并间隔要相应调短。
+
+DB_SPOOL_KEYS = {}   # 表 key -> id 字段
+for _item in os.environ.get("DB_SPOOL_KEYS", "").split(","):
+    _k, _, _f = _item.strip().partition(":")
+    if _k:
+        DB_SPOOL_KEYS[_k] = _f.strip() or "id"
+SPOOL_PREFIX = "db/_spool/"
+DB_SPOOL_LEASE_S = float(os.environ.get("DB_SPOOL_LEASE_S", "15"))   # 整表读-改-写的 lease 时长（秒）
+
+_CONTAINER_ID = uuid.uuid4().hex[:12]   # 每个容器（进程）一个，分段互不覆盖
+_spool_seq = itertools.count(1)
+
+_lease_prefixes = []   # 不走 spool、但整表读-改-写也要串行化的表（register_leased_prefix 登记）
 
-def append_json_line(key: str, record: dict) -> None:
+def _spooled(key: str) -> bool:
+    return key in DB_SPOOL_KEYS
+
+def register_leased_prefix(prefix: str) -> None:
     """
-    读取旧内容 + 追加一行 JSON + 回写。
-    A 阶段并发低，直接全量回写即可。
+    登记一类表（按 key 前缀）：upsert / 整表覆盖在 _table_lease 内进行，多个容器并发 upsert 不会互相覆盖丢行。
+    用于读方当作权威数据的派生表（如 submission_index 的按作业索引）。
     """
-    line = json.dumps(record, ensure_ascii=False) + "\n"
+    if prefix and prefix not in _lease_prefixes:
+        _lease_prefixes.append(prefix)
+
+def _leased(key: str) -> bool:
+    return _spooled(key) or any(key.startswith(p) for p in _lease_prefixes)
+
+def _spool_dir(key: str) -> str:
+    name = key[3:] if key.startswith("db/") else key
+    name = name[:-len(".ndjson")] if name.endswith(".ndjson") else name
+    return SPOOL_PREFIX + name.replace("/", "__") + "/"
+
+def _line_id(line: str, field: str):
     try:
-        old = get_text(key)
-        new_text = old + line
+        return json.loads(line).get(field)
     except Exception:
-        # 文件不存在或读取失败时，从空开始
-        new_text = line
-    put_text(key, new_text, content_type="application/x-ndjson")
+        return None
+
+def _spoolable(key: str, data: bytes) -> bool:
+    """spool 表且每行都带 id 字段时才写分段"""
+    if key not in DB_SPOOL_KEYS:
+        return False
+    field = DB_SPOOL_KEYS[key]
+    lines = [ln for ln in data.decode("utf-8", "ignore").splitlines() if ln.strip()]
+    return all(_line_id(ln, field) is not None for ln in lines)
+
+def _unmerged(key: str, text: str, pending: list) -> list:
+    """分段行中 id 尚不在主表的（保留分段内原有顺序与重复）"""
+    field = DB_SPOOL_KEYS[key]
+    have = {_line_id(ln, field) for ln in text.splitlines() if ln.strip()}
+    return [ln for ln in pending if _line_id(ln, field) not in have]
+
+@contextmanager
+def _table_lease(key: str):
+    """spool 表 / 登记过的表整表读-改-写的 COS lease（不可重入）；其他表不加锁，保持原行为"""
+    if not _leased(key):
+        yield
+        return
+    lock_key = _spool_dir(key).rstrip("/") + ".lock"
+    if not acquire_lease(lock_key, DB_SPOOL_LEASE_S):
+        raise RuntimeError(f"table lease busy: {key}")
+    try:
+        yield
+    finally:
+        release_lease(lock_key)
+
+def _spool_put(key: str, data: bytes) -> None:
+    # 毫秒时间戳在前：同表分段按 key 排序即大致按时间排序
+    seq = f"{int(time.time() * 1000):013d}-{next(_spool_seq):06d}"
+    put_bytes(f"{_spool_dir(key)}{_CONTAINER_ID}/{seq}.ndjson", data, content_type=NDJSON_CONTENT_TYPE)
+
+def _spool_segments(key: str) -> list:
+    keys = [o["key"] for o in list_objects(_spool_dir(key)) if o["key"].endswith(".ndjson")]
+    keys.sort(key=lambda k: (k.rsplit("/", 1)[-1], k))
+    return keys
+
+def _spool_lines(segments: list) -> list:
+    """按顺序读取分段中的行；已被合并删除的分段跳过"""
+    lines = []
+    for seg in segments:
+        raw = _read_raw(seg)
+        if raw:
+            lines.extend(ln for ln in _decode(raw)[0].decode("utf-8", "ignore").splitlines() if ln.strip())
+    return lines
+
+def _read_table_with_spool(key: str) -> str:
+    pending = _spool_lines(_spool_segments(key))
+    text = _read_table(key)
+    if not pending:
+        return text
+    return text + "".join(ln + "\n" for ln in _unmerged(key, text, pending))
+
+def _merge_spool_locked(key: str) -> dict:
+    """调用方已持有 _table_lease(key)"""
+    segments = _spool_segments(key)
+    if not segments:
+        return {"key": key, "segments": 0, "lines": 0}
+    pending = _spool_lines(segments)
+    text = _read_table(key)
+    extra = _unmerged(key, text, pending)
+    if extra:
+        _write_table(key, (text + "".join(ln + "\n" for ln in extra)).encode("utf-8"))
+        # 回读确认：行确实已在主表才删分段，否则留给下次合并
+        if _unmerged(key, _read_table(key), extra):
+            raise RuntimeError(f"spool merge not visible yet: {key}")
+    for seg in segments:
+        try:
+            delete_object(seg)
+        except Exception:
+            pass  # 留到下次合并：id 已在主表，不会重复
+    return {"key": key, "segments": len(segments), "lines": len(extra)}
+
+def merge_spool(key: str) -> dict:
+    """把 key 的分段并入主表（幂等，lease 内进行）；返回 { key, segments, lines }"""
+    with _table_lease(key):
+        return _merge_spool_locked(key)
+
+def merge_spools(keys=None) -> dict:
+    """合并全部（或指定）spool 表；供定时触发器调用"""
+    out = {"tables": [], "errors": []}
+    for key in sorted(keys or DB_SPOOL_KEYS):
+        try:
+            out["tables"].append(merge_spool(key))
+        except Exception as e:
+            out["errors"].append({"key": key, "error": str(e)})
+    return out
+
+def _read_table_for_write(key: str) -> str:
+    """整表读-改-写前调用（调用方已持有 _table_lease(key)）：spool 表先把分段并入主表"""
+    if _spooled(key):
+        _merge_spool_locked(key)
+    return _read_table(key)
+
+# ========== 组提交（单次调用内的写缓冲） ==========
+# index.main_handler 在调用开始时开启 db_unit 作用域，返回前 flush_unit()：
+# 本次调用内的 append / upsert / write_json 先按 key 缓冲（第一次写入时才建缓冲），结束时每个 key 只做一次“读-改-写”，
+# 不同 key 之间并发（DB_FLUSH_WORKERS）。同一调用内读取有待写内容的 key 时先单独刷该 key（读己之写）。
+# 缓冲属于调用的作用域（contextvar），不是模块全局：线程池 worker 要经 db_unit.propagate() 带上作用域才会并入。
+# 没有作用域（预热/快照等入口、未带作用域的 worker、或 DB_GROUP_COMMIT=0）时照旧逐次直写。
+# best_effort=True 的写入失败只记入报告，不让整个请求失败（与原先调用方吞掉异常的语义一致）。
+# 调用结束时刷出失败会把响应改成 500，此时 handler 的其他副作用已经发生：
+# 有不可撤销副作用（投递收件箱、通知等）的 handler 要在副作用之前调用 commit()，
+# 让必须落盘的写入先写出、失败时在副作用发生前返回错误；之后缓冲的只剩 best_effort 写入。
+
+DB_GROUP_COMMIT  = os.environ.get("DB_GROUP_COMMIT", "1").lower() in ("1", "true", "yes")
+DB_FLUSH_WORKERS = int(os.environ.get("DB_FLUSH_WORKERS", "8"))
+
+def begin_unit() -> None:
+    """在当前上下文开启作用域（不经 index.main_handler 的入口/脚本用；之后必须 flush_unit()）"""
+    db_unit.begin()
+
+def _buffer(key: str, op: tuple) -> bool:
+    """当前上下文有打开的作用域时缓冲写操作并返回 True；否则返回 False 由调用方直写"""
+    scope = db_unit.current()
+    if scope is None or not DB_GROUP_COMMIT:
+        return False
+    with scope.lock:
+        if scope.closed:
+            return False
+        if scope.ops is None:
+            scope.ops = OrderedDict()
+        scope.ops.setdefault(key, []).append(op)
+        return True
+
+def _take(key: str = None, close: bool = False):
+    """取走当前作用域里某个 key（None 表示全部）的缓冲操作"""
+    scope = db_unit.current()
+    if scope is None:
+        return None
+    with scope.lock:
+        if close:
+            scope.closed = True
+        if not scope.ops:
+            return None
+        if key is not None:
+            return scope.ops.pop(key, None)
+        pending, scope.ops = scope.ops, None
+        return pending
+
+def _flush_pending(key: str) -> None:
+    ops = _take(key)
+    if ops:
+        _flush_key(key, ops)
+
+def _flush_key(key: str, ops: list) -> None:
+    """把同一 key 的缓冲操作按顺序合并成一次写入"""
+    if ops[-1][0] == "json":
+        put_text(key, ops[-1][1], content_type="application/json")
+        return
+    if all(op[0] == "append" for op in ops):
+        _append_bytes(key, b"".join(op[1] for op in ops))
+        return
+    with _table_lease(key):
+        rows = [json.loads(ln) for ln in _read_table_for_write(key).splitlines() if ln.strip()]
+        for op in ops:
+            if op[0] == "append":
+                rows.append(json.loads(op[1]))
+            else:
+                _apply_upsert(rows, op[1], op[2], op[3])
+        _write_rows(key, rows)
+
+def flush_unit() -> dict:
+    """
+    刷出当前作用域的缓冲并关闭作用域（之后的写入直写）。
+    返回 { keys, ops, ms, errors:[{key, error, best_effort}] }；没有作用域或没有写入时 keys=0。
+    """
+    return _flush_ops(_take(close=True))
+
+def commit() -> dict:
+    """
+    立即写出本次调用到目前为止缓冲的写入（作用域保持打开，之后的写入继续缓冲）。
+    非 best_effort 的写入失败时抛 RuntimeError；没有作用域时什么也不做。返回同 flush_unit()。
+    """
+    report = _flush_ops(_take())
+    fatal = [e for e in report["errors"] if not e["best_effort"]]
+    if fatal:
+        raise RuntimeError("storage write failed: " + ", ".join(e["key"] for e in fatal))
+    return report
+
+def _flush_ops(pending) -> dict:
+    report = {"keys": 0, "ops": 0, "ms": 0.0, "errors": []}
+    if not pending:
+        return report
+    t = time.perf_counter()
+    report["keys"] = len(pending)
+    report["ops"] = sum(len(v) for v in pending.values())
+
+    def _one(item):
+        key, ops = item
+        try:
+            _flush_key(key, ops)
+        except Exception as e:
+            return {"key": key, "error": str(e), "best_effort": all(op[-1] for op in ops)}
+        return None
+
+    workers = max(1, min(DB_FLUSH_WORKERS, len(pending)))
+    if workers == 1:
+        results = [_one(x) for x in pending.items()]
+    else:
+        with ThreadPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(_one, pending.items()))
+    report["errors"] = [r for r in results if r]
+    report["ms"] = round((time.perf_counter() - t) * 1000, 1)
+    return report
+
+# ========== NDJSON（逐行 JSON） ==========
+
+def _append_bytes(key: str, data: bytes) -> None:
+    if _spoolable(key, data):
+        _spool_put(key, data)
+        return
+    raw = _read_raw(key)
+    if not raw:
+        # 文件不存在时，从空开始
+        _write_table(key, data)
+        return
+    plain, members = _decode(raw)
+    if NDJSON_GZIP and 0 < members < NDJSON_MAX_SEGMENTS:
+        put_bytes(key, raw + _encode(data), content_type=NDJSON_CONTENT_TYPE)
+    else:
+        # 未压缩的旧表（迁移）/ 分段过多（重压）/ 关闭压缩（回退为明文）
+        _write_table(key, plain + data)
+
+def _apply_upsert(rows: list, id_field: str, id_value: str, updater) -> None:
+    for it in rows:
+        if it.get(id_field) == id_value:
+            updater(it)
+            return
+    it = {id_field: id_value}
+    updater(it)
+    rows.append(it)
+
+def _write_rows(key: str, rows: list) -> None:
+    new_text = "\n".join(json.dumps(x, ensure_ascii=False) for x in rows) + "\n"
+    _write_table(key, new_text.encode("utf-8"))
+
+def append_json_line(key: str, record: dict, best_effort: bool = False) -> None:
+    """
+    读取旧内容 + 追加一行 JSON + 回写。
+    A 阶段并发低，直接全量回写即可；gzip 表只压缩新增的一行。组提交开启时先缓冲。
+    """
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    if _buffer(key, ("append", line, best_effort)):
+        return
+    _append_bytes(key, line)
 
 def read_lines(key: str, limit: Optional[int] = None) -> List[str]:
     """
-    读取 NDJSON 文本，返回行列表（原样字符串）。
-    可选 limit：返回最后 N 行。
+    读取 NDJSON 文本（自动识别 gzip），返回行列表（原样字符串）。
+    可选 limit：返回最后 N 行。对象不存在返回 []，其他读失败抛出。
     """
-    try:
-        text = get_text(key)
-    except Exception:
-        return []
+    _flush_pending(key)
+    text = _read_table_with_spool(key) if _spooled(key) else _read_table(key)
     lines = [ln for ln in text.splitlines() if ln.strip()]
     if limit and limit > 0:
         return lines[-limit:]
     return lines
 
-def upsert_json_line(key: str, id_field: str, id_value: str, updater) -> None:
+def write_ndjson(key: str, text: str) -> None:
+    """整表覆盖写（按当前 NDJSON_GZIP 设置编码）；之前缓冲的同 key 操作作废"""
+    _take(key)
+    with _table_lease(key):
+        if _spooled(key):
+            _merge_spool_locked(key)
+        _write_table(key, text.encode("utf-8"))
+
+def upsert_json_line(key: str, id_field: str, id_value: str, updater, best_effort: bool = False) -> None:
     """
     读取 NDJSON → 查找 id_field=id_value 的对象 → 调用 updater(it) 修改/补充 →
-    全量回写（不存在则新增）。
+    全量回写（不存在则新增）。组提交开启时先缓冲，updater 在刷出时调用。
     """
-    # 读取
-    try:
-        text = get_text(key)
-        rows = [json.loads(ln) for ln in text.splitlines() if ln.strip()]
-    except Exception:
-        rows = []
+    if _buffer(key, ("upsert", id_field, id_value, updater, best_effort)):
+        return
+    with _table_lease(key):
+        rows = [json.loads(ln) for ln in _read_table_for_write(key).splitlines() if ln.strip()]
+        _apply_upsert(rows, id_field, id_value, updater)
+        _write_rows(key, rows)
 
-    found = False
-    for it in rows:
-        if it.get(id_field) == id_value:
-            updater(it)
-            found = True
-            break
-    if not found:
-        it = {id_field: id_value}
-        updater(it)
-        rows.append(it)
-
-    # 回写
-    new_text = "\n".join(json.dumps(x, ensure_ascii=False) for x in rows) + "\n"
-    put_text(key, new_text, content_type="application/x-ndjson")
+def migrate_ndjson(prefix: str = "db/", dry_run: bool = False, compress: bool = True) -> dict:
+    """
+    把 prefix 下未压缩 / 分段过多的 .ndjson 表重写为单个 gzip member；
+    compress=False 时反过来把 gzip 表解压回明文（回退用）。分阶段切换的步骤见上方“NDJSON 存储格式”。
+    返回 { scanned, migrated, bytes_before, bytes_after, errors }
+    """
+    out = {"scanned": 0, "migrated": 0, "bytes_before": 0, "bytes_after": 0, "errors": []}
+    for obj in list_objects(prefix):
+        key = obj["key"]
+        if not key.endswith(".ndjson") or key.startswith(SPOOL_PREFIX):
+            continue
+        out["scanned"] += 1
+        try:
+            raw = _read_raw(key)
+            if not raw:
+                continue
+            plain, members = _decode(raw)
+            if (members == 1) if compress else (members == 0):
+                continue
+            packed = _encode(plain) if compress else plain
+            out["migrated"] += 1
+            out["bytes_before"] += len(raw)
+            out["bytes_after"] += len(packed)
+            if not dry_run:
+                put_bytes(key, packed, content_type=NDJSON_CONTENT_TYPE)
+        except Exception as e:
+            out["errors"].append({"key": key, "error": str(e)})
+    return out
 
 # ====== 与你旧工具兼容的别名（如旧代码使用 ndjson_* 命名） ======
 def ndjson_append(key: str, record: dict) -> None:
     append_json_line(key, record)
 
 def ndjson_all(key: str):
-    try:
-        text = get_text(key)
-        return [json.loads(ln) for ln in text.splitlines() if ln.strip()]
-    except Exception:
-        return []
+    return [json.loads(ln) for ln in read_lines(key)]
 
 def ndjson_upsert(key: str, id_field: str, id_value: str, updater) -> None:
     upsert_json_line(key, id_field, id_value, updater)
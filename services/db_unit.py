@@ -0,0 +1,41 @@
+# services/db_unit.py
+# 组提交（见 db_index“组提交”一节）的调用级作用域，绑定在 contextvar 上：
+#   - index.main_handler 开头 begin()、结束时 end()；本模块不依赖 db_index，/ping 等路由只多一个空对象
+#   - 缓冲在 db_index 第一次写入时才在作用域里建立，与 db_index 何时被 import 无关
+#   - 线程池 worker 不继承 contextvar：要让 worker 的读写归入本次调用，提交时用 propagate(fn) 显式带上作用域；
+#     没带上的 worker 看不到作用域，照旧直写直读
+
+import contextvars, threading
+
+class Scope:
+    """一次调用的写缓冲；ops 由 db_index 维护（key -> [op, ...]），None 表示还没有写入"""
+    __slots__ = ("lock", "ops", "closed")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = None
+        self.closed = False
+
+_current = contextvars.ContextVar("db_unit_scope", default=None)
+
+def begin():
+    """在当前上下文开启新作用域，返回 end() 用的 token"""
+    return _current.set(Scope())
+
+def end(token) -> None:
+    _current.reset(token)
+
+def current():
+    return _current.get()
+
+def propagate(fn):
+    """把调用方当前的作用域带进 fn（提交给线程池前包一层）"""
+    scope = _current.get()
+
+    def _run(*args, **kwargs):
+        token = _current.set(scope)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current.reset(token)
+    return _run
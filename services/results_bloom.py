@@ -0,0 +1,200 @@
+# services/results_bloom.py
+# /results/<id> 轮询的存在性索引，单个对象 db/idx/results_bloom.bin：
+#   - Bloom 过滤器：已有结果（scored / stt_failed）的 submission_id
+#   - 待评分状态表：只放 pending 的 id
+# 索引只由定时任务 rebuild()（index.snapshot_handler）从主表整体生成，请求路径上不写 COS、不抢 lease：
+#   - 读：lookup() 只查本容器的快照，不发请求；快照超过 RESULTS_BLOOM_REFRESH_S 时在后台线程条件 GET 刷新
+#   - 写：mark_scored() 只更新本容器快照（本容器评分的 id 立即不再报 pending）
+# 陈旧上限：其他容器评分的 id，最多在“定时周期 + RESULTS_BLOOM_REFRESH_S”内仍被回答 pending；
+# 快照超过 RESULTS_BLOOM_MAX_STALE_S 没刷新成功时不再回答 pending（走原来的 HEAD 路径）。
+# 上次 rebuild 之后才提交的 id 不在状态表里，同样走 HEAD 路径，不会误报。
+
+import os, time, json, struct, hashlib, threading, datetime
+from collections import OrderedDict
+from services import cos_client
+from services import db_index
+from services import retry
+
+RESULTS_BLOOM_KEY   = os.environ.get("RESULTS_BLOOM_KEY", "db/idx/results_bloom.bin")
+RESULTS_BLOOM_BITS  = int(os.environ.get("RESULTS_BLOOM_BITS", str(1 << 20)))  # 128KB，约 10 万个 id 时误判 ~1%
+RESULTS_BLOOM_HASHES = int(os.environ.get("RESULTS_BLOOM_HASHES", "7"))
+RESULTS_BLOOM_REFRESH_S = float(os.environ.get("RESULTS_BLOOM_REFRESH_S", "15"))     # 快照后台刷新间隔（秒）
+RESULTS_BLOOM_MAX_STALE_S = float(os.environ.get("RESULTS_BLOOM_MAX_STALE_S", "120"))  # 超过则不再回答 pending
+RESULTS_PENDING_MAX_DAYS = int(os.environ.get("RESULTS_PENDING_MAX_DAYS", "30"))  # 更早的 pending 不进状态表
+
+MAGIC = b"RBLM2"
+_HEADER = struct.Struct("<QIII")   # m, k, count, 状态表 JSON 字节数
+
+_lock = threading.Lock()
+_cached = {"index": None, "etag": None, "checked_at": 0.0, "refreshing": False}
+_scored_here = OrderedDict()   # 本容器评分过的 id：刷新到尚未重建的旧对象时也不再报 pending
+_SCORED_HERE_MAX = 5000
+_stats = {"skipped_head": 0, "maybe": 0, "unknown": 0, "stale": 0, "refresh": 0, "not_modified": 0,
+          "refresh_failed": 0}
+
+# ========= Bloom 过滤器 =========
+
+class BloomFilter:
+    def __init__(self, m: int = None, k: int = None, bits: bytearray = None, count: int = 0):
+        self.m = max(8, m or RESULTS_BLOOM_BITS)
+        self.k = max(1, k or RESULTS_BLOOM_HASHES)
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+        self.count = count
+
+    def _positions(self, item: str):
+        # 双重散列：h1 + i*h2（Kirsch–Mitzenmacher），只算一次摘要
+        d = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", d)
+        h2 |= 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def add(self, item: str) -> bool:
+        """返回是否有新置位的 bit"""
+        changed = False
+        for p in self._positions(item):
+            byte, bit = p >> 3, 1 << (p & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                changed = True
+        if changed:
+            self.count += 1
+        return changed
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(item))
+
+class ResultsIndex:
+    """过滤器 + 状态表，整体序列化为一个对象"""
+    def __init__(self, bloom: BloomFilter = None, pending: dict = None):
+        self.bloom = bloom or BloomFilter()
+        self.pending = pending or {}
+
+    def to_bytes(self) -> bytes:
+        p = json.dumps(self.pending, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        b = self.bloom
+        return MAGIC + _HEADER.pack(b.m, b.k, b.count, len(p)) + bytes(b.bits) + p
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "ResultsIndex":
+        if not raw.startswith(MAGIC):
+            raise ValueError("not a results bloom index")
+        m, k, count, plen = _HEADER.unpack_from(raw, len(MAGIC))
+        start = len(MAGIC) + _HEADER.size
+        nbytes = (m + 7) // 8
+        bits = bytearray(raw[start:start + nbytes])
+        pending = json.loads(raw[start + nbytes:start + nbytes + plen] or b"{}")
+        return cls(BloomFilter(m, k, bits, count), pending)
+
+# ========= 快照（热容器内，后台刷新） =========
+
+def refresh() -> None:
+    """条件 GET 刷新本容器快照（未变化时只有一次无 body 的往返）；失败抛出"""
+    with _lock:
+        etag = _cached["etag"] if _cached["index"] is not None else None
+    checked = time.monotonic()   # 以发请求前的时刻计，保守
+    try:
+        raw, new_etag = cos_client.get_if_changed(RESULTS_BLOOM_KEY, etag)
+    except Exception as e:
+        if not retry.is_not_found(e):
+            raise
+        raw, new_etag = ResultsIndex().to_bytes(), None
+    idx = ResultsIndex.from_bytes(raw) if raw is not None else None
+    with _lock:
+        if idx is None:
+            _stats["not_modified"] += 1
+        else:
+            _stats["refresh"] += 1
+            _cached["index"], _cached["etag"] = idx, new_etag
+        _cached["checked_at"] = checked
+
+def _refresh_bg() -> None:
+    try:
+        refresh()
+    except Exception as e:
+        _stats["refresh_failed"] += 1
+        print(f"[results_bloom] refresh failed: {e}")
+    finally:
+        with _lock:
+            _cached["refreshing"] = False
+
+def _snapshot():
+    """返回 (快照, 距上次核对的秒数)；到期时触发一次后台刷新（同一时刻最多一个），本次不等待"""
+    with _lock:
+        idx = _cached["index"]
+        age = time.monotonic() - _cached["checked_at"] if idx is not None else None
+        start = (age is None or age >= RESULTS_BLOOM_REFRESH_S) and not _cached["refreshing"]
+        if start:
+            _cached["refreshing"] = True
+    if start:
+        threading.Thread(target=_refresh_bg, name="results-bloom-refresh", daemon=True).start()
+    return idx, age
+
+# ========= 查询 =========
+
+def lookup(submission_id: str):
+    """
+    "pending"：确定尚未评分（可跳过 HEAD）
+    None：可能已评分 / 未知 / 快照尚未加载或过旧，调用方走原路径
+    """
+    idx, age = _snapshot()
+    if submission_id in _scored_here:
+        _stats["maybe"] += 1
+        return None
+    if idx is None or age > RESULTS_BLOOM_MAX_STALE_S:
+        _stats["stale"] += 1
+        return None
+    if submission_id in idx.bloom:
+        _stats["maybe"] += 1
+        return None
+    if (idx.pending.get(submission_id) or {}).get("status") == "pending":
+        _stats["skipped_head"] += 1
+        return "pending"
+    _stats["unknown"] += 1
+    return None
+
+# ========= 维护 =========
+
+def mark_scored(submission_id: str):
+    """评分结果写出后调用（scored / stt_failed 都算有结果）：只更新本容器快照，不写 COS"""
+    if not submission_id:
+        return
+    with _lock:
+        _scored_here[submission_id] = True
+        while len(_scored_here) > _SCORED_HERE_MAX:
+            _scored_here.popitem(last=False)
+        idx = _cached["index"]
+        if idx is not None:
+            idx.bloom.add(submission_id)
+            idx.pending.pop(submission_id, None)
+
+def rebuild(submissions_key: str = "db/submissions.ndjson", results_key: str = "db/results.ndjson") -> dict:
+    """
+    按主表整体重建索引（只看主表，已删除/过期 id 的位随之清掉），定时任务调用。
+    先读提交表、后读结果表：读提交表期间评分的 id 也在结果表里，不会被记成 pending；
+    读结果表之后才评分的 id 留到下一次重建。
+    """
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=RESULTS_PENDING_MAX_DAYS)).isoformat()
+    candidates = {}
+    for s in db_index.ndjson_all(submissions_key):
+        sid = s.get("id")
+        if sid and (s.get("status") or "pending") == "pending" and (s.get("created_at") or "") >= cutoff:
+            candidates[sid] = s.get("created_at") or ""
+    scored = set()
+    for r in db_index.ndjson_all(results_key):
+        sid = r.get("submission_id")
+        if sid:
+            scored.add(sid)
+
+    b = BloomFilter()
+    for sid in scored:
+        b.add(sid)
+    pending = {sid: {"status": "pending", "at": at} for sid, at in candidates.items() if sid not in scored}
+    idx = ResultsIndex(b, pending)
+    etag = cos_client.put_bytes(RESULTS_BLOOM_KEY, idx.to_bytes(), content_type="application/octet-stream")
+    with _lock:
+        _cached["index"], _cached["etag"], _cached["checked_at"] = idx, etag, time.monotonic()
+    return {"key": RESULTS_BLOOM_KEY, "ids": len(scored), "bits": b.m, "hashes": b.k,
+            "bytes": len(b.bits), "pending": len(pending)}
+
+def stats() -> dict:
+    return dict(_stats)
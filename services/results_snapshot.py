@@ -0,0 +1,245 @@
+# services/results_snapshot.py
+# 评分结果的列式快照：db/results.ndjson（+ submissions.ndjson 补 assignment_id）→ db/snapshots/results.col
+# 老师端看板的聚合（每份作业的平均 overall、WER 分布）只需按列读取，不再逐行 json.loads 整张表。
+#
+# 文件格式（小端）：
+#   b"RCOL1\n" | uint32 头长度 | 头 JSON | 各列数据
+#   头 JSON：{ rows, built_at, columns: { name: {dtype, offset, length[, dict]} } }
+#   dtype：f4 = float32（缺失为 NaN）/ i8 = int64（scored_at 的 epoch 秒，缺失为 0）
+#          u4 = uint32 字典编码（dict 为取值表）/ str = UTF-8，\n 分隔
+# 读取：先 Range GET 头，再只 Range GET 需要的列；有 NumPy 时列为 ndarray，否则为 array.array
+# 列的 Range GET 都带 If-Match（头所在版本的 ETag）：快照被其他容器重建后返回 412，头和列一起重新加载，
+# 不会按旧偏移去读新文件。
+
+import os, sys, json, time, struct, datetime, threading
+from array import array
+from services import cos_client
+from services import db_index
+from services import retry
+
+try:
+    import numpy as np  # 可选：有则用向量化聚合
+except ImportError:
+    np = None
+
+SNAPSHOT_KEY       = os.environ.get("RESULTS_SNAPSHOT_KEY", "db/snapshots/results.col")
+SNAPSHOT_CACHE_TTL = float(os.environ.get("RESULTS_SNAPSHOT_CACHE_TTL", "60"))  # 热容器内列缓存（秒）
+
+MAGIC = b"RCOL1\n"
+_HEAD_PROBE = 64 * 1024   # 第一次 Range GET 的长度，通常已包含完整头部
+_TYPECODES = {"f4": "f", "i8": "q", "u4": "I"}
+_NP_DTYPES = {"f4": "<f4", "i8": "<i8", "u4": "<u4"}
+WER_BINS = [0.0, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0]  # 最后一档为 ≥1.0
+
+_lock = threading.Lock()
+_snap = None   # 同一版本的头和已读列作为一个整体缓存：{ head, etag, at, columns: {name: (values, dict)} }
+
+# ========= 构建 =========
+
+def _epoch(iso: str) -> int:
+    if not iso:
+        return 0
+    try:
+        return int(datetime.datetime.fromisoformat(iso.replace("Z", "+00:00")).timestamp())
+    except Exception:
+        return 0
+
+def _float(v) -> float:
+    try:
+        return float(v) if v is not None else float("nan")
+    except (TypeError, ValueError):
+        return float("nan")
+
+def _pack(typecode: str, values) -> bytes:
+    a = array(typecode, values)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a.tobytes()
+
+def build(results_key: str = "db/results.ndjson", submissions_key: str = "db/submissions.ndjson") -> dict:
+    """
+    读取结果表并写出快照；同一 submission_id 多次评分以最后一行为准。
+    旧结果行没有 assignment_id 时按 submissions 表补齐；没有 WER 的记为 NaN。
+    """
+    t0 = time.perf_counter()
+    latest = {}
+    for r in db_index.ndjson_all(results_key):
+        sid = r.get("submission_id")
+        if sid:
+            latest[sid] = r
+    aid_of = {}
+    if any(not r.get("assignment_id") for r in latest.values()):
+        aid_of = {s.get("id"): s.get("assignment_id") for s in db_index.ndjson_all(submissions_key)}
+
+    rows = list(latest.values())
+    sids = [r["submission_id"] for r in rows]
+    aids = [r.get("assignment_id") or aid_of.get(r["submission_id"]) or "" for r in rows]
+    aid_dict = sorted(set(aids))
+    code = {a: i for i, a in enumerate(aid_dict)}
+
+    blobs = [
+        ("submission_id", "str", "\n".join(sids).encode("utf-8"), None),
+        ("assignment_id", "u4", _pack("I", [code[a] for a in aids]), aid_dict),
+        ("overall",       "f4", _pack("f", [_float(r.get("overall")) for r in rows]), None),
+        ("wer",           "f4", _pack("f", [_float(r.get("wer")) for r in rows]), None),
+        ("scored_at",     "i8", _pack("q", [_epoch(r.get("scored_at")) for r in rows]), None),
+    ]
+    # 列偏移相对数据区起点，头长度变化不影响
+    cols, offset = {}, 0
+    for name, dtype, blob, d in blobs:
+        cols[name] = {"dtype": dtype, "offset": offset, "length": len(blob)}
+        if d is not None:
+            cols[name]["dict"] = d
+        offset += len(blob)
+    head = json.dumps({"rows": len(rows), "built_at": datetime.datetime.utcnow().isoformat() + "Z",
+                       "columns": cols}, ensure_ascii=False).encode("utf-8")
+    data = MAGIC + struct.pack("<I", len(head)) + head + b"".join(b for _, _, b, _ in blobs)
+    cos_client.put_bytes(SNAPSHOT_KEY, data, content_type="application/octet-stream")
+    invalidate()
+    return {"key": SNAPSHOT_KEY, "rows": len(rows), "bytes": len(data),
+            "assignments": len(aid_dict), "ms": round((time.perf_counter() - t0) * 1000, 1)}
+
+# ========= 读取 =========
+
+def invalidate():
+    global _snap
+    with _lock:
+        _snap = None
+
+def _read_header():
+    """返回 (头, ETag)；头超过探测长度时补读的部分也钉在同一 ETag 上"""
+    probe, etag = cos_client.get_range(SNAPSHOT_KEY, 0, _HEAD_PROBE, with_etag=True)
+    if not probe.startswith(MAGIC):
+        raise ValueError("not a results snapshot")
+    n = struct.unpack("<I", probe[len(MAGIC):len(MAGIC) + 4])[0]
+    start = len(MAGIC) + 4
+    if start + n > len(probe):
+        probe += cos_client.get_range(SNAPSHOT_KEY, len(probe), start + n - len(probe), if_match=etag)
+    head = json.loads(probe[start:start + n].decode("utf-8"))
+    head["data_start"] = start + n
+    return head, etag
+
+def _decode_column(meta: dict, blob: bytes):
+    dtype = meta["dtype"]
+    if dtype == "str":
+        return blob.decode("utf-8").split("\n") if blob else []
+    if np is not None:
+        return np.frombuffer(blob, dtype=_NP_DTYPES[dtype])
+    a = array(_TYPECODES[dtype])
+    a.frombytes(blob)
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def _load_once(columns) -> dict:
+    global _snap
+    now = time.monotonic()
+    with _lock:
+        snap = _snap if _snap and now - _snap["at"] < SNAPSHOT_CACHE_TTL else None
+    if snap is None:
+        head, etag = _read_header()
+        snap = {"head": head, "etag": etag, "at": now, "columns": {}}
+        with _lock:
+            _snap = snap
+    head = snap["head"]
+    out = {"_dict": {}, "_rows": head["rows"], "_built_at": head.get("built_at")}
+    for name in columns:
+        meta = head["columns"].get(name)
+        if meta is None:
+            raise KeyError(f"unknown column: {name}")
+        hit = snap["columns"].get(name)
+        if hit is None:
+            blob = cos_client.get_range(SNAPSHOT_KEY, head["data_start"] + meta["offset"], meta["length"],
+                                        if_match=snap["etag"])
+            hit = (_decode_column(meta, blob), meta.get("dict"))
+            with _lock:
+                snap["columns"][name] = hit
+        out[name] = hit[0]
+        if hit[1] is not None:
+            out["_dict"][name] = hit[1]
+    return out
+
+def load(columns) -> dict:
+    """
+    只读取需要的列，返回 { name: 列数据, "_dict": {name: 取值表}, "_rows": 行数 }。
+    热容器内缓存 SNAPSHOT_CACHE_TTL 秒；快照被重建（列读取 412）时丢弃整份缓存重读一次。
+    """
+    try:
+        return _load_once(columns)
+    except Exception as e:
+        if not retry.is_precondition_failed(e):
+            raise
+    invalidate()
+    return _load_once(columns)
+
+# ========= 聚合 =========
+
+def _wer_summary(values) -> dict:
+    vals = sorted(v for v in values if v == v)   # 去掉 NaN
+    hist = [0] * len(WER_BINS)
+    for v in vals:
+        i = min(int(v * 10), len(WER_BINS) - 1) if v >= 0 else 0
+        hist[i] += 1
+    if not vals:
+        return {"n": 0, "mean": None, "p50": None, "p90": None, "bins": WER_BINS, "hist": hist}
+    return {
+        "n": len(vals),
+        "mean": round(sum(vals) / len(vals), 4),
+        "p50": round(vals[len(vals) // 2], 4),
+        "p90": round(vals[min(len(vals) - 1, int(len(vals) * 0.9))], 4),
+        "bins": WER_BINS,
+        "hist": hist,
+    }
+
+def assignment_stats(assignment_id: str = None) -> dict:
+    """
+    每份作业：{ count, scored, avg_overall, wer:{n, mean, p50, p90, bins, hist} }
+    assignment_id 为空时返回全部作业。
+    """
+    cols = load(["assignment_id", "overall", "wer"])
+    names = cols["_dict"]["assignment_id"]
+    codes, overall, wer = cols["assignment_id"], cols["overall"], cols["wer"]
+    want = None
+    if assignment_id:
+        if assignment_id not in names:
+            return {}
+        want = names.index(assignment_id)
+
+    out = {}
+    if np is not None:
+        ok_mask = ~np.isnan(overall)
+        count = np.bincount(codes, minlength=len(names))
+        scored = np.bincount(codes, weights=ok_mask, minlength=len(names))
+        sums = np.bincount(codes, weights=np.where(ok_mask, overall, 0.0), minlength=len(names))
+        # 按作业分组 WER：一次稳定排序后按计数切片，避免每份作业扫一遍全表
+        wer_sorted = wer[np.argsort(codes, kind="stable")]
+        ends = np.cumsum(count)
+        for i, name in enumerate(names):
+            if (want is not None and i != want) or not count[i]:
+                continue
+            out[name] = {
+                "count": int(count[i]),
+                "scored": int(scored[i]),
+                "avg_overall": round(float(sums[i] / scored[i]), 2) if scored[i] else None,
+                "wer": _wer_summary(wer_sorted[ends[i] - count[i]:ends[i]].tolist()),
+            }
+        return out
+
+    acc = {}
+    for c, o, w in zip(codes, overall, wer):
+        if want is not None and c != want:
+            continue
+        a = acc.setdefault(c, [0, 0, 0.0, []])
+        a[0] += 1
+        if o == o:
+            a[1] += 1
+            a[2] += o
+        a[3].append(w)
+    for c, (count, scored, total, wers) in acc.items():
+        out[names[c]] = {
+            "count": count,
+            "scored": scored,
+            "avg_overall": round(total / scored, 2) if scored else None,
+            "wer": _wer_summary(wers),
+        }
+    return out
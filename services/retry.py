@@ -0,0 +1,155 @@
+# services/retry.py
+# COS 调用的重试策略：指数退避 + full jitter + 单次调用（invocation）截止时间预算 + 容器级重试预算
+# 约定：
+# - index.main_handler 开头调用 begin_invocation(context)，按 SCF 剩余时间推出本次调用的截止时刻
+# - 只重试“瞬时”错误：网络/超时、429、5xx；404 等 4xx 直接抛出（is_not_found / is_precondition_failed / status_of 供调用方判错误类型）
+# - 非幂等操作（idempotent=False）不重试，避免重复副作用
+# - 重试预算：成功调用攒 token，每次重试消耗 1 个，下游整体故障时不会放大成重试风暴
+
+import os, time, random, threading
+
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "4"))     # 含首次
+RETRY_BASE_MS      = int(os.environ.get("RETRY_BASE_MS", "50"))
+RETRY_CAP_MS       = int(os.environ.get("RETRY_CAP_MS", "2000"))
+DEADLINE_RESERVE_MS = int(os.environ.get("DEADLINE_RESERVE_MS", "800"))  # 给响应序列化/写日志留的余量
+RETRY_BUDGET_MAX   = float(os.environ.get("RETRY_BUDGET_MAX", "20"))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", "0.1"))  # 每次成功调用回补的 token
+
+_lock = threading.Lock()
+_deadline = None          # time.monotonic() 截止时刻；None 表示不限
+_budget = RETRY_BUDGET_MAX
+_stats = {"calls": 0, "retries": 0, "gave_up": 0, "budget_exhausted": 0}
+
+# ========= 截止时间 =========
+
+def begin_invocation(context=None):
+    """
+    按 SCF context 设置本次调用的截止时刻。兼容：
+      - 对象/字典带 get_remaining_time_in_millis()
+      - 字典带 time_limit_in_ms（SCF Python 运行时）
+    都没有时不设截止时间，只受 RETRY_MAX_ATTEMPTS 限制。
+    """
+    global _deadline
+    ms = None
+    try:
+        fn = getattr(context, "get_remaining_time_in_millis", None)
+        if callable(fn):
+            ms = float(fn())
+        elif isinstance(context, dict) and context.get("time_limit_in_ms"):
+            ms = float(context.get("time_limit_in_ms"))
+    except Exception:
+        ms = None
+    _deadline = (time.monotonic() + ms / 1000.0) if ms else None
+
+def remaining_ms():
+    """距截止时刻的毫秒数（已扣除余量）；未设置截止时间返回 None"""
+    if _deadline is None:
+        return None
+    return (_deadline - time.monotonic()) * 1000.0 - DEADLINE_RESERVE_MS
+
+# ========= 错误分类 =========
+
+def status_of(e):
+    """异常里的 HTTP 状态码（COS SDK / urllib），取不到返回 None"""
+    for attr in ("get_status_code", "getcode"):
+        fn = getattr(e, attr, None)
+        if callable(fn):
+            try:
+                return int(fn())
+            except Exception:
+                pass
+    code = getattr(e, "code", None) or getattr(e, "status", None)
+    return code if isinstance(code, int) else None
+
+def is_not_found(e) -> bool:
+    """COS 404 / NoSuchKey"""
+    if status_of(e) == 404:
+        return True
+    fn = getattr(e, "get_error_code", None)
+    try:
+        return callable(fn) and fn() in ("NoSuchKey", "NoSuchBucket")
+    except Exception:
+        return False
+
+def is_precondition_failed(e) -> bool:
+    """条件请求（If-Match 等）不满足：412"""
+    return status_of(e) == 412
+
+# COS SDK 把 requests 的网络异常统一包成 CosClientError(str(e))，没有子类可分，只能按消息判断；
+# 同一个类型也用于缺 SecretId、Bucket/Region 格式错误、签名参数错误等配置问题，这些重试无用
+_TRANSIENT_CLIENT_MARKERS = (
+    "timed out", "timeout", "connection aborted", "connection reset", "connection refused",
+    "connection broken", "remotedisconnected", "remote end closed", "incompleteread",
+    "newconnectionerror", "failed to establish a new connection", "temporary failure in name resolution",
+    "broken pipe", "protocolerror",
+)
+
+def _transient_client_error(e) -> bool:
+    msg = str(e).lower()
+    if "certificate" in msg:   # 证书校验失败是配置问题
+        return False
+    return any(m in msg for m in _TRANSIENT_CLIENT_MARKERS)
+
+def is_retryable(e) -> bool:
+    status = status_of(e)
+    if status is not None:
+        return status == 429 or status >= 500
+    # 无状态码：COS SDK 的 CosClientError（仅超时/连接失败）、socket/urllib 网络错误
+    name = type(e).__name__
+    if name == "CosClientError":
+        return _transient_client_error(e)
+    return name in ("URLError", "timeout", "TimeoutError",
+                    "ConnectionError", "ConnectionResetError", "RemoteDisconnected",
+                    "ProtocolError", "ReadTimeout", "ConnectTimeout", "IncompleteRead")
+
+# ========= 主入口 =========
+
+def _take_budget() -> bool:
+    global _budget
+    with _lock:
+        if _budget >= 1:
+            _budget -= 1
+            return True
+        _stats["budget_exhausted"] += 1
+        return False
+
+def _refill():
+    global _budget
+    with _lock:
+        _budget = min(RETRY_BUDGET_MAX, _budget + RETRY_BUDGET_RATIO)
+
+def call(fn, *args, idempotent=True, attempts=None, **kwargs):
+    """
+    执行 fn(*args, **kwargs)，瞬时错误按 full jitter 指数退避重试。
+    超出次数/截止时间/重试预算时抛出最后一次的异常。
+    """
+    attempts = max(1, attempts or RETRY_MAX_ATTEMPTS)
+    with _lock:
+        _stats["calls"] += 1
+    for i in range(attempts):
+        try:
+            out = fn(*args, **kwargs)
+            _refill()
+            return out
+        except Exception as e:
+            last = i == attempts - 1
+            if last or not idempotent or not is_retryable(e):
+                if is_retryable(e):
+                    with _lock:
+                        _stats["gave_up"] += 1
+                raise
+            sleep_ms = random.uniform(0, min(RETRY_CAP_MS, RETRY_BASE_MS * (2 ** i)))
+            left = remaining_ms()
+            if left is not None and left < sleep_ms:
+                with _lock:
+                    _stats["gave_up"] += 1
+                raise
+            if not _take_budget():
+                raise
+            with _lock:
+                _stats["retries"] += 1
+            time.sleep(sleep_ms / 1000.0)
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "budget": round(_budget, 2), "remaining_ms": remaining_ms()}
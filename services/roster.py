@@ -0,0 +1,225 @@
+# services/roster.py
+# 名册服务：老师名册（带 TTL 的进程内缓存）+ 学生 → 老师/班级 反向索引
+# 存储布局：
+#   db/roster/teachers/<teacher_id>.json  { students:[{student_id, class_id?}, ...], class_id? }
+#   db/roster/students/<student_id>.json  { student_id, teachers:[...], classes:[...], updated_at }
+# 说明：
+# - SCF 热容器内复用缓存，publish / inbox 不再每次下载名册 JSON
+# - 反向索引由 save_teacher_roster() 维护；手工上传的名册可用 rebuild_student_index() 补建
+# - “不存在”只缓存 ROSTER_MISS_TTL 秒：名册刚建好时，其他容器不会长时间当作没有名册（跳过收件箱投递）
+
+import os, time, datetime, threading
+from concurrent.futures import ThreadPoolExecutor
+from services import db_index
+from services import retry
+from services import db_unit
+
+TEACHER_DIR = "db/roster/teachers"
+STUDENT_DIR = "db/roster/students"
+
+ROSTER_CACHE_TTL = int(os.environ.get("ROSTER_CACHE_TTL", "300"))  # 秒；0 表示不缓存
+ROSTER_MISS_TTL  = int(os.environ.get("ROSTER_MISS_TTL", "5"))     # 名册/索引不存在时的缓存秒数
+ROSTER_WORKERS   = int(os.environ.get("ROSTER_WORKERS", "8"))      # 保存名册时并发读写学生索引
+
+_lock = threading.Lock()
+_teacher_cache = {}   # teacher_id -> (expire_at, roster_dict)
+_student_cache = {}   # student_id -> (expire_at, membership_dict)
+
+# ========= 小工具 =========
+
+def _iso_now():
+    return datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _cache_get(cache: dict, k: str):
+    with _lock:
+        hit = cache.get(k)
+    if hit and hit[0] > time.monotonic():
+        return hit[1]
+    return None
+
+def _cache_put(cache: dict, k: str, v, ttl: int = None):
+    ttl = ROSTER_CACHE_TTL if ttl is None else min(ttl, ROSTER_CACHE_TTL)
+    if ttl <= 0:
+        return
+    with _lock:
+        cache[k] = (time.monotonic() + ttl, v)
+
+def _cache_drop(cache: dict, k: str):
+    with _lock:
+        cache.pop(k, None)
+
+def _students_of(roster: dict):
+    """名册 → [(student_id, class_id), ...]（去空、去重，保持顺序）"""
+    default_class = str(roster.get("class_id") or "").strip()
+    out, seen = [], set()
+    for s in (roster.get("students") or []):
+        if isinstance(s, dict):
+            sid = str(s.get("student_id") or "").strip()
+            cid = str(s.get("class_id") or "").strip() or default_class
+        else:
+            sid, cid = str(s or "").strip(), default_class
+        if not sid or sid in seen:
+            continue
+        seen.add(sid)
+        out.append((sid, cid))
+    return out
+
+def _read_or_none(key: str):
+    """不存在返回 None；其他读失败抛出"""
+    try:
+        return db_index.read_json(key)
+    except Exception as e:
+        if retry.is_not_found(e):
+            return None
+        raise
+
+def _pmap(fn, items):
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(x) for x in items]
+    with ThreadPoolExecutor(max_workers=max(1, min(ROSTER_WORKERS, len(items)))) as ex:
+        return list(ex.map(db_unit.propagate(fn), items))
+
+# ========= 老师名册 =========
+
+def teacher_roster(teacher_id: str) -> dict:
+    """读取老师名册（带缓存）；不存在时返回 {}，只缓存 ROSTER_MISS_TTL 秒；读失败返回 {} 且不缓存。"""
+    teacher_id = (teacher_id or "").strip()
+    if not teacher_id:
+        return {}
+    hit = _cache_get(_teacher_cache, teacher_id)
+    if hit is not None:
+        return hit
+    try:
+        roster = _read_or_none(f"{TEACHER_DIR}/{teacher_id}.json")
+    except Exception:
+        return {}
+    if roster is None:
+        _cache_put(_teacher_cache, teacher_id, {}, ttl=ROSTER_MISS_TTL)
+        return {}
+    _cache_put(_teacher_cache, teacher_id, roster)
+    return roster
+
+def student_ids_of_teacher(teacher_id: str):
+    """老师名下全部学生 ID（不截断）"""
+    return [sid for sid, _ in _students_of(teacher_roster(teacher_id))]
+
+# ========= 学生反向索引 =========
+
+def memberships_of_student(student_id: str) -> dict:
+    """
+    返回：{ student_id, teachers:[...], classes:[...] }
+    反向索引不存在时返回空列表（只缓存 ROSTER_MISS_TTL 秒；读失败不缓存）。
+    """
+    student_id = (student_id or "").strip()
+    empty = {"student_id": student_id, "teachers": [], "classes": []}
+    if not student_id:
+        return empty
+    hit = _cache_get(_student_cache, student_id)
+    if hit is not None:
+        return hit
+    try:
+        data = _read_or_none(f"{STUDENT_DIR}/{student_id}.json")
+    except Exception:
+        return empty
+    if data is None:
+        _cache_put(_student_cache, student_id, empty, ttl=ROSTER_MISS_TTL)
+        return empty
+    m = {
+        "student_id": student_id,
+        "teachers": list(data.get("teachers") or []),
+        "classes": list(data.get("classes") or []),
+    }
+    _cache_put(_student_cache, student_id, m)
+    return m
+
+def _membership(data: dict, student_id: str, teacher_id: str, class_id: str, remove: bool,
+                old_class_id: str, kept_classes: set) -> dict:
+    """
+    由旧的索引记录算出新记录（纯计算）。old_class_id：换班时需移除的旧班级；
+    kept_classes：其他老师名册里该学生仍在的班级，移除班级时保留这些。
+    """
+    teachers = [t for t in (data.get("teachers") or []) if t != teacher_id]
+    classes = list(data.get("classes") or [])
+    drop = {c for c in (old_class_id, class_id if remove else "") if c} - kept_classes
+    classes = [c for c in classes if c not in drop]
+    if not remove:
+        teachers.append(teacher_id)
+        if class_id and class_id not in classes:
+            classes.append(class_id)
+    return {"student_id": student_id, "teachers": teachers, "classes": classes, "updated_at": _iso_now()}
+
+def _write_student_index(m: dict):
+    db_index.write_json(f"{STUDENT_DIR}/{m['student_id']}.json", m)
+    _cache_put(_student_cache, m["student_id"], {k: m[k] for k in ("student_id", "teachers", "classes")})
+
+def _apply_changes(teacher_id: str, changes: list):
+    """
+    changes: [(student_id, class_id, remove, old_class_id), ...]
+    并发读各学生的索引记录 → 需要移除班级时，一次性并发读涉及的其他老师名册（每位老师只读一次，
+    不用缓存：写路径上要看到最新名册）→ 内存里算出新记录 → 并发写回。
+    """
+    if not changes:
+        return
+    records = _pmap(lambda c: _read_or_none(f"{STUDENT_DIR}/{c[0]}.json") or {}, changes)
+
+    others = set()
+    for (_, cid, remove, old_cid), data in zip(changes, records):
+        if old_cid or (remove and cid):
+            others.update(t for t in (data.get("teachers") or []) if t != teacher_id)
+    others = sorted(others)
+    rosters = dict(zip(others, _pmap(lambda t: _read_or_none(f"{TEACHER_DIR}/{t}.json") or {}, others)))
+    placed = {}   # (teacher_id, student_id) -> class_id
+    for t, r in rosters.items():
+        for sid, cid in _students_of(r):
+            placed[(t, sid)] = cid
+
+    updated = []
+    for (sid, cid, remove, old_cid), data in zip(changes, records):
+        kept = {placed.get((t, sid)) for t in (data.get("teachers") or []) if t != teacher_id} - {None, ""}
+        updated.append(_membership(data, sid, teacher_id, cid, remove, old_cid, kept))
+    _pmap(_write_student_index, updated)
+
+def save_teacher_roster(teacher_id: str, roster: dict) -> dict:
+    """
+    写入老师名册并同步反向索引：
+      - 新增/仍在名册的学生：确保 teachers 含 teacher_id，classes 含其 class_id
+      - 被移出的学生：从其 teachers 中删掉 teacher_id；其他老师名册里仍有该班级时保留班级
+    返回：{ added, removed, total }
+    """
+    teacher_id = (teacher_id or "").strip()
+    if not teacher_id:
+        raise ValueError("teacher_id required")
+    old = _read_or_none(f"{TEACHER_DIR}/{teacher_id}.json") or {}
+    old_map = dict(_students_of(old))
+    new_list = _students_of(roster or {})
+    new_map = dict(new_list)
+
+    db_index.write_json(f"{TEACHER_DIR}/{teacher_id}.json", roster)
+    _cache_put(_teacher_cache, teacher_id, roster)
+
+    changes = [(sid, cid, False, old_map.get(sid, "")) for sid, cid in new_list
+               if not (sid in old_map and old_map[sid] == cid)]
+    added = len(changes)
+    removed = [(sid, cid, True, "") for sid, cid in old_map.items() if sid not in new_map]
+    _apply_changes(teacher_id, changes + removed)
+    return {"added": added, "removed": len(removed), "total": len(new_list)}
+
+def rebuild_student_index(teacher_id: str) -> int:
+    """为已有（手工上传的）名册补建反向索引；返回处理的学生数。"""
+    _cache_drop(_teacher_cache, teacher_id)
+    pairs = _students_of(teacher_roster(teacher_id))
+    _apply_changes(teacher_id, [(sid, cid, False, "") for sid, cid in pairs])
+    return len(pairs)
+
+def invalidate(teacher_id: str = None, student_id: str = None):
+    """丢弃本容器缓存（名册被外部修改时使用）；都不传则清空全部。"""
+    if teacher_id is None and student_id is None:
+        with _lock:
+            _teacher_cache.clear()
+            _student_cache.clear()
+        return
+    if teacher_id:
+        _cache_drop(_teacher_cache, teacher_id)
+    if student_id:
+        _cache_drop(_student_cache, student_id)
@@ -0,0 +1,74 @@
+# services/sign_cache.py
+# /cos/resign 热路径的进程内缓存（SCF 热容器复用）：
+#   1) 预签名 URL 缓存：key -> (url, 过期时刻)，剩余有效期 ≥ RESIGN_REUSE_FRACTION 时直接复用
+#   2) “已知存在”key 集合：TTS 缓存命中/写入、作业详情、提交落盘时登记，resign 可跳过 HEAD
+# 纯内存、无 COS 依赖，新旧代码都可直接 import
+
+import os, time, threading
+from collections import OrderedDict
+
+RESIGN_REUSE_FRACTION = float(os.environ.get("RESIGN_REUSE_FRACTION", "0.5"))  # 0~1；1 表示不复用
+SIGN_CACHE_MAX = int(os.environ.get("SIGN_CACHE_MAX", "5000"))
+KNOWN_KEYS_MAX = int(os.environ.get("KNOWN_KEYS_MAX", "20000"))
+
+_lock = threading.Lock()
+_urls = OrderedDict()    # key -> (url, expire_at, expires)
+_known = OrderedDict()   # key -> True（LRU）
+_stats = {"hit": 0, "miss": 0, "known_hit": 0}
+
+# ========= 预签名 URL =========
+
+def get_url(key: str, expires: int):
+    """命中且剩余有效期足够时返回 (url, 剩余秒数)，否则 None"""
+    now = time.time()
+    with _lock:
+        hit = _urls.get(key)
+        if hit and hit[2] == expires:
+            remaining = hit[1] - now
+            if remaining >= expires * RESIGN_REUSE_FRACTION:
+                _urls.move_to_end(key)
+                _stats["hit"] += 1
+                return hit[0], int(remaining)
+        _stats["miss"] += 1
+    return None
+
+def put_url(key: str, url: str, expires: int):
+    """登记新签的 URL；签出来的对象一定存在，同时记入已知集合"""
+    with _lock:
+        _urls[key] = (url, time.time() + expires, expires)
+        _urls.move_to_end(key)
+        while len(_urls) > SIGN_CACHE_MAX:
+            _urls.popitem(last=False)
+    mark_known(key)
+
+# ========= 已知存在的 key =========
+
+def mark_known(key: str):
+    if not key:
+        return
+    with _lock:
+        _known[key] = True
+        _known.move_to_end(key)
+        while len(_known) > KNOWN_KEYS_MAX:
+            _known.popitem(last=False)
+
+def mark_known_many(keys):
+    for k in keys or []:
+        mark_known(k)
+
+def is_known(key: str) -> bool:
+    with _lock:
+        if key in _known:
+            _stats["known_hit"] += 1
+            return True
+    return False
+
+def forget(key: str):
+    """对象被删除/覆盖时调用"""
+    with _lock:
+        _urls.pop(key, None)
+        _known.pop(key, None)
+
+def stats() -> dict:
+    with _lock:
+        return {**_stats, "urls": len(_urls), "known": len(_known)}
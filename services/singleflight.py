@@ -0,0 +1,49 @@
+# services/singleflight.py
+# 进程内 single-flight：同一 key 的并发调用只执行一次，其余线程等待并共享结果（或异常）
+# 用于 TTS 合成等“贵且幂等”的操作；跨容器的协调见 cos_client 的 COS lease
+
+import threading
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"leaders": 0, "shared": 0}
+
+    def do(self, key, fn, *args, **kwargs):
+        """key 相同的并发调用只执行一次 fn；返回值 / 异常对所有等待者相同"""
+        with self._lock:
+            c = self._calls.get(key)
+            if c is not None:
+                self._stats["shared"] += 1
+                leader = False
+            else:
+                c = self._calls[key] = _Call()
+                self._stats["leaders"] += 1
+                leader = True
+        if not leader:
+            c.done.wait()
+            if c.error is not None:
+                raise c.error
+            return c.result
+        try:
+            c.result = fn(*args, **kwargs)
+            return c.result
+        except Exception as e:
+            c.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            c.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
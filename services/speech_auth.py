@@ -0,0 +1,66 @@
+# services/speech_auth.py
+# Azure 语音鉴权头：key 模式（默认，每次带 Ocp-Apim-Subscription-Key）或 token 模式
+# token 模式：调用 issueToken 换取 Bearer token（有效期 10 分钟），按 (region, key) 缓存在热容器内，
+# TTS（cos_client / tts_azure / index_legacy）与 STT（index_legacy）共用。
+# 换 token 失败时回退到 key 模式，不影响主流程。
+
+import os, time, threading
+import urllib.request
+
+SPEECH_AUTH_MODE = (os.environ.get("SPEECH_AUTH_MODE") or "key").strip().lower()  # key / token
+SPEECH_TOKEN_TTL = float(os.environ.get("SPEECH_TOKEN_TTL", "540"))  # 秒；Azure token 10 分钟有效，留 1 分钟余量
+SPEECH_TOKEN_URL = os.environ.get("SPEECH_TOKEN_URL", "")             # 覆盖 issueToken 地址（私有终结点/本地压测）
+
+_lock = threading.Lock()
+_tokens = {}   # (region, key) -> (expire_at, token)
+_stats = {"issued": 0, "cached": 0, "fallback": 0}
+
+def token_url(region: str) -> str:
+    return SPEECH_TOKEN_URL or f"https://{region}.api.cognitive.microsoft.com/sts/v1.0/issueToken"
+
+def _issue(key: str, region: str) -> str:
+    req = urllib.request.Request(token_url(region), data=b"", method="POST")
+    req.add_header("Ocp-Apim-Subscription-Key", key)
+    req.add_header("Content-Length", "0")
+    with urllib.request.urlopen(req, timeout=10) as r:
+        return r.read().decode("utf-8").strip()
+
+def get_token(key: str, region: str) -> str:
+    """取缓存 token，过期/不存在时重新换取（同一时刻只换一次）"""
+    ck = (region, key)
+    hit = _tokens.get(ck)
+    if hit and hit[0] > time.monotonic():
+        _stats["cached"] += 1
+        return hit[1]
+    with _lock:
+        hit = _tokens.get(ck)
+        if hit and hit[0] > time.monotonic():
+            _stats["cached"] += 1
+            return hit[1]
+        token = _issue(key, region)
+        _tokens[ck] = (time.monotonic() + SPEECH_TOKEN_TTL, token)
+        _stats["issued"] += 1
+        return token
+
+def auth_headers(key: str, region: str) -> dict:
+    """返回鉴权头；token 模式下换 token 失败则回退 key 模式"""
+    if SPEECH_AUTH_MODE == "token":
+        try:
+            return {"Authorization": f"Bearer {get_token(key, region)}"}
+        except Exception:
+            _stats["fallback"] += 1
+    return {"Ocp-Apim-Subscription-Key": key}
+
+def using_token() -> bool:
+    return SPEECH_AUTH_MODE == "token"
+
+def invalidate(key: str = None, region: str = None):
+    """服务端返回 401 时丢弃缓存的 token；不传参数则全部丢弃"""
+    with _lock:
+        if key is None and region is None:
+            _tokens.clear()
+        else:
+            _tokens.pop((region, key), None)
+
+def stats() -> dict:
+    return {"mode": SPEECH_AUTH_MODE, **_stats}
@@ -0,0 +1,218 @@
+# services/submission_index.py
+# 提交的二级索引：assignment_id → 该作业下的提交（每个 submission_id 一行）
+#   db/idx/assignment_submissions/<assignment_id>.ndjson
+#   行：{ submission_id, student_id, status, created_at, updated_at, has_audio?, images?, image_keys?, overall?, scored_at? }
+#   images 是 image_keys（去重的图片 key）的个数：重试的上传/finalize 写同一批 key，不会重复计数
+#   status：uploaded（仅图片）/ pending / scored / stt_failed
+# 提交落盘（create / upload_image / finalize）与评分时维护；老师端“谁交了”只读本作业的索引，
+# 与历史提交总量无关。主数据仍是 db/submissions.ndjson，索引损坏/缺失可用 rebuild() 重建。
+# 列表把索引当权威数据：索引的 upsert 在 db_index 的表 lease 内进行（同班并发提交不丢行），
+# 写失败不吞掉，由调用方（组提交刷出）让请求失败、客户端重试。
+# 另有单条提交记录 db/submissions/<submission_id>.json（详情页用，见 save_record / get_record）。
+
+import os, json, base64, datetime
+from services import db_index
+from services import retry
+from services.circuit import NegativeCache
+
+INDEX_DIR = os.environ.get("SUBMISSION_INDEX_DIR", "db/idx/assignment_submissions")
+db_index.register_leased_prefix(INDEX_DIR + "/")
+RECORD_DIR = "db/submissions"
+LIST_MAX_LIMIT = 200
+# 记录对象缺失时回退扫描 db/submissions.ndjson（早期提交没有记录对象）；
+# 早期提交都补写过记录后设为 0，未知 id 直接 404，不再扫表
+RECORD_FALLBACK = os.environ.get("SUBMISSION_RECORD_FALLBACK", "1").lower() in ("1", "true", "yes")
+RECORD_MISS_TTL = float(os.environ.get("SUBMISSION_RECORD_MISS_TTL", "10"))   # 扫表也没找到的 id，秒
+
+# 扫表未命中的 id：短时间内重复轮询直接返回 None（本容器 save_record 时立即清除；其他容器最多晚 TTL 秒可见）
+_record_miss = NegativeCache(ttl=RECORD_MISS_TTL, max_items=5000)
+_miss_stats = {"scans": 0, "miss_cached": 0}
+
+def _key(assignment_id: str) -> str:
+    return f"{INDEX_DIR}/{assignment_id}.ndjson"
+
+def _now():
+    return datetime.datetime.utcnow().isoformat() + "Z"
+
+# ========= 写入 =========
+
+def _merge_keys(old, new) -> list:
+    """去重合并，保持先后顺序"""
+    out = list(old or [])
+    seen = set(out)
+    for k in new or []:
+        if k and k not in seen:
+            seen.add(k)
+            out.append(k)
+    return out
+
+def record(assignment_id: str, submission_id: str, **fields):
+    """
+    按 submission_id 合并写入一行（不存在则新增）。images 传本次的图片 key 列表，与已有 key 取并集。
+    在表 lease 内读-改-写；失败抛出（组提交开启时在刷出时报错），不做 best-effort。
+    """
+    if not (assignment_id and submission_id):
+        return
+    now = _now()
+
+    def _merge(it):
+        it.setdefault("created_at", fields.get("created_at") or now)
+        for k, v in fields.items():
+            if k == "images":
+                # 旧行只有计数没有 key：取较大值（宁可少算，不重复算），rebuild() 后以 key 为准
+                legacy = 0 if "image_keys" in it else int(it.get("images") or 0)
+                it["image_keys"] = _merge_keys(it.get("image_keys"), v)
+                it["images"] = max(legacy, len(it["image_keys"]))
+            elif v is not None and k != "created_at":
+                it[k] = v
+        it.setdefault("status", "uploaded")   # 只有图片、尚无音频的提交
+        it["updated_at"] = now
+
+    db_index.upsert_json_line(_key(assignment_id), "submission_id", submission_id, _merge)
+
+def _record_key(submission_id: str) -> str:
+    return f"{RECORD_DIR}/{submission_id}.json"
+
+def save_record(submission_id: str, fields: dict):
+    """
+    合并写入单条提交记录（读-改-写）；images 列表做去重追加。
+    与 record() 一样是派生数据：失败只打日志。
+    """
+    if not submission_id:
+        return
+    key = _record_key(submission_id)
+    _record_miss.discard(submission_id)
+    try:
+        try:
+            rec = db_index.read_json(key)
+        except Exception as e:
+            if not retry.is_not_found(e):
+                raise
+            rec = {"submission_id": submission_id}
+        for k, v in fields.items():
+            if k == "images":
+                rec["images"] = _merge_keys(rec.get("images"), v)
+            elif v is not None:
+                rec[k] = v
+        rec["updated_at"] = _now()
+        db_index.write_json(key, rec, best_effort=True)
+    except Exception as e:
+        print(f"[submission_index] record write failed {submission_id}: {e}")
+
+def get_record(submission_id: str):
+    """
+    读单条提交记录（读穿缓存）。记录对象不存在时回退到 db/submissions.ndjson 查找（早期提交，
+    RECORD_FALLBACK 关闭时不查），找到后补写记录对象；都没有返回 None。
+    扫表也没找到的 id 记入负缓存 RECORD_MISS_TTL 秒，未知 id 的重复轮询不会每次全表扫描。
+    """
+    if _record_miss.get(submission_id):
+        _miss_stats["miss_cached"] += 1
+        return None
+    try:
+        return db_index.read_json_cached(_record_key(submission_id))
+    except Exception as e:
+        if not retry.is_not_found(e):
+            raise
+    if not RECORD_FALLBACK:
+        _record_miss.put(submission_id, "not_found")
+        return None
+    _miss_stats["scans"] += 1
+    found = next((x for x in db_index.ndjson_all("db/submissions.ndjson") if x.get("id") == submission_id), None)
+    if found is None:
+        _record_miss.put(submission_id, "not_found")
+        return None
+    rec = {"submission_id": submission_id, **{k: v for k, v in found.items() if k != "id"}}
+    try:
+        db_index.write_json(_record_key(submission_id), rec)
+    except Exception:
+        pass
+    return rec
+
+def record_stats() -> dict:
+    return dict(_miss_stats)
+
+def rebuild(assignment_id: str = None, submissions_key: str = "db/submissions.ndjson",
+            images_key: str = "db/submissions_images.ndjson", results_key: str = "db/results.ndjson") -> dict:
+    """
+    从主表重建索引；assignment_id 为空时重建全部作业。返回 { assignment_id: 行数 }
+    图片数按 submissions_images 行里的 keys 去重；早期没有 keys 的行只能取各行 count 的最大值。
+    """
+    rows = {}   # (aid, sid) -> row
+
+    def _row(aid, sid, created_at):
+        return rows.setdefault((aid, sid), {"submission_id": sid, "created_at": created_at or _now()})
+
+    for s in db_index.ndjson_all(submissions_key):
+        aid, sid = s.get("assignment_id"), s.get("id")
+        if not (aid and sid) or (assignment_id and aid != assignment_id):
+            continue
+        r = _row(aid, sid, s.get("created_at"))
+        r.update({"student_id": s.get("student_id"), "status": s.get("status") or "pending", "has_audio": True})
+    for s in db_index.ndjson_all(images_key):
+        aid, sid = s.get("assignment_id"), s.get("submission_id")
+        if not (aid and sid) or (assignment_id and aid != assignment_id):
+            continue
+        r = _row(aid, sid, s.get("created_at"))
+        r.setdefault("student_id", s.get("student_id"))
+        r.setdefault("status", "uploaded")
+        if s.get("keys"):
+            r["image_keys"] = _merge_keys(r.get("image_keys"), s["keys"])
+        else:
+            r["_legacy_images"] = max(r.get("_legacy_images", 0), int(s.get("count") or 0))
+        r["images"] = max(r.get("_legacy_images", 0), len(r.get("image_keys") or []))
+    by_sid = {sid: r for (_, sid), r in rows.items()}
+    for res in db_index.ndjson_all(results_key):
+        r = by_sid.get(res.get("submission_id"))
+        if r is not None:
+            r.update({"status": res.get("status") or r.get("status"), "overall": res.get("overall"),
+                      "scored_at": res.get("scored_at")})
+
+    grouped = {}
+    for (aid, _), r in rows.items():
+        r.pop("_legacy_images", None)
+        grouped.setdefault(aid, []).append(r)
+    for aid, items in grouped.items():
+        text = "".join(json.dumps(x, ensure_ascii=False) + "\n" for x in items)
+        db_index.write_ndjson(_key(aid), text)
+    return {aid: len(items) for aid, items in grouped.items()}
+
+# ========= 读取 =========
+
+def _encode_cursor(item: dict) -> str:
+    raw = json.dumps([item.get("created_at") or "", item.get("submission_id") or ""]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        pad = "=" * (-len(cursor) % 4)
+        created_at, sid = json.loads(base64.urlsafe_b64decode(cursor + pad))
+        return str(created_at), str(sid)
+    except Exception:
+        raise ValueError("bad cursor")
+
+def list_page(assignment_id: str, cursor: str = None, limit: int = 50, status: str = None,
+              student_id: str = None) -> dict:
+    """
+    最近的在前（created_at 倒序，同一时刻按 submission_id 倒序）；cursor 为上一页最后一条的位置。
+    用位置而非偏移做游标：翻页期间有新提交也不会重复/漏项。
+    返回 { items, nextCursor }
+    """
+    limit = max(1, min(LIST_MAX_LIMIT, int(limit or 50)))
+    after = _decode_cursor(cursor) if cursor else None
+    rows = db_index.ndjson_all(_key(assignment_id))
+    rows.sort(key=lambda x: (x.get("created_at") or "", x.get("submission_id") or ""), reverse=True)
+    items = []
+    for r in rows:
+        pos = (r.get("created_at") or "", r.get("submission_id") or "")
+        if after and pos >= after:
+            continue
+        if status and r.get("status") != status:
+            continue
+        if student_id and r.get("student_id") != student_id:
+            continue
+        items.append(r)
+        if len(items) > limit:
+            break
+    more = len(items) > limit
+    items = items[:limit]
+    return {"items": items, "nextCursor": _encode_cursor(items[-1]) if more else None}
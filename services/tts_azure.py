@@ -5,6 +5,7 @@ import hashlib
 import urllib.request
 import urllib.error
 from typing import Tuple, Dict
+from services import speech_auth
 
 DEFAULT_LANG = os.getenv("DEFAULT_LANG", "en-GB")
 DEFAULT_VOICE = os.getenv("DEFAULT_VOICE", "en-GB-LibbyNeural")
@@ -31,8 +32,9 @@ def _azure_headers(fmt_key: str) -> Dict[str, str]:
     if not SPEECH_KEY:
         raise RuntimeError("SPEECH_KEY not set")
     fmt = FMT_MAP.get(fmt_key, FMT_MAP[DEFAULT_FMT])
+    # 鉴权头：SPEECH_AUTH_MODE=token 时使用缓存的 Bearer token（与 cos_client / legacy 共用）
     return {
-        "Ocp-Apim-Subscription-Key": SPEECH_KEY,
+        **speech_auth.auth_headers(SPEECH_KEY, SPEECH_REGION),
         "Content-Type": "application/ssml+xml",
         "X-Microsoft-OutputFormat": fmt,
         "User-Agent": "scf-homework-api",
@@ -0,0 +1,209 @@
+# services/tts_prewarm.py
+# TTS 预热：把“可能要发布”的词/句提前合成进 tts/ 缓存，第一位发布的老师不再同步等待合成
+# 入口见 index.prewarm_handler（定时触发器 / 手动调用），也可直接调用 run()
+# - 文本来源：显式 words/texts，或按 db/assignments.ndjson 找到的最近作业详情里的条目
+# - 音色/格式组合：TTS_PREWARM_COMBOS + 最近作业里实际出现过的组合（按出现次数取前 TTS_PREWARM_TOP_COMBOS 个）
+# - 并发受 TTS_PREWARM_WORKERS 限制；SCF 剩余时间不足 / Azure 熔断打开时停止提交新任务
+# - dry_run：只 HEAD 判断缓存是否存在，报告将新建多少个 key，不调用 Azure
+
+import os, json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from services import cos_client
+from services import db_index
+from services import retry
+from services import circuit
+
+TTS_PREWARM_WORKERS    = int(os.environ.get("TTS_PREWARM_WORKERS", "4"))
+TTS_PREWARM_RECENT     = int(os.environ.get("TTS_PREWARM_RECENT", "20"))       # 扫描最近多少份作业
+TTS_PREWARM_TOP_COMBOS = int(os.environ.get("TTS_PREWARM_TOP_COMBOS", "3"))
+TTS_PREWARM_MAX_TEXTS  = int(os.environ.get("TTS_PREWARM_MAX_TEXTS", "500"))
+# 逗号分隔的 voice/format，如 "en-GB-LibbyNeural/mp3-16k,en-US-JennyNeural/mp3-24k"；language 取 voice 前两段
+TTS_PREWARM_COMBOS     = os.environ.get("TTS_PREWARM_COMBOS", "en-GB-LibbyNeural/mp3-16k")
+TTS_PREWARM_LIST_MAX   = int(os.environ.get("TTS_PREWARM_LIST_MAX", "1000"))   # 索引为空时按前缀列举的上限
+ASSIGNMENTS_INDEX_KEY  = "db/assignments.ndjson"
+PREWARM_MIN_REMAINING_MS = int(os.environ.get("PREWARM_MIN_REMAINING_MS", "3000"))  # 剩余时间低于该值不再提交
+
+MAX_REPORT_ERRORS = 20
+
+# ========= 组合 / 文本收集 =========
+
+def _combo(voice: str, fmt: str, language: str = None) -> dict:
+    voice = (voice or "").strip()
+    return {
+        "language": language or "-".join(voice.split("-")[:2]) or "en-GB",
+        "voice":    voice or "en-GB-LibbyNeural",
+        "rate":     "+0%",
+        "pitch":    "+0st",
+        "style":    "",
+        "format":   (fmt or "").strip() or "mp3-16k",
+    }
+
+def parse_combos(spec) -> list:
+    """
+    接受 "voice/format,..." 字符串，或 [{"voice","format","language"?}, "voice/format", ...]
+    """
+    if isinstance(spec, str):
+        spec = [x for x in spec.split(",") if x.strip()]
+    out = []
+    for c in spec or []:
+        if isinstance(c, dict):
+            out.append(_combo(c.get("voice"), c.get("format"), c.get("language")))
+        elif isinstance(c, str) and "/" in c:
+            voice, fmt = c.strip().split("/", 1)
+            out.append(_combo(voice, fmt))
+    return out
+
+def _combo_of_key(key: str):
+    """tts/<lang>/<voice>/<fmt>/<sha1>.<ext> → (lang, voice, fmt)"""
+    parts = (key or "").split("/")
+    if len(parts) == 5 and parts[0] == "tts":
+        return parts[1], parts[2], parts[3]
+    return None
+
+def recent_assignment_keys(limit: int = None) -> list:
+    """
+    最近发布的作业详情 key（新的在前）：取 db/assignments.ndjson（发布时追加，天然按时间排序）的末尾若干行，
+    不再列举整个 db/assignments/ 目录；索引为空时退回按前缀列举，最多一页（TTS_PREWARM_LIST_MAX 条）
+    """
+    n = limit or TTS_PREWARM_RECENT
+    keys, seen = [], set()
+    for ln in reversed(db_index.read_lines(ASSIGNMENTS_INDEX_KEY, limit=n * 2)):  # 多取一些，容忍重复/坏行
+        try:
+            aid = (json.loads(ln).get("assignment_id") or "").strip()
+        except Exception:
+            continue
+        if aid and aid not in seen:
+            seen.add(aid)
+            keys.append(f"db/assignments/{aid}.json")
+            if len(keys) >= n:
+                return keys
+    if keys:
+        return keys
+    objs = [o for o in cos_client.list_objects("db/assignments/", limit=TTS_PREWARM_LIST_MAX) if o["key"].endswith(".json")]
+    objs.sort(key=lambda o: o["last_modified"], reverse=True)
+    return [o["key"] for o in objs[:n]]
+
+def scan_recent(limit: int = None):
+    """
+    返回 (texts, combo_counter)：最近作业里的文本（去重、保序），以及实际使用过的 (lang, voice, fmt) 计数
+    """
+    texts, seen, combos = [], set(), Counter()
+    for key in recent_assignment_keys(limit):
+        try:
+            doc = db_index.read_json(key)
+        except Exception:
+            continue
+        for it in (doc or {}).get("items") or []:
+            tx = (it.get("text") or "").strip()
+            if tx and tx.lower() not in seen:
+                seen.add(tx.lower())
+                texts.append(tx)
+            c = _combo_of_key(it.get("audio_cos_key"))
+            if c:
+                combos[c] += 1
+    return texts, combos
+
+# ========= 主流程 =========
+
+def run(texts=None, combos=None, recent: int = None, dry_run: bool = False, workers: int = None) -> dict:
+    """
+    入参:
+      texts:   显式文本列表；为空时扫描最近作业
+      combos:  音色/格式组合（见 parse_combos）；为空时用 TTS_PREWARM_COMBOS + 最近作业的常用组合
+      recent:  扫描最近多少份作业
+      dry_run: 只统计，不合成
+    返回:
+      { dry_run, texts, combos, candidates, cached, would_create | created, failed, skipped, errors }
+    """
+    used = Counter()
+    if not texts:
+        texts, used = scan_recent(recent)
+    texts = [str(t).strip() for t in texts if str(t or "").strip()][:TTS_PREWARM_MAX_TEXTS]
+
+    combo_list = parse_combos(combos) if combos else parse_combos(TTS_PREWARM_COMBOS)
+    if not combos:
+        for (lang, voice, fmt), _ in used.most_common(TTS_PREWARM_TOP_COMBOS):
+            combo_list.append(_combo(voice, fmt, lang))
+    uniq = {}
+    for c in combo_list:
+        uniq.setdefault((c["language"], c["voice"], c["format"]), c)
+    combo_list = list(uniq.values())
+
+    # 同一 key 只处理一次（不同写法的同一单词归一化后指纹相同）
+    jobs = {}
+    for c in combo_list:
+        for t in texts:
+            key, _ = cos_client.tts_cache_key(t, c)
+            jobs.setdefault(key, (t, c))
+
+    report = {
+        "dry_run": bool(dry_run),
+        "texts": len(texts),
+        "combos": [f"{c['voice']}/{c['format']}" for c in combo_list],
+        "candidates": len(jobs),
+        "cached": 0, "failed": 0, "skipped": 0,
+        "would_create" if dry_run else "created": 0,
+        "errors": [],
+    }
+
+    def _one(key, text, tts):
+        if cos_client.cos_exists(key):
+            return "cached", None
+        if dry_run:
+            return "would_create", None
+        cos_client.tts_synthesize_cached(text, tts)
+        return "created", None
+
+    def _stop() -> bool:
+        left = retry.remaining_ms()
+        return left is not None and left < PREWARM_MIN_REMAINING_MS
+
+    # 分批提交：每批最多 workers 个，批间检查剩余时间 / 熔断，避免排队的任务撞上函数超时
+    n = max(1, workers or TTS_PREWARM_WORKERS)
+    items = list(jobs.items())
+    with ThreadPoolExecutor(max_workers=n) as ex:
+        for i in range(0, len(items), n):
+            if _stop() or (not dry_run and cos_client.speech_breaker_open()):
+                report["skipped"] += len(items) - i
+                break
+            futs = [(key, ex.submit(_one, key, t, c)) for key, (t, c) in items[i:i + n]]
+            for key, f in futs:
+                try:
+                    status, _ = f.result()
+                    report[status] += 1
+                except circuit.CircuitOpen as e:
+                    report["skipped"] += 1
+                    if len(report["errors"]) < MAX_REPORT_ERRORS:
+                        report["errors"].append({"key": key, "error": str(e)})
+                except Exception as e:
+                    report["failed"] += 1
+                    if len(report["errors"]) < MAX_REPORT_ERRORS:
+                        report["errors"].append({"key": key, "error": str(e)})
+    return report
+
+def run_event(event) -> dict:
+    """
+    兼容触发来源：
+      - 直接调用：{ words|texts, combos, recent, dry_run, workers }
+      - 定时触发器：{ "Type":"Timer", "Message": "<同上 JSON>" }
+      - API 网关：body 为上述 JSON
+    """
+    ev = event if isinstance(event, dict) else {}
+    payload = ev
+    for field in ("Message", "body"):
+        raw = ev.get(field)
+        if isinstance(raw, str) and raw.strip().startswith("{"):
+            try:
+                payload = json.loads(raw)
+            except Exception:
+                payload = {}
+            break
+    dry = payload.get("dry_run")
+    return run(
+        texts=payload.get("words") or payload.get("texts"),
+        combos=payload.get("combos"),
+        recent=int(payload.get("recent") or 0) or None,
+        dry_run=dry in (True, 1) or str(dry).lower() in ("1", "true", "yes"),
+        workers=int(payload.get("workers") or 0) or None,
+    )
@@ -0,0 +1,101 @@
+# tests/conftest.py
+# 单元测试公用夹具：内存版 COS（替换 cos_client 的共享客户端），不依赖 qcloud_cos、不访问网络
+
+import os, sys, io, hashlib, threading
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+os.environ.setdefault("COS_BUCKET", "test-bucket")
+os.environ.setdefault("COS_REGION", "ap-test")
+
+class CosError(Exception):
+    """与 qcloud_cos.CosServiceError 相同的取值接口（retry.status_of / is_not_found 依赖）"""
+    def __init__(self, status: int, code: str = "Err"):
+        super().__init__(f"{status} {code}")
+        self._status, self._code = status, code
+
+    def get_status_code(self):
+        return self._status
+
+    def get_error_code(self):
+        return self._code
+
+class _Body:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def get_raw_stream(self):
+        return io.BytesIO(self._data)
+
+class MemoryCos:
+    """CosS3Client 的最小内存实现：ETag 为内容 md5；If-Match 不符 412，If-None-Match 相符按 SDK 行为返回同 ETag 空 body"""
+    def __init__(self):
+        self.store = {}
+        self.calls = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def etag(data: bytes) -> str:
+        return '"%s"' % hashlib.md5(data).hexdigest()
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self.store:
+                raise CosError(404, "NoSuchKey")
+            return self.store[key]
+
+    def put_object(self, Bucket, Key, Body, **kw):
+        self.calls.append(("put", Key))
+        data = Body.encode("utf-8") if isinstance(Body, str) else bytes(Body)
+        with self._lock:
+            if (kw.get("Metadata") or {}).get("x-cos-forbid-overwrite") == "true" and Key in self.store:
+                raise CosError(409, "PathConflict")
+            self.store[Key] = data
+        return {"ETag": self.etag(data)}
+
+    def get_object(self, Bucket, Key, Range=None, IfMatch=None, IfNoneMatch=None, **kw):
+        self.calls.append(("get", Key))
+        data = self._get(Key)
+        tag = self.etag(data)
+        if IfMatch and IfMatch != tag:
+            raise CosError(412, "PreconditionFailed")
+        if IfNoneMatch and IfNoneMatch == tag:
+            return {"ETag": tag, "Body": _Body(b"")}
+        if Range:
+            start, end = Range[len("bytes="):].split("-")
+            data = data[int(start):int(end) + 1]
+        return {"ETag": tag, "Body": _Body(data)}
+
+    def head_object(self, Bucket, Key, **kw):
+        self.calls.append(("head", Key))
+        data = self._get(Key)
+        return {"Content-Length": str(len(data)), "ETag": self.etag(data)}
+
+    def delete_object(self, Bucket, Key, **kw):
+        self.calls.append(("delete", Key))
+        with self._lock:
+            self.store.pop(Key, None)
+        return {}
+
+    def list_objects(self, Bucket, Prefix="", Marker="", MaxKeys=1000, **kw):
+        self.calls.append(("list", Prefix))
+        with self._lock:
+            keys = sorted(k for k in self.store if k.startswith(Prefix) and k > Marker)
+            page = keys[:MaxKeys]
+            contents = [{"Key": k, "Size": str(len(self.store[k])), "LastModified": ""} for k in page]
+        return {"Contents": contents, "IsTruncated": "true" if len(keys) > MaxKeys else "false",
+                "NextMarker": page[-1] if page else ""}
+
+    def ops(self, op: str) -> list:
+        return [k for o, k in self.calls if o == op]
+
+@pytest.fixture
+def cos(monkeypatch):
+    """每个用例一个空的内存 COS；同时清掉进程内与 COS 内容相关的缓存"""
+    from services import cos_client, db_index
+    fake = MemoryCos()
+    monkeypatch.setattr(cos_client, "_cos", fake)
+    db_index.invalidate_cached()
+    return fake
@@ -0,0 +1,41 @@
+# Base64 分块解码（index_legacy.b64_decoded_len / iter_b64_decode / b64_is_valid）
+
+import base64, binascii, os
+import pytest
+
+import index_legacy as L
+
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 4, 5, 1000, 1001, 1002])
+def test_decoded_len_matches_actual_length(n):
+    raw = os.urandom(n)
+    assert L.b64_decoded_len(base64.b64encode(raw).decode("ascii")) == n
+
+def test_decoded_len_empty_and_none():
+    assert L.b64_decoded_len("") == 0
+    assert L.b64_decoded_len(None) == 0
+
+@pytest.mark.parametrize("chunk", [4, 8, 12, 256])
+@pytest.mark.parametrize("n", [0, 1, 2, 3, 97, 300])
+def test_iter_decode_round_trip_across_chunk_sizes(n, chunk):
+    raw = os.urandom(n)
+    b64 = base64.b64encode(raw).decode("ascii")
+    assert b"".join(L.iter_b64_decode(b64, validate=True, chunk_chars=chunk)) == raw
+
+def test_iter_decode_drops_non_alphabet_chars_when_not_validating():
+    raw = os.urandom(200)
+    b64 = base64.b64encode(raw).decode("ascii")
+    noisy = "\n".join(b64[i:i + 7] for i in range(0, len(b64), 7))   # 换行跨越分块边界
+    assert b"".join(L.iter_b64_decode(noisy, chunk_chars=8)) == raw == base64.b64decode(noisy)
+
+def test_iter_decode_validate_rejects_non_alphabet_chars():
+    with pytest.raises(binascii.Error):
+        list(L.iter_b64_decode("QUJD\nREVG", validate=True, chunk_chars=4))
+
+def test_iter_decode_bad_padding_raises():
+    with pytest.raises(binascii.Error):
+        list(L.iter_b64_decode("QUJDRA", chunk_chars=4))
+
+def test_b64_is_valid():
+    assert L.b64_is_valid(base64.b64encode(b"hello").decode("ascii"))
+    assert not L.b64_is_valid("not base64!")
+    assert not L.b64_is_valid("QUJDRA")
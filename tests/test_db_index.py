@@ -0,0 +1,178 @@
+# db_index：NDJSON 存储格式（gzip 魔数识别 / 分段追加）
+
+import gzip, json
+import pytest
+
+from services import db_index
+
+KEY = "db/t.ndjson"
+
+def _rows(n, start=0):
+    return [{"id": f"r{i}", "n": i} for i in range(start, start + n)]
+
+def _text(rows):
+    return "".join(json.dumps(r) + "\n" for r in rows)
+
+# ========= gzip 魔数识别 =========
+
+def test_decode_plain_passthrough():
+    assert db_index._decode(b'{"a":1}\n') == (b'{"a":1}\n', 0)
+
+def test_decode_multi_member_gzip():
+    raw = gzip.compress(b"a\n") + gzip.compress(b"b\n") + gzip.compress(b"c\n")
+    assert db_index._decode(raw) == (b"a\nb\nc\n", 3)
+
+def test_plain_text_starting_like_magic_byte_is_not_gzip():
+    # 只有 \x1f\x8b 两个字节才算 gzip；单个 \x1f 开头的明文原样返回
+    assert db_index._decode(b"\x1fabc\n") == (b"\x1fabc\n", 0)
+
+def test_reads_gzip_and_plain_tables_regardless_of_setting(cos, monkeypatch):
+    rows = _rows(3)
+    cos.store[KEY] = gzip.compress(_text(rows).encode("utf-8"))
+    cos.store["db/plain.ndjson"] = _text(rows).encode("utf-8")
+    for flag in (False, True):
+        monkeypatch.setattr(db_index, "NDJSON_GZIP", flag)
+        assert db_index.ndjson_all(KEY) == rows
+        assert db_index.ndjson_all("db/plain.ndjson") == rows
+
+def test_gzip_append_adds_one_member_per_append(cos, monkeypatch):
+    monkeypatch.setattr(db_index, "NDJSON_GZIP", True)
+    for r in _rows(3):
+        db_index.append_json_line(KEY, r)
+    raw = cos.store[KEY]
+    assert raw.startswith(b"\x1f\x8b")
+    assert db_index._decode(raw)[1] == 3
+    assert db_index.ndjson_all(KEY) == _rows(3)
+
+def test_gzip_append_recompresses_past_max_segments(cos, monkeypatch):
+    monkeypatch.setattr(db_index, "NDJSON_GZIP", True)
+    monkeypatch.setattr(db_index, "NDJSON_MAX_SEGMENTS", 3)
+    for r in _rows(5):
+        db_index.append_json_line(KEY, r)
+    assert db_index._decode(cos.store[KEY])[1] < 3
+    assert db_index.ndjson_all(KEY) == _rows(5)
+
+def test_plain_append_to_gzip_table_writes_back_plain(cos, monkeypatch):
+    cos.store[KEY] = gzip.compress(_text(_rows(2)).encode("utf-8"))
+    monkeypatch.setattr(db_index, "NDJSON_GZIP", False)
+    db_index.append_json_line(KEY, {"id": "r2", "n": 2})
+    assert not cos.store[KEY].startswith(b"\x1f\x8b")
+    assert db_index.ndjson_all(KEY) == _rows(3)
+
+# ========= 组提交 =========
+
+from concurrent.futures import ThreadPoolExecutor
+from services import db_unit
+
+@pytest.fixture
+def unit(monkeypatch):
+    """开启一个调用级作用域，结束时关闭（未刷出的缓冲随作用域丢弃）"""
+    monkeypatch.setattr(db_index, "DB_GROUP_COMMIT", True)
+    token = db_unit.begin()
+    yield
+    db_unit.end(token)
+
+def test_writes_are_buffered_until_flush(cos, unit):
+    db_index.append_json_line(KEY, {"id": "a"})
+    db_index.append_json_line(KEY, {"id": "b"})
+    db_index.upsert_json_line(KEY, "id", "a", lambda it: it.update(n=1))
+    db_index.write_json("db/x.json", {"v": 1})
+    db_index.write_json("db/x.json", {"v": 2})
+    assert cos.ops("put") == []
+
+    report = db_index.flush_unit()
+    assert report["keys"] == 2 and report["ops"] == 5 and report["errors"] == []
+    assert sorted(cos.ops("put")) == [KEY, "db/x.json"]   # 每个 key 只写一次
+    assert db_index.ndjson_all(KEY) == [{"id": "a", "n": 1}, {"id": "b"}]
+    assert json.loads(cos.store["db/x.json"]) == {"v": 2}
+
+def test_read_your_writes_flushes_only_that_key(cos, unit):
+    db_index.append_json_line(KEY, {"id": "a"})
+    db_index.write_json("db/x.json", {"v": 1})
+    assert db_index.read_lines(KEY) == ['{"id": "a"}']
+    assert cos.ops("put") == [KEY]
+    assert db_index.read_json("db/x.json") == {"v": 1}
+    assert db_index.flush_unit()["keys"] == 0
+
+def test_writes_after_flush_go_straight_through(cos, unit):
+    db_index.flush_unit()
+    db_index.append_json_line(KEY, {"id": "a"})
+    assert cos.ops("put") == [KEY]
+
+def test_workers_join_the_scope_only_when_propagated(cos, unit):
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        ex.submit(db_unit.propagate(db_index.append_json_line), KEY, {"id": "a"}).result()
+        assert cos.ops("put") == []
+        ex.submit(db_index.append_json_line, "db/other.ndjson", {"id": "b"}).result()
+    assert cos.ops("put") == ["db/other.ndjson"]
+    db_index.flush_unit()
+    assert db_index.ndjson_all(KEY) == [{"id": "a"}]
+
+def test_scopes_are_isolated_per_context(cos, unit):
+    import contextvars
+    db_index.append_json_line(KEY, {"id": "a"})
+
+    def other_invocation():
+        token = db_unit.begin()
+        try:
+            db_index.append_json_line("db/other.ndjson", {"id": "b"})
+            return db_index.flush_unit()["keys"]
+        finally:
+            db_unit.end(token)
+    assert contextvars.copy_context().run(other_invocation) == 1
+    assert cos.ops("put") == ["db/other.ndjson"]
+    assert db_index.flush_unit()["keys"] == 1
+
+def test_commit_raises_on_failed_write_and_keeps_scope_open(cos, unit, monkeypatch):
+    db_index.append_json_line(KEY, {"id": "a"})
+    monkeypatch.setattr(db_index, "_append_bytes", lambda key, data: (_ for _ in ()).throw(IOError("down")))
+    with pytest.raises(RuntimeError):
+        db_index.commit()
+    db_index.append_json_line(KEY, {"id": "b"}, best_effort=True)
+    assert db_index.commit()["errors"][0]["best_effort"] is True
+
+# ========= 追加旁路（spool） =========
+
+SPOOL_KEY = "db/spooled.ndjson"
+
+@pytest.fixture
+def spooled(monkeypatch):
+    monkeypatch.setitem(db_index.DB_SPOOL_KEYS, SPOOL_KEY, "id")
+
+def _segments(cos):
+    return sorted(k for k in cos.store if k.startswith(db_index._spool_dir(SPOOL_KEY)))
+
+def test_spool_append_writes_segment_not_main_table(cos, spooled):
+    db_index.append_json_line(SPOOL_KEY, {"id": "a"})
+    db_index.append_json_line(SPOOL_KEY, {"id": "b"})
+    assert SPOOL_KEY not in cos.store and len(_segments(cos)) == 2
+    assert [r["id"] for r in db_index.ndjson_all(SPOOL_KEY)] == ["a", "b"]
+
+def test_rows_without_id_bypass_spool(cos, spooled):
+    db_index.append_json_line(SPOOL_KEY, {"x": 1})
+    assert _segments(cos) == [] and db_index.ndjson_all(SPOOL_KEY) == [{"x": 1}]
+
+def test_merge_is_idempotent_and_dedups_by_id(cos, spooled):
+    cos.store[SPOOL_KEY] = b'{"id": "a"}\n'
+    for r in ({"id": "a"}, {"id": "b"}, {"id": "c"}):
+        db_index.append_json_line(SPOOL_KEY, r)
+    stale = {k: cos.store[k] for k in _segments(cos)}
+
+    assert db_index.merge_spool(SPOOL_KEY) == {"key": SPOOL_KEY, "segments": 3, "lines": 2}
+    assert _segments(cos) == []
+    # 删除分段失败 / 并发合并重复执行：分段行的 id 已在主表，不会多出行
+    cos.store.update(stale)
+    assert db_index.merge_spool(SPOOL_KEY)["lines"] == 0
+    assert [r["id"] for r in db_index.ndjson_all(SPOOL_KEY)] == ["a", "b", "c"]
+
+def test_read_between_merge_steps_sees_each_row_once(cos, spooled):
+    db_index.append_json_line(SPOOL_KEY, {"id": "a"})
+    seg = _segments(cos)[0]
+    cos.store[SPOOL_KEY] = cos.store[seg]   # 已写进主表、分段尚未删除
+    assert [r["id"] for r in db_index.ndjson_all(SPOOL_KEY)] == ["a"]
+
+def test_upsert_merges_spool_first(cos, spooled):
+    db_index.append_json_line(SPOOL_KEY, {"id": "a"})
+    db_index.upsert_json_line(SPOOL_KEY, "id", "a", lambda it: it.update(n=1))
+    assert _segments(cos) == []
+    assert db_index.ndjson_all(SPOOL_KEY) == [{"id": "a", "n": 1}]
@@ -0,0 +1,100 @@
+# results_snapshot：列偏移 / Range 读取与快照被重建后的 412 重载
+
+import json, math
+import pytest
+
+from services import results_snapshot as rs
+
+def _put_results(cos, rows):
+    cos.store["db/results.ndjson"] = "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+
+ROWS = [
+    {"submission_id": "s1", "assignment_id": "a1", "overall": 80, "wer": 0.10, "scored_at": "2025-01-01T00:00:00Z"},
+    {"submission_id": "s2", "assignment_id": "a2", "overall": 60, "wer": 0.35},
+    {"submission_id": "s3", "assignment_id": "a1", "overall": None, "wer": None},
+    {"submission_id": "s1", "assignment_id": "a1", "overall": 90, "wer": 0.05},   # 同一 id 以最后一行为准
+]
+
+@pytest.fixture(autouse=True)
+def _fresh():
+    rs.invalidate()
+    yield
+    rs.invalidate()
+
+def _col(values):
+    return [v for v in (values.tolist() if hasattr(values, "tolist") else list(values))]
+
+def test_build_and_load_columns(cos):
+    _put_results(cos, ROWS)
+    assert rs.build()["rows"] == 3
+    cols = rs.load(["submission_id", "assignment_id", "overall", "wer", "scored_at"])
+    assert cols["_rows"] == 3
+    assert cols["submission_id"] == ["s1", "s2", "s3"]
+    names = cols["_dict"]["assignment_id"]
+    assert [names[c] for c in _col(cols["assignment_id"])] == ["a1", "a2", "a1"]
+    overall = _col(cols["overall"])
+    assert overall[:2] == [90.0, 60.0] and math.isnan(overall[2])
+    assert _col(cols["scored_at"]) == [0, 0, 0]   # s1 以最后一行为准，没有 scored_at
+
+def test_column_reads_fetch_exactly_their_byte_range(cos, monkeypatch):
+    _put_results(cos, ROWS)
+    rs.build()
+    head, _ = rs._read_header()
+    meta = head["columns"]["wer"]
+    ranges = []
+    real = rs.cos_client.get_range
+
+    def spy(key, start, length, **kw):
+        ranges.append((start, length))
+        return real(key, start, length, **kw)
+    monkeypatch.setattr(rs.cos_client, "get_range", spy)
+
+    cols = rs.load(["wer"])
+    assert ranges[0] == (0, rs._HEAD_PROBE)
+    assert ranges[1] == (head["data_start"] + meta["offset"], meta["length"])
+    assert meta["length"] == 4 * 3   # float32 × 3 行
+    assert len(ranges) == 2
+    data = cos.store[rs.SNAPSHOT_KEY]
+    assert data[ranges[1][0]:ranges[1][0] + ranges[1][1]] == rs._pack("f", _col(cols["wer"]))
+
+    # 已读列在缓存内：再读不发请求
+    rs.load(["wer"])
+    assert len(ranges) == 2
+
+def test_header_longer_than_probe_is_completed_with_if_match(cos, monkeypatch):
+    _put_results(cos, ROWS)
+    rs.build()
+    monkeypatch.setattr(rs, "_HEAD_PROBE", 16)
+    head, etag = rs._read_header()
+    assert head["rows"] == 3
+    assert etag == cos.etag(cos.store[rs.SNAPSHOT_KEY])
+    assert cos.ops("get").count(rs.SNAPSHOT_KEY) == 2
+
+def test_rebuilt_snapshot_412_reloads_header_and_columns(cos):
+    _put_results(cos, ROWS)
+    rs.build()
+    rs.load(["overall"])            # 缓存旧版本的头
+    stale = rs._snap
+
+    # 其他容器重建：行数与列偏移都变了，本容器缓存未失效
+    _put_results(cos, ROWS + [{"submission_id": "s4", "assignment_id": "a3", "overall": 70, "wer": 0.2}])
+    rs.build()
+    rs._snap = stale
+
+    cols = rs.load(["wer", "submission_id"])
+    assert cols["_rows"] == 4
+    assert cols["submission_id"] == ["s1", "s2", "s3", "s4"]
+    assert rs._snap is not stale
+
+def test_non_412_errors_are_not_retried(cos):
+    with pytest.raises(Exception) as ei:
+        rs.load(["wer"])
+    assert rs.retry.is_not_found(ei.value)
+
+def test_assignment_stats(cos):
+    _put_results(cos, ROWS)
+    rs.build()
+    st = rs.assignment_stats()
+    assert st["a1"]["count"] == 2 and st["a1"]["scored"] == 1 and st["a1"]["avg_overall"] == 90.0
+    assert st["a2"]["wer"]["n"] == 1 and st["a2"]["wer"]["hist"][3] == 1
+    assert rs.assignment_stats("nope") == {}
@@ -0,0 +1,72 @@
+# submission_index：按作业索引的写入与游标分页
+
+import json
+import pytest
+
+from services import submission_index as si
+
+AID = "A1"
+
+def _seed(cos, rows):
+    cos.store[si._key(AID)] = "".join(json.dumps(r) + "\n" for r in rows).encode("utf-8")
+
+def _row(sid, created_at, **kw):
+    return {"submission_id": sid, "student_id": kw.pop("student_id", "S" + sid), "status": "pending",
+            "created_at": created_at, **kw}
+
+def _all_pages(limit, **kw):
+    out, cursor = [], None
+    while True:
+        page = si.list_page(AID, cursor=cursor, limit=limit, **kw)
+        out.extend(r["submission_id"] for r in page["items"])
+        cursor = page["nextCursor"]
+        if not cursor:
+            return out
+
+def test_newest_first_with_submission_id_tiebreak(cos):
+    _seed(cos, [_row("b", "2025-01-01T00:00:01Z"), _row("a", "2025-01-01T00:00:02Z"),
+                _row("c", "2025-01-01T00:00:01Z"), _row("d", "2025-01-01T00:00:00Z")])
+    page = si.list_page(AID, limit=10)
+    assert [r["submission_id"] for r in page["items"]] == ["a", "c", "b", "d"]
+    assert page["nextCursor"] is None
+
+@pytest.mark.parametrize("limit", [1, 2, 3, 7])
+def test_cursor_walks_every_row_once(cos, limit):
+    rows = [_row(f"s{i:02d}", f"2025-01-01T00:00:{i // 2:02d}Z") for i in range(7)]   # 成对的同一时刻
+    _seed(cos, rows)
+    want = [r["submission_id"] for r in sorted(rows, key=lambda r: (r["created_at"], r["submission_id"]),
+                                                 reverse=True)]
+    assert _all_pages(limit) == want
+
+def test_new_rows_between_pages_do_not_shift_cursor(cos):
+    rows = [_row(f"s{i}", f"2025-01-01T00:00:0{i}Z") for i in range(5)]
+    _seed(cos, rows)
+    first = si.list_page(AID, limit=2)
+    assert [r["submission_id"] for r in first["items"]] == ["s4", "s3"]
+    _seed(cos, rows + [_row("new", "2025-01-01T00:00:09Z")])   # 翻页期间有新提交
+    rest = si.list_page(AID, cursor=first["nextCursor"], limit=10)
+    assert [r["submission_id"] for r in rest["items"]] == ["s2", "s1", "s0"]
+
+def test_filters_apply_before_limit(cos):
+    _seed(cos, [_row("s1", "2025-01-01T00:00:01Z", status="scored"),
+                _row("s2", "2025-01-01T00:00:02Z"),
+                _row("s3", "2025-01-01T00:00:03Z", status="scored", student_id="X")])
+    assert _all_pages(1, status="scored") == ["s3", "s1"]
+    assert _all_pages(1, student_id="X") == ["s3"]
+
+def test_bad_cursor_and_limit_clamp(cos):
+    _seed(cos, [_row(f"s{i:03d}", "2025-01-01T00:00:00Z") for i in range(si.LIST_MAX_LIMIT + 5)])
+    with pytest.raises(ValueError):
+        si.list_page(AID, cursor="not-a-cursor")
+    assert len(si.list_page(AID, limit=10_000)["items"]) == si.LIST_MAX_LIMIT
+    assert len(si.list_page(AID, limit=0)["items"]) == 50
+
+def test_record_merges_by_submission_id_under_lease(cos):
+    si.record(AID, "s1", student_id="S1", images=["k1"])
+    si.record(AID, "s1", images=["k1", "k2"], status="pending")
+    si.record(AID, "s2", student_id="S2")
+    rows = {r["submission_id"]: r for r in si.list_page(AID, limit=10)["items"]}
+    assert rows["s1"]["image_keys"] == ["k1", "k2"] and rows["s1"]["images"] == 2
+    assert rows["s1"]["status"] == "pending" and rows["s2"]["status"] == "uploaded"
+    lease = [k for k in cos.ops("put") if k.endswith(".lock")]
+    assert len(lease) == 3 and not any(k.endswith(".lock") for k in cos.store)
@@ -0,0 +1,108 @@
+# tools/bench_speech_auth.py
+# Azure 语音鉴权方式的延迟对比：key 模式（每次带 Ocp-Apim-Subscription-Key）vs token 模式（缓存 Bearer token）
+# 用本地 http.server 冒充 issueToken 与 TTS 终结点，不访问 Azure、不需要 COS：
+#   - 带订阅 key 的请求：模拟服务端逐次校验 key，耗时 --key-validate-ms
+#   - 带 Bearer token 的请求：token 由本地签发，只做一次字典查找
+# 走的是线上同一条代码路径（services.cos_client._azure_tts_request + services.speech_auth）。
+#
+# 用法（仓库根目录）：
+#   python tools/bench_speech_auth.py [--calls 200] [--key-validate-ms 15]
+
+import os, sys, time, json, uuid, argparse, threading, statistics
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_KEY = "bench-subscription-key"
+_tokens = set()
+_counts = {"issue": 0, "tts_key": 0, "tts_token": 0, "unauthorized": 0}
+_key_validate_s = 0.015
+
+class _StandIn(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"   # 保持连接，和线上连接复用一致
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code: int, body: bytes, ctype: str = "application/octet-stream"):
+        self.send_response(code)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        if n:
+            self.rfile.read(n)
+        if self.path.startswith("/sts/v1.0/issueToken"):
+            if self.headers.get("Ocp-Apim-Subscription-Key") != _KEY:
+                return self._reply(401, b"bad key", "text/plain")
+            time.sleep(_key_validate_s)
+            token = uuid.uuid4().hex
+            _tokens.add(token)
+            _counts["issue"] += 1
+            return self._reply(200, token.encode("utf-8"), "text/plain")
+        if self.path.startswith("/tts"):
+            auth = self.headers.get("Authorization") or ""
+            if auth.startswith("Bearer ") and auth[7:] in _tokens:
+                _counts["tts_token"] += 1
+            elif self.headers.get("Ocp-Apim-Subscription-Key") == _KEY:
+                time.sleep(_key_validate_s)   # 服务端逐次校验订阅 key
+                _counts["tts_key"] += 1
+            else:
+                _counts["unauthorized"] += 1
+                return self._reply(401, b"unauthorized", "text/plain")
+            return self._reply(200, b"\xff\xf3" + b"\x00" * 2046, "audio/mpeg")
+        self._reply(404, b"not found", "text/plain")
+
+def _run(mode: str, calls: int) -> dict:
+    from services import cos_client, speech_auth
+    speech_auth.SPEECH_AUTH_MODE = mode
+    speech_auth.invalidate()
+    before = dict(speech_auth.stats())
+    lat = []
+    for i in range(calls):
+        t = time.perf_counter()
+        with cos_client._azure_tts_request(f"benchmark sentence {i}", {}) as r:
+            r.content
+        lat.append((time.perf_counter() - t) * 1000)
+    after = speech_auth.stats()
+    lat.sort()
+    return {
+        "mode": mode,
+        "calls": calls,
+        "median_ms": round(statistics.median(lat), 2),
+        "p95_ms": round(lat[min(len(lat) - 1, int(len(lat) * 0.95))], 2),
+        "mean_ms": round(statistics.fmean(lat), 2),
+        "tokens_issued": after["issued"] - before["issued"],
+        "token_cache_hits": after["cached"] - before["cached"],
+    }
+
+def main():
+    global _key_validate_s
+    ap = argparse.ArgumentParser(description="key vs token 鉴权延迟对比（本地替身服务器）")
+    ap.add_argument("--calls", type=int, default=200)
+    ap.add_argument("--key-validate-ms", type=float, default=15.0, help="替身服务器校验一次订阅 key 的耗时")
+    args = ap.parse_args()
+    _key_validate_s = args.key_validate_ms / 1000.0
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    # cos_client / speech_auth 在 import 时读取这些配置
+    os.environ["SPEECH_KEY"] = _KEY
+    os.environ["SPEECH_TTS_URL"] = base + "/tts"
+    os.environ["SPEECH_TOKEN_URL"] = base + "/sts/v1.0/issueToken"
+
+    try:
+        _run("key", min(10, args.calls))   # 预热：import、建连
+        out = [_run("key", args.calls), _run("token", args.calls)]
+    finally:
+        server.shutdown()
+    print(json.dumps({"key_validate_ms": args.key_validate_ms, "results": out, "server": _counts},
+                     ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()